@@ -0,0 +1,280 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Benchmarks for the Nationalmuseum batch processing.
+
+usage:
+    python Nationalmuseum/benchmark.py [OPTIONS]
+
+&params;
+    -memory to compare the per-record footprint of InfoEntry objects with
+        and without the raw xml tree being retained (default benchmark)
+    -sparql to compare the speed and memory use of the current and the
+        original NatmusInfo.clean_sparql_output on synthetic data
+    -dir:PATH path to the directory containing the xml files, relative to
+        the main directory (default: the one used by pre_process)
+    -dump:PATH path to a single xml file (optionally .gz or .bz2) with all
+        records, used instead of -dir
+    -limit:N the maximum number of records to use (default: 3000)
+    -rows:N the number of synthetic rows for -sparql (default: 100000)
+"""
+import itertools
+import os
+import random
+import sys
+import time
+
+import pywikibot
+
+import batchupload.common as common
+
+import pre_process
+from make_Natmus_info import NatmusInfo
+
+DEFAULT_LIMIT = 3000
+DEFAULT_ROWS = 100000
+REPEATS = 3  # number of timed runs, the fastest of which is reported
+ENTITY_URL = u'http://www.wikidata.org/entity/'
+
+
+def deep_getsizeof(obj, seen=None):
+    """
+    Return the approximate memory footprint of an object and its contents.
+
+    Objects referenced more than once, e.g. shared by several entries, are
+    only counted the first time they are encountered.
+
+    @param obj: the object to measure
+    @param seen: set of ids of already measured objects
+    @return: int
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.iteritems():
+            size += deep_getsizeof(k, seen) + deep_getsizeof(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for v in obj:
+            size += deep_getsizeof(v, seen)
+    elif not isinstance(obj, basestring):
+        if hasattr(obj, '__dict__'):
+            size += deep_getsizeof(obj.__dict__, seen)
+        for slot in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, slot):
+                size += deep_getsizeof(getattr(obj, slot), seen)
+    return size
+
+
+def load_records(xml_dir=None, dump=None, limit=DEFAULT_LIMIT):
+    """
+    Load the xml data for up to limit records.
+
+    @param xml_dir: path to the directory containing the xml files
+    @param dump: path to a single xml file containing all records
+    @param limit: the maximum number of records to load
+    @return: list of loaded xml data
+    """
+    if dump:
+        records = pre_process.load_dump(dump)
+    else:
+        filenames = sorted(
+            filename for filename in os.listdir(xml_dir)
+            if filename.endswith('.xml'))
+        records = (pre_process.load_xml(os.path.join(xml_dir, filename))
+                   for filename in filenames)
+    return list(itertools.islice(records, limit))
+
+
+def make_entries(records):
+    """
+    Create an InfoEntry, retaining the raw xml tree, for each valid record.
+
+    @param records: list of loaded xml data
+    @return: list of InfoEntry
+    """
+    entries = []
+    for xml_data in records:
+        try:
+            entries.append(pre_process.InfoEntry(
+                xml_data, verbose_tags=False, keep_raw=True))
+        except Exception:
+            continue
+    return entries
+
+
+def benchmark_memory(xml_dir=None, dump=None, limit=DEFAULT_LIMIT):
+    """
+    Compare the per-record footprint of InfoEntry with and without raw_data.
+
+    The footprint with the raw xml tree retained corresponds to how
+    InfoEntry behaved before the tree was dropped after extraction.
+
+    @param xml_dir: path to the directory containing the xml files
+    @param dump: path to a single xml file containing all records
+    @param limit: the maximum number of records to use
+    """
+    records = load_records(xml_dir, dump, limit)
+    pywikibot.output(u"Loaded %d records" % len(records))
+    entries = make_entries(records)
+    del records
+    if not entries:
+        pywikibot.error(u"No records could be processed")
+        return
+
+    raw_size = deep_getsizeof(entries)
+    for entry in entries:
+        entry.raw_data = None
+    compact_size = deep_getsizeof(entries)
+
+    for label, size in ((u'retaining raw_data', raw_size),
+                        (u'compact', compact_size)):
+        pywikibot.output(
+            u"InfoEntry %s: %d entries, %d bytes in total, "
+            u"%d bytes per record" % (
+                label, len(entries), size, size / len(entries)))
+    pywikibot.output(u"The compact entries use %.1f%% of the memory" % (
+        100.0 * compact_size / raw_size))
+
+
+def clean_sparql_output_original(data, key):
+    """
+    The original implementation of NatmusInfo.clean_sparql_output.
+
+    Kept for comparison only.
+    """
+    entity_url = u'http://www.wikidata.org/entity/'
+    if key not in data[0].keys():
+        pywikibot.error(
+            u"The expected key '%s' was not present in the sparql output "
+            u"keys: %s" % (key, ', '.join(data[0].keys())))
+    new_data = {}
+    for d in data:
+        k = d[key].replace(entity_url, '')
+        new_data[k] = {}
+        for kk, value in d.iteritems():
+            value = value.split('|')
+            for i, v in enumerate(value):
+                value[i] = v.replace(entity_url, '')
+            new_data[k][kk] = common.trim_list(value)
+    return new_data
+
+
+def make_sparql_rows(num_rows):
+    """
+    Create synthetic painting query results.
+
+    The values are modelled on the output of load_painting_items(), with
+    creators, types etc. shared between many rows.
+
+    @param num_rows: the number of rows to create
+    @return: list of dicts
+    """
+    rand = random.Random(num_rows)
+    num_creators = max(num_rows / 20, 1)
+    types = [u'%sQ3305213' % ENTITY_URL, u'%sQ132137' % ENTITY_URL]
+
+    def entities(prefix, num, max_num):
+        return u'|'.join(
+            u'%s%s%d' % (ENTITY_URL, prefix, rand.randrange(num))
+            for _ in range(rand.randint(0, max_num)))
+
+    rows = []
+    for i in range(num_rows):
+        creators = entities(u'Q', num_creators, 2)
+        rows.append({
+            'item': u'%sQ%d' % (ENTITY_URL, 10000000 + i),
+            'obj_id': u'%d' % (7000000 + i),
+            'types': u'|'.join(rand.sample(types, rand.randint(0, 2))),
+            'creators': creators,
+            'creator_templates': u'',
+            'creator_cats': u'|'.join(
+                u'Creator cat %s' % c.split('Q')[-1]
+                for c in creators.split('|') if c),
+            'death_dates': u'18%02d-01-01T00:00:00Z' % rand.randrange(100)
+                if creators else u'',
+            'commons_cats': u'Painting %d' % i if i % 3 else u'',
+            'depicted_persons': entities(u'Q', num_creators, 1),
+            'depicted_cats': u'',
+        })
+    return rows
+
+
+def benchmark_sparql(num_rows=DEFAULT_ROWS):
+    """
+    Compare the current and original clean_sparql_output.
+
+    @param num_rows: the number of synthetic rows to use
+    """
+    rows = make_sparql_rows(num_rows)
+    pywikibot.output(u"Created %d synthetic rows" % len(rows))
+
+    outputs = []
+    for label, function in (
+            (u'original', clean_sparql_output_original),
+            (u'current', NatmusInfo.clean_sparql_output)):
+        durations = []
+        for _ in range(REPEATS):
+            start = time.time()
+            output = function(rows, 'obj_id')
+            durations.append(time.time() - start)
+        outputs.append(output)
+        pywikibot.output(
+            u"%s clean_sparql_output: %.3f s, output of %d bytes" % (
+                label, min(durations), deep_getsizeof(output)))
+
+    if outputs[0] != outputs[1]:
+        pywikibot.error(u"The outputs differ")
+
+
+def handle_args(args):
+    """
+    Parse and load all of the basic arguments.
+
+    @param args: arguments to be handled
+    @type args: list of strings
+    @return: list of options
+    @rtype: dict
+    """
+    options = {
+        'benchmark': 'memory',
+        'xml_dir': os.path.join(pre_process.MAIN_DIR, pre_process.XML_DIR),
+        'dump': None,
+        'limit': DEFAULT_LIMIT,
+        'rows': DEFAULT_ROWS,
+    }
+
+    for arg in pywikibot.handle_args(args):
+        option, sep, value = arg.partition(':')
+        if option == '-memory':
+            options['benchmark'] = 'memory'
+        elif option == '-dir':
+            options['xml_dir'] = os.path.join(pre_process.MAIN_DIR, value)
+        elif option == '-dump':
+            options['dump'] = value
+        elif option == '-limit':
+            options['limit'] = int(value)
+        elif option == '-sparql':
+            options['benchmark'] = 'sparql'
+        elif option == '-rows':
+            options['rows'] = int(value)
+
+    return options
+
+
+def main(*args):
+    """Command line entry-point."""
+    options = handle_args(args)
+    if options['benchmark'] == 'memory':
+        benchmark_memory(
+            options['xml_dir'], options['dump'], options['limit'])
+    elif options['benchmark'] == 'sparql':
+        benchmark_sparql(options['rows'])
+
+
+if __name__ == "__main__":
+    main()
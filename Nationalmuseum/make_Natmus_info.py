@@ -9,10 +9,34 @@ up on wikidata.
 import batchupload.helpers as helpers
 import batchupload.common as common  # temp before this is merged with helper
 from batchupload.make_info import MakeBaseInfo
+from collections import Counter, OrderedDict
+from multiprocessing.pool import ThreadPool
+import codecs
+import cPickle
+import functools
+import hashlib
+import inspect
+import itertools
+import json
+import mmap
+import multiprocessing
 import os
 import re
+import sqlite3
+import struct
+import sys
+import time
+import urllib
+import urllib2
 import pywikibot
 import pywikibot.data.sparql as sparql
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  # backport for python 2
+    except ImportError:
+        scandir = None
 
 OUT_PATH = u'connections'
 BATCH_CAT = u'Media contributed by Nationalmuseum Stockholm‎'
@@ -21,6 +45,535 @@ BASE_NAME = u'artwork'
 COLLECTION = u'Nationalmuseum'
 LANGUAGE_PRIORITY = ('_', 'en', 'sv')
 ANON_Q = 'Q4233718'
+ENTITY_URL = u'http://www.wikidata.org/entity/'
+# format of the json lines index written by pre_process.LidoLinesOutput
+INDEX_MAGIC = b'LIDX1'
+INDEX_HEADER = struct.Struct('<5sI')  # magic, width of the obj_id field
+INDEX_ENTRY = '<%dsQI'  # obj_id (utf-8, null padded), offset, length
+CACHE_DIR = u'wikidata_cache'
+WDQS_ENDPOINT = u'https://query.wikidata.org/sparql'
+STREAM_READ_SIZE = 64 * 1024  # characters of a streamed response read at once
+STREAM_USER_AGENT = u'Nationalmuseum batch upload (make_Natmus_info.py)'
+CACHE_TTL = 24  # hours before a cached query result is refetched
+VALUES_CHUNK_SIZE = 200  # max number of qids in a single VALUES clause
+QUERY_WORKERS = 4  # max number of concurrent queries per loader
+QUERY_RETRIES = 2  # number of times a failed split query is retried
+ENTITY_CACHE_SIZE = 1024  # number of decoded entities kept by EntityStore
+SNAPSHOT_VERSION = 3  # increase if the snapshotted state changes format
+IMAGE_INDEX = u'image_index.json'
+SCAN_WORKERS = 4  # max number of image directories scanned concurrently
+RENDER_CHUNKS = 4  # number of chunks of items per render worker
+
+_renderer = None  # the NatmusInfo shared with forked render workers
+
+
+def render_items(keys):
+    """
+    Render the given items in a render worker.
+
+    @param keys: the keys of the items in NatmusInfo.data
+    @return: list of (output, side effects) tuples, see render_item, and
+        a Counter of the resolutions made, see NatmusInfo.resolve_wd_artist
+    """
+    resolutions = Counter(_renderer.resolutions)
+    results = [_renderer.render_item(key) for key in keys]
+    return results, _renderer.resolutions - resolutions
+
+
+class LidoRecordStore(object):
+    """
+    Random access to the records of a json lines lido file.
+
+    Makes use of the index produced alongside the file by pre_process and
+    memory maps of the index and the file so that only the requested
+    records are looked up, read and decoded.
+
+    The index starts with a header followed by fixed width entries,
+    sorted by obj_id, of the obj_id and the offset and length of its
+    record. Its format is given by INDEX_HEADER and INDEX_ENTRY.
+    """
+
+    def __init__(self, filename):
+        """
+        Open the records file and its index.
+
+        @param filename: the path to the json lines file
+        """
+        with open(u'%s.idx' % filename, 'rb') as f:
+            self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.width = INDEX_HEADER.unpack_from(self.index)
+        if magic != INDEX_MAGIC:
+            self.index.close()
+            raise common.MyError(
+                u"Unsupported index format for %s, re-run pre_process with "
+                u"-jsonl" % filename)
+        self.entry = struct.Struct(INDEX_ENTRY % self.width)
+        self.size = (len(self.index) - INDEX_HEADER.size) // self.entry.size
+        self.records = None
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self.records = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def has_index(filename):
+        """Check if there is an index in the current format for the file."""
+        index_file = u'%s.idx' % filename
+        if not os.path.isfile(index_file):
+            return False
+        with open(index_file, 'rb') as f:
+            return f.read(len(INDEX_MAGIC)) == INDEX_MAGIC
+
+    def close(self):
+        """Close the memory maps."""
+        self.index.close()
+        if self.records:
+            self.records.close()
+
+    def get_entry(self, i):
+        """Return the (obj_id, offset, length) of the ith index entry."""
+        return self.entry.unpack_from(
+            self.index, INDEX_HEADER.size + i * self.entry.size)
+
+    def find(self, obj_id):
+        """
+        Find the record for an obj_id by bisecting the index.
+
+        @param obj_id: the obj_id to look up
+        @return: (offset, length) of the record, or None if not found
+        """
+        key = obj_id.encode('utf-8')
+        if len(key) > self.width:
+            return None
+        key = key.ljust(self.width, b'\0')
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            entry = self.get_entry(middle)
+            if entry[0] < key:
+                low = middle + 1
+            elif entry[0] > key:
+                high = middle
+            else:
+                return entry[1:]
+
+    def __contains__(self, obj_id):
+        """Check if there is a record for the obj_id."""
+        return self.find(obj_id) is not None
+
+    def __getitem__(self, obj_id):
+        """Return the decoded record for the obj_id."""
+        location = self.find(obj_id)
+        if location is None:
+            raise KeyError(obj_id)
+        offset, length = location
+        return json.loads(self.records[offset:offset + length])
+
+    def keys(self):
+        """Return the obj_ids of all records, in sorted order."""
+        return [self.get_entry(i)[0].rstrip(b'\0').decode('utf-8')
+                for i in range(self.size)]
+
+
+class EntityStore(object):
+    """
+    Read-only mapping of wikidata entity data stored in an sqlite table.
+
+    Values are only decoded when requested, with the most recently used
+    ones kept in a small LRU cache. Each process opens its own connection
+    so the store can be shared by several worker processes.
+
+    The time at which each table was created, and the source of its data,
+    are recorded in a separate info table.
+    """
+
+    def __init__(self, filename, table, cache_size=ENTITY_CACHE_SIZE):
+        """
+        Initialise the store, the database is only opened once used.
+
+        @param filename: the path to the sqlite database
+        @param table: the table holding the data
+        @param cache_size: the number of decoded values to keep
+        """
+        self.filename = filename
+        self.table = table
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.connection = None
+        self.pid = None
+
+    @staticmethod
+    def info(filename, table):
+        """
+        Return when, and from which source, a table was created.
+
+        @param filename: the path to the sqlite database
+        @param table: the table in question
+        @return: (timestamp, source) tuple, or None if the table does not
+            exist or has no recorded info
+        """
+        if not os.path.isfile(filename):
+            return None
+        connection = sqlite3.connect(filename)
+        try:
+            if connection.execute(
+                    "SELECT 1 FROM sqlite_master "
+                    "WHERE type = 'table' AND name = 'store_info'"
+                    ).fetchone() is None:
+                return None
+            return connection.execute(
+                "SELECT created, source FROM store_info WHERE name = ?",
+                (table, )).fetchone()
+        finally:
+            connection.close()
+
+    @staticmethod
+    def create(filename, table, data, source=None):
+        """
+        Store the data in a table of the database, replacing any old data.
+
+        @param filename: the path to the sqlite database
+        @param table: the table in which to store the data
+        @param data: dict of data to store
+        @param source: description of where the data came from
+        """
+        connection = sqlite3.connect(filename)
+        try:
+            with connection:
+                connection.execute("DROP TABLE IF EXISTS %s" % table)
+                connection.execute(
+                    "CREATE TABLE %s "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL)" % table)
+                connection.executemany(
+                    "INSERT INTO %s VALUES (?, ?)" % table,
+                    ((k, json.dumps(v)) for k, v in data.iteritems()))
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS store_info "
+                    "(name TEXT PRIMARY KEY, created REAL NOT NULL, "
+                    "source TEXT)")
+                connection.execute(
+                    "INSERT OR REPLACE INTO store_info VALUES (?, ?, ?)",
+                    (table, time.time(), source))
+        finally:
+            connection.close()
+
+    def __getstate__(self):
+        """Pickle without the connection or the cache."""
+        return (self.filename, self.table, self.cache_size)
+
+    def __setstate__(self, state):
+        """Unpickle the store."""
+        self.__init__(*state)
+
+    def execute(self, query, parameters=()):
+        """Execute a query, connecting to the database if needed."""
+        if self.pid != os.getpid():
+            self.connection = sqlite3.connect(
+                self.filename, check_same_thread=False)
+            self.pid = os.getpid()
+        return self.connection.execute(query % self.table, parameters)
+
+    def get(self, key, default=None):
+        """Return the value for the key, or default if not present."""
+        if key in self.cache:
+            value = self.cache.pop(key)
+        else:
+            row = self.execute(
+                "SELECT value FROM %s WHERE key = ?", (key, )).fetchone()
+            value = json.loads(row[0]) if row else None
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+        self.cache[key] = value
+        if value is None:
+            return default
+        return value
+
+    def __contains__(self, key):
+        """Check if there is a value for the key."""
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        """Return the value for the key."""
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __len__(self):
+        """Return the number of stored values."""
+        return self.execute("SELECT COUNT(*) FROM %s").fetchone()[0]
+
+    def keys(self):
+        """Return all keys."""
+        return [row[0] for row in self.execute("SELECT key FROM %s")]
+
+    def iteritems(self):
+        """Iterate over all keys and values, bypassing the cache."""
+        for key, value in self.execute("SELECT key, value FROM %s"):
+            yield key, json.loads(value)
+
+
+def iter_sparql_bindings(response, read_size=STREAM_READ_SIZE):
+    """
+    Incrementally decode the rows of a SPARQL json response.
+
+    Only a single binding is decoded at a time, so neither the response
+    text nor the decoded json of the whole response is held in memory. The
+    rows are in the same format as those returned by SparqlQuery.select(),
+    i.e. a dict of variable: value with None for any unbound variables.
+    This relies on the head preceding the results, as in the responses of
+    the Wikidata Query Service, otherwise unbound variables are left out.
+
+    @param response: file like object with the utf-8 encoded response
+    @param read_size: the number of characters to read at a time
+    @return: generator of dicts
+    """
+    reader = codecs.getreader('utf-8')(response)
+    decoder = json.JSONDecoder()
+    text = u''
+    eof = False
+
+    # the variables are listed in the head, before the results
+    bindings = re.compile(r'"bindings"\s*:\s*\[')
+    match = bindings.search(text)
+    while not match:
+        chunk = reader.read(read_size)
+        if not chunk:
+            raise ValueError(u"No bindings found in the SPARQL response")
+        text += chunk
+        match = bindings.search(text)
+    head = re.search(r'"vars"\s*:\s*', text[:match.start()])
+    variables = None
+    if head:
+        variables = decoder.raw_decode(text[:match.start()], head.end())[0]
+    text = text[match.end():]
+
+    while True:
+        text = text.lstrip().lstrip(u',').lstrip()
+        if text.startswith(u']'):
+            return
+        try:
+            if not text:
+                raise ValueError(u"Incomplete binding")
+            binding, end = decoder.raw_decode(text)
+        except ValueError:
+            if eof:
+                raise
+            chunk = reader.read(read_size)
+            eof = not chunk
+            text += chunk
+            continue
+        text = text[end:]
+        yield dict(
+            (variable, binding[variable]['value']
+             if variable in binding else None)
+            for variable in variables or binding.keys())
+
+
+class CachedQueryService(object):
+    """
+    A SPARQL query service storing the results of each query on disk.
+
+    Results are keyed on the normalised query text and reused until they
+    are older than the ttl. In offline mode only cached results are used,
+    regardless of their age.
+
+    The cache directory doubles as a set of recorded query results: with
+    refresh set every query is run and its result recorded, in offline mode
+    the recorded results are replayed.
+
+    In stream mode the responses of the SPARQL endpoint are decoded one row
+    at a time, see iter_select.
+    """
+
+    def __init__(self, cache_dir, ttl=CACHE_TTL, refresh=False,
+                 offline=False, endpoint=None, backend=None, stream=False):
+        """
+        Initialise the query service.
+
+        @param cache_dir: the directory in which to store the results
+        @param ttl: the number of hours a cached result is considered valid
+        @param refresh: whether to ignore any cached results
+        @param offline: whether to only use cached results
+        @param endpoint: url of the SPARQL endpoint to use instead of the
+            Wikidata Query Service
+        @param backend: object with a select(query) method to use instead
+            of sparql.SparqlQuery
+        @param stream: whether to decode the responses of the endpoint
+            incrementally, not used together with backend
+        """
+        if refresh and offline:
+            raise common.MyError(
+                u"Cannot refresh the Wikidata cache in offline mode.")
+        self.cache_dir = cache_dir
+        self.ttl = ttl * 3600
+        self.refresh = refresh
+        self.offline = offline
+        self.endpoint = endpoint
+        self.backend = backend
+        self.stream = stream and not backend
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def normalise_query(query):
+        """Strip comments and collapse whitespace in a SPARQL query."""
+        lines = []
+        for line in query.split('\n'):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                lines.append(line)
+        return u' '.join(u' '.join(lines).split())
+
+    def cache_file(self, query):
+        """Return the path to the cache file for the given query."""
+        key = hashlib.sha1(
+            CachedQueryService.normalise_query(query).encode('utf-8'))
+        return os.path.join(self.cache_dir, u'%s.json' % key.hexdigest())
+
+    def get_backend(self):
+        """Return the service used to run any non-cached queries."""
+        if self.backend:
+            return self.backend
+        elif self.endpoint:
+            return sparql.SparqlQuery(
+                endpoint=self.endpoint, entity_url=ENTITY_URL)
+        return sparql.SparqlQuery()
+
+    def get_cached(self, filename):
+        """
+        Return the cached result in a cache file, if still valid.
+
+        @param filename: the path to the cache file
+        @return: list of dicts, or None if there is no valid result
+        """
+        if not self.refresh and os.path.isfile(filename):
+            cached = common.open_and_read_file(filename, as_json=True)
+            if self.offline or time.time() - cached['timestamp'] < self.ttl:
+                return cached['data']
+        if self.offline:
+            raise common.MyError(
+                u"No cached result for query in offline mode: %s" % filename)
+
+    def store(self, filename, query, data):
+        """Store the result of a query in a cache file."""
+        common.open_and_write_file(
+            filename,
+            {'timestamp': time.time(), 'query': query, 'data': data},
+            as_json=True)
+
+    def select(self, query):
+        """
+        Run a SELECT query, or load its result from the cache.
+
+        Safe to call from several threads at once as long as they run
+        different queries.
+
+        @param query: the SPARQL query
+        @return: list of dicts, or None if the query failed
+        """
+        if self.stream:
+            return list(self.iter_select(query))
+        filename = self.cache_file(query)
+        data = self.get_cached(filename)
+        if data is not None:
+            return data
+
+        data = self.get_backend().select(query)
+        if data is not None:
+            self.store(filename, query, data)
+        return data
+
+    def iter_select(self, query):
+        """
+        Run a SELECT query, or load its result from the cache, row by row.
+
+        In stream mode the response is decoded incrementally, without
+        holding the response text or its decoded json in memory. The rows
+        are cached once all of them have been read. Otherwise this is the
+        same as select(), except that a failed query raises a MyError.
+
+        @param query: the SPARQL query
+        @return: generator of dicts
+        """
+        filename = self.cache_file(query)
+        data = self.get_cached(filename)
+        if data is None and not self.stream:
+            data = self.select(query)
+            if data is None:
+                raise common.MyError(
+                    u"Query failed: %s" % query.split('\n')[0])
+        if data is not None:
+            for row in data:
+                yield row
+            return
+
+        request = urllib2.Request(
+            u'%s?%s' % (self.endpoint or WDQS_ENDPOINT, urllib.urlencode(
+                {'query': query.encode('utf-8')})),
+            headers={'Accept': 'application/sparql-results+json',
+                     'User-Agent': STREAM_USER_AGENT})
+        response = urllib2.urlopen(request)
+        rows = []
+        try:
+            for row in iter_sparql_bindings(response):
+                rows.append(row)
+                yield row
+        finally:
+            response.close()
+        self.store(filename, query, rows)
+
+
+class WikidataIndex(object):
+    """
+    Wikidata data loaded from a local index instead of through SPARQL.
+
+    The index is created from a Wikidata dump by make_wikidata_index and
+    the loaders return data in the same format as those in NatmusInfo.
+    """
+
+    def __init__(self, filename):
+        """
+        Load the index.
+
+        @param filename: the path to the index file
+        """
+        self.index = common.open_and_read_file(filename, as_json=True)
+        pywikibot.output(u"Loaded Wikidata index created from %s" %
+                         self.index['dump'])
+
+    def load_painting_items(self):
+        """Return all natmus paintings in the index."""
+        pywikibot.output(u"Loaded %d paintings from wikidata index" %
+                         len(self.index['paintings']))
+        return self.index['paintings']
+
+    def load_creator_items(self):
+        """Return all nsid people in the index."""
+        pywikibot.output(u"Loaded %d artists from wikidata index" %
+                         len(self.index['creators']))
+        return self.index['creators']
+
+    def load_local_nsid_mappings(self, filename):
+        """
+        Load the local nsid mappings and the commonscats of the mapped qids.
+
+        @param filename: path to the local json with nsid mappings
+        @return: (dict, dict)
+        """
+        local_nsid_mapping = common.open_and_read_file(
+            filename, as_json=True)
+        local_cats = {}
+        for qid in set(local_nsid_mapping.values()):
+            if qid in self.index['commons_cats']:
+                local_cats[qid] = {
+                    'item': [qid, ],
+                    'commons_cat': self.index['commons_cats'][qid],
+                }
+        pywikibot.output(
+            "Loaded %d cats via wikidata index from local mappings" %
+            len(local_cats))
+        return (local_nsid_mapping, local_cats)
 
 
 class NatmusInfo(MakeBaseInfo):
@@ -35,10 +588,39 @@ class NatmusInfo(MakeBaseInfo):
         """
         self.skip_non_wikidata = options['skip_non_wikidata']
         self.local_nsid_mappings = options['nsid_file']
-
-        # load wikidata and static mappings
-        self.wd_paintings = NatmusInfo.load_painting_items()
-        self.wd_creators = NatmusInfo.load_creator_items()
+        self.obj_ids = options.get('obj_ids')
+        self.query_service = NatmusInfo.get_query_service(options)
+        self.values_chunk_size = options.get(
+            'values_chunk_size', VALUES_CHUNK_SIZE)
+        self.split_painting_query = options.get(
+            'split_painting_query', False)
+        self.wd_index = options.get('wd_index')
+        self.wd_store = options.get('wd_store')
+        self.refresh_wikidata = options.get('refresh_wikidata', False)
+        self.loose_image_matching = options.get(
+            'loose_image_matching', False)
+        self.snapshot = options.get('snapshot')
+        self.snapshot_data = None  # load_data() output restored from snapshot
+        self.lido_file = None  # (path, size, mtime) of the lido file
+        self.image_index = options.get('image_index') or IMAGE_INDEX
+        # image filename: (directory, size, mtime), see load_image_dirs
+        self.image_info = {}
+        self.workers = options.get('workers', 1)
+        self.effects = None  # side effects recorded while rendering an item
+        self.render_cache = options.get('render_cache')
+        self.code_fingerprint = None  # set once the render cache is used
+        self.resolved = {}  # cached artist and depicted resolutions
+        self.resolutions = Counter()  # resolution cache hits and misses
+
+        # restore the loaded state from a snapshot or start loading wikidata
+        # and local mappings in the background, these are only waited for
+        # once needed
+        self.loaders = None
+        self.deathyears = None  # latest death year per obj_id and per nsid
+        if self.snapshot:
+            self.fingerprint = NatmusInfo.make_fingerprint(options)
+        if not (self.snapshot and self.load_snapshot(options)):
+            self.start_loaders()
 
         # store various ids for potential later use
         self.nsid = {}  # nsid ids, frequency and potential wikidata matches
@@ -53,9 +635,411 @@ class NatmusInfo(MakeBaseInfo):
         """
         Add text to logger.
 
+        If side effects are being recorded the text is only recorded.
+
         @param text: text to log
         """
-        self.logger.append(text)
+        if self.effects is not None:
+            self.effects.append(('log', text))
+        else:
+            self.logger.append(text)
+
+    def warning(self, text):
+        """
+        Output a warning.
+
+        If side effects are being recorded the warning is only recorded.
+
+        @param text: the warning
+        """
+        if self.effects is not None:
+            self.effects.append(('warning', text))
+        else:
+            pywikibot.warning(text)
+
+    def add_wd_candidate(self, ids, key, qid=None):
+        """
+        Note that an nsid or uri id is missing in wikidata.
+
+        If side effects are being recorded the candidate is only recorded.
+
+        @param ids: the id store, i.e. 'nsid' or 'uri_ids'
+        @param key: the nsid or uri id
+        @param qid: a qid which is a potential match, if any
+        """
+        entry = getattr(self, ids)[key]
+        if self.effects is not None:
+            self.effects.append(('wd', ids, key, qid))
+            return
+        candidates = entry.setdefault('wd', set())
+        if qid:
+            candidates.add(qid)
+
+    def replay_effects(self, effects):
+        """
+        Apply the side effects recorded while rendering an item.
+
+        @param effects: list of side effects, see render_item
+        """
+        for effect in effects:
+            if effect[0] == 'log':
+                self.log(effect[1])
+            elif effect[0] == 'warning':
+                self.warning(effect[1])
+            else:
+                self.add_wd_candidate(*effect[1:])
+
+    @staticmethod
+    def make_fingerprint(options):
+        """
+        Fingerprint the inputs and options which affect the loaded state.
+
+        Files, and image directories, are identified by their path, size
+        and modification time.
+
+        @param options: the options passed to __init__
+        @return: str
+        """
+        files = []
+        for in_file in options.get('in_file') or []:
+            if isinstance(in_file, list):  # image directories
+                files += in_file
+            else:
+                files.append(in_file)
+        files += [options.get('nsid_file'), options.get('wd_index')]
+        fingerprint = [SNAPSHOT_VERSION, options.get('obj_ids'),
+                       options.get('split_painting_query', False),
+                       options.get('wd_store'), options.get('cache_dir'),
+                       options.get('sparql_endpoint')]
+        for filename in files:
+            if filename and os.path.exists(filename):
+                stat = os.stat(filename)
+                fingerprint.append(
+                    (os.path.abspath(filename), stat.st_size, stat.st_mtime))
+            else:
+                fingerprint.append(filename)
+        return hashlib.sha1(json.dumps(fingerprint)).hexdigest()
+
+    def load_snapshot(self, options):
+        """
+        Restore the loaded state from the snapshot, if it is still valid.
+
+        A snapshot is valid if it was made with the same inputs and, unless
+        offline, is younger than the cache ttl. A snapshot which cannot be
+        read, e.g. if corrupt or in an old format, is ignored.
+
+        @param options: the options passed to __init__
+        @return: bool, whether the state was restored
+        """
+        if self.refresh_wikidata or not os.path.isfile(self.snapshot):
+            return False
+
+        start = time.time()
+        try:
+            with open(self.snapshot, 'rb') as f:
+                snapshot = cPickle.load(f)
+            age = time.time() - snapshot['timestamp']
+            fingerprint = snapshot['fingerprint']
+        except Exception as e:
+            pywikibot.output(
+                u"Ignoring unreadable snapshot: %s" % e.__class__.__name__)
+            return False
+        if fingerprint != self.fingerprint:
+            pywikibot.output(u"Ignoring outdated snapshot: inputs changed")
+            return False
+        elif not options.get('offline') and \
+                age > options.get('cache_ttl', CACHE_TTL) * 3600:
+            pywikibot.output(u"Ignoring outdated snapshot: too old")
+            return False
+
+        state = snapshot['state']
+        if state['lido_file'] != NatmusInfo.describe_file(
+                state['lido_file'][0]):
+            pywikibot.output(u"Ignoring outdated snapshot: lido file changed")
+            return False
+
+        self.wd_paintings = state['wd_paintings']
+        self.wd_creators = state['wd_creators']
+        self.local_nsid_mapping = state['local_nsid_mapping']
+        self.local_cats = state['local_cats']
+        self.snapshot_data = state['data']
+        self.lido_file = state['lido_file']
+        self.image_info = state['image_info']
+        pywikibot.output(u"Restored snapshot %s in %.2f s" % (
+            self.snapshot, time.time() - start))
+        return True
+
+    def save_snapshot(self, raw_data):
+        """
+        Store the loaded state in the snapshot.
+
+        Lazily loaded lido records, i.e. from a json lines file, are only
+        stored by reference to the lido file. Other records are stored as a
+        list, since an unpickled dict need not iterate in the same order,
+        which would change the order of the log.
+
+        @param raw_data: output from load_data()
+        """
+        lido_data, image_files = raw_data
+        if isinstance(lido_data, dict):
+            raw_data = (lido_data.items(), image_files)
+        else:
+            raw_data = (None, image_files)
+        snapshot = {
+            'timestamp': time.time(),
+            'fingerprint': self.fingerprint,
+            'state': {
+                'wd_paintings': self.wd_paintings,
+                'wd_creators': self.wd_creators,
+                'local_nsid_mapping': self.local_nsid_mapping,
+                'local_cats': self.local_cats,
+                'data': raw_data,
+                'lido_file': self.lido_file,
+                'image_info': self.image_info,
+            },
+        }
+        with open(self.snapshot, 'wb') as f:
+            cPickle.dump(snapshot, f, cPickle.HIGHEST_PROTOCOL)
+        pywikibot.output(u"Created snapshot %s" % self.snapshot)
+
+    @staticmethod
+    def describe_file(filename):
+        """
+        Identify a file by its path, size and modification time.
+
+        @param filename: the path to the file
+        @return: (path, size, mtime) tuple, with size and mtime None if the
+            file does not exist
+        """
+        if not os.path.isfile(filename):
+            return (filename, None, None)
+        stat = os.stat(filename)
+        return (filename, stat.st_size, stat.st_mtime)
+
+    @staticmethod
+    def timed(function, *args):
+        """
+        Call a function and measure how long it took.
+
+        @param function: the function to call
+        @param args: the arguments to pass to the function
+        @return: (result, seconds)
+        """
+        start = time.time()
+        result = function(*args)
+        return (result, time.time() - start)
+
+    def start_loaders(self):
+        """Start the independent startup loaders in a thread pool."""
+        if self.wd_index:
+            index = WikidataIndex(self.wd_index)
+            loaders = [
+                (u'wikidata paintings', index.load_painting_items, ()),
+                (u'wikidata artists', index.load_creator_items, ()),
+                (u'local nsid mappings', index.load_local_nsid_mappings,
+                 (self.local_nsid_mappings, )),
+            ]
+        else:
+            load_painting_items = NatmusInfo.load_painting_items
+            if self.split_painting_query:
+                load_painting_items = NatmusInfo.load_painting_items_split
+            loaders = [
+                (u'wikidata paintings', load_painting_items,
+                 (self.query_service, )),
+                (u'wikidata artists', NatmusInfo.load_creator_items,
+                 (self.query_service, )),
+                (u'local nsid mappings', NatmusInfo.load_local_nsid_mappings,
+                 (self.local_nsid_mappings, self.query_service,
+                  self.values_chunk_size)),
+            ]
+
+        # reuse any previously stored paintings and artists
+        if self.can_reuse_wd_store():
+            loaders[0] = (u'wikidata paintings', EntityStore,
+                          (self.wd_store, 'paintings'))
+            loaders[1] = (u'wikidata artists', EntityStore,
+                          (self.wd_store, 'creators'))
+
+        pool = ThreadPool(len(loaders))
+        self.loaders = []
+        for label, function, args in loaders:
+            self.loaders.append((label, pool.apply_async(
+                NatmusInfo.timed, (function, ) + args)))
+        pool.close()
+
+    def wikidata_source(self):
+        """
+        Describe the source from which the wikidata data is loaded.
+
+        An index is identified by its path, size and modification time.
+
+        @return: str
+        """
+        if self.wd_index:
+            stat = os.stat(self.wd_index)
+            source = [u'index', os.path.abspath(self.wd_index),
+                      stat.st_size, stat.st_mtime]
+        else:
+            source = [u'sparql', self.query_service.endpoint,
+                      self.split_painting_query]
+        return json.dumps(source)
+
+    def can_reuse_wd_store(self):
+        """
+        Check if the wikidata data in the entity store can be reused.
+
+        The data is reused if it was loaded from the same source and,
+        unless offline, is younger than the cache ttl. It is never reused
+        with -refresh_wikidata.
+
+        @return: bool
+        """
+        if not self.wd_store or self.refresh_wikidata:
+            return False
+
+        source = self.wikidata_source()
+        for table in ('paintings', 'creators'):
+            info = EntityStore.info(self.wd_store, table)
+            if not info:
+                return False
+            created, store_source = info
+            if store_source != source:
+                pywikibot.output(
+                    u"Ignoring outdated wikidata store: source changed")
+                return False
+            elif not self.query_service.offline and \
+                    time.time() - created > self.query_service.ttl:
+                pywikibot.output(
+                    u"Ignoring outdated wikidata store: too old")
+                return False
+        return True
+
+    def wait_for_loaders(self):
+        """
+        Wait for the startup loaders to finish and store their results.
+
+        Outputs the time taken by each loader. Does nothing if the results
+        have already been stored, e.g. if restored from a snapshot, except
+        building the death year index if not yet done.
+        """
+        if self.loaders is None:
+            if self.deathyears is None:
+                self.build_deathyear_index()
+            return
+
+        results = []
+        for label, job in self.loaders:
+            result, duration = job.get()
+            pywikibot.output(u"Loaded %s in %.2f s" % (label, duration))
+            results.append(result)
+        self.loaders = None
+
+        self.wd_paintings, self.wd_creators, local_mappings = results
+        self.local_nsid_mapping, self.local_cats = local_mappings
+
+        # move the wikidata data to the entity store
+        if self.wd_store and not isinstance(self.wd_paintings, EntityStore):
+            source = self.wikidata_source()
+            EntityStore.create(
+                self.wd_store, 'paintings', self.wd_paintings, source)
+            EntityStore.create(
+                self.wd_store, 'creators', self.wd_creators, source)
+            self.wd_paintings = EntityStore(self.wd_store, 'paintings')
+            self.wd_creators = EntityStore(self.wd_store, 'creators')
+            pywikibot.output(u"Stored wikidata data in %s" % self.wd_store)
+
+        self.build_deathyear_index()
+
+    @staticmethod
+    def latest_deathyear(death_dates):
+        """
+        Return the latest year among a list of death dates.
+
+        Any unknown values are ignored, as are (with an error) any dates
+        not starting with a positive year.
+
+        @param death_dates: list of death dates
+        @return: int or None
+        """
+        # internal markup for unknown or something weird
+        unknown = (u't329875228', u't318787658', u't329488873', u't318035461')
+        year = None
+        for deathyear in death_dates:
+            if deathyear in unknown:
+                continue
+            elif not common.is_pos_int(deathyear[:4]):
+                pywikibot.error("Found non-integer deathyear: %s" % deathyear)
+                continue
+            deathyear = int(deathyear[:4])
+            if deathyear > year:  # works as any int > None
+                year = deathyear
+        return year
+
+    @staticmethod
+    def has_stored_deathyears(filename):
+        """Check if the stored death years are as new as the stored data."""
+        deathyears = EntityStore.info(filename, 'deathyears')
+        if not deathyears:
+            return False
+        for table in ('paintings', 'creators'):
+            info = EntityStore.info(filename, table)
+            if not info or info[0] > deathyears[0]:
+                return False
+        return True
+
+    def build_deathyear_index(self):
+        """
+        Index the latest death year per painting obj_id and artist nsid.
+
+        If the wikidata data is in an entity store the index is stored
+        alongside it, and reused for as long as the data is.
+        """
+        start = time.time()
+        store = None
+        if isinstance(self.wd_paintings, EntityStore):
+            store = self.wd_paintings.filename
+
+        if store and NatmusInfo.has_stored_deathyears(store):
+            stored = EntityStore(store, 'deathyears')
+            self.deathyears = {
+                'obj_id': stored['obj_id'],
+                'nsid': stored['nsid'],
+            }
+            action = u'Loaded'
+        else:
+            self.deathyears = {'obj_id': {}, 'nsid': {}}
+            for key, wd_data in (('obj_id', self.wd_paintings),
+                                 ('nsid', self.wd_creators)):
+                for k, v in wd_data.iteritems():
+                    year = NatmusInfo.latest_deathyear(
+                        v.get('death_dates') or [])
+                    if year:
+                        self.deathyears[key][k] = year
+            if store:
+                EntityStore.create(store, 'deathyears', self.deathyears)
+            action = u'Built'
+        self.log(
+            u"%s death year index for %d paintings and %d artists "
+            u"in %.2f s" % (action, len(self.deathyears['obj_id']),
+                            len(self.deathyears['nsid']),
+                            time.time() - start))
+
+    @staticmethod
+    def get_query_service(options):
+        """
+        Set up the service used for the Wikidata queries.
+
+        @param options: the options passed to __init__
+        @return: CachedQueryService
+        """
+        cache_dir = options.get('cache_dir') or CACHE_DIR
+        return CachedQueryService(
+            cache_dir,
+            ttl=options.get('cache_ttl', CACHE_TTL),
+            refresh=options.get('refresh_wikidata', False),
+            offline=options.get('offline', False),
+            endpoint=options.get('sparql_endpoint'),
+            stream=options.get('stream_sparql', False))
 
     @staticmethod
     def load_place_mappings():
@@ -117,31 +1101,42 @@ class NatmusInfo(MakeBaseInfo):
         """
         Takes the sparql output and outputs it as a dict with lists.
 
-        Also converts any entity_urls to Qids.
+        Also converts any entity_urls to Qids. Identical values are shared
+        between rows rather than being stored as separate strings.
 
-        @param data: data to clean
+        @param data: data to clean, any iterable of rows, e.g. those streamed
+            by CachedQueryService.iter_select
         @param key: data value to use as key in the new dict
         @return: dict
         """
-        entity_url = u'http://www.wikidata.org/entity/'
-        if key not in data[0].keys():
-            pywikibot.error(
-                u"The expected key '%s' was not present in the sparql output "
-                u"keys: %s" % (key, ', '.join(data[0].keys())))
+        entity_url = ENTITY_URL
+        share = {}.setdefault
         new_data = {}
         for d in data:
+            if not new_data and key not in d:
+                pywikibot.error(
+                    u"The expected key '%s' was not present in the sparql "
+                    u"output keys: %s" % (key, ', '.join(d.keys())))
             k = d[key].replace(entity_url, '')
-            new_data[k] = {}
+            new_data[share(k, k)] = row = {}
             for kk, value in d.iteritems():
-                value = value.split('|')
-                for i, v in enumerate(value):
-                    value[i] = v.replace(entity_url, '')
-                new_data[k][kk] = common.trim_list(value)
+                if value:
+                    row[kk] = [
+                        share(v, v)
+                        for v in value.replace(entity_url, '').split('|')
+                        if v]
+                else:
+                    row[kk] = []
         return new_data
 
     @staticmethod
-    def load_painting_items():
-        """Store all natmus paintings in Wikidata."""
+    def load_painting_items(query_service=None):
+        """
+        Store all natmus paintings in Wikidata.
+
+        @param query_service: service used to run the query, defaults to
+            an uncached sparql.SparqlQuery
+        """
         query = u'''\
 # Nationalmuseum import
 SELECT ?item ?obj_id
@@ -184,14 +1179,155 @@ WHERE
 }
 group by ?item ?obj_id
 '''
-        s = sparql.SparqlQuery()
-        data = s.select(query)
+        data = NatmusInfo.clean_sparql_output(
+            NatmusInfo.iter_select(query_service, query), 'obj_id')
         pywikibot.output("Loaded %d paintings from wikidata" % len(data))
-        return NatmusInfo.clean_sparql_output(data, 'obj_id')
+        return data
 
     @staticmethod
-    def load_creator_items():
-        """Store all nsid people in Wikidata."""
+    def load_painting_items_split(query_service=None):
+        """
+        Store all natmus paintings in Wikidata using several narrow queries.
+
+        An alternative to load_painting_items() where each group of
+        properties is fetched by a separate query, these are run
+        concurrently and joined locally into the same format as
+        load_painting_items() produces. Each query is retried separately
+        on failure.
+
+        @param query_service: service used to run the queries, defaults to
+            an uncached sparql.SparqlQuery
+        """
+        # (query, {variable: grouped key}), the first variable is the item
+        parts = (
+            (u'''\
+# Nationalmuseum import: paintings
+SELECT ?item ?obj_id ?type WHERE {
+  ?item wdt:P2539 ?obj_id .
+  OPTIONAL { ?item wdt:P31 ?type . }
+}
+''', {'obj_id': 'obj_id', 'type': 'types'}),
+            (u'''\
+# Nationalmuseum import: painting creators
+SELECT ?item ?creator ?death_date ?creator_template ?creator_cat WHERE {
+  ?item wdt:P2539 [] ;
+        wdt:P170 ?creator .
+  OPTIONAL { ?creator wdt:P570 ?death_date . }
+  OPTIONAL { ?creator wdt:P1472 ?creator_template . }
+  OPTIONAL { ?creator wdt:P373 ?creator_cat . }
+}
+''', {'creator': 'creators', 'death_date': 'death_dates',
+                'creator_template': 'creator_templates',
+                'creator_cat': 'creator_cats'}),
+            (u'''\
+# Nationalmuseum import: painting commonscats
+SELECT ?item ?commons_cat WHERE {
+  ?item wdt:P2539 [] ;
+        wdt:P373 ?commons_cat .
+}
+''', {'commons_cat': 'commons_cats'}),
+            (u'''\
+# Nationalmuseum import: depicted people
+SELECT ?item ?depicted_person ?depicted_cat WHERE {
+  ?item wdt:P2539 [] ;
+        wdt:P180 ?depicted_person .
+  ?depicted_person wdt:P31 wd:Q5 .
+  OPTIONAL { ?depicted_person wdt:P373 ?depicted_cat . }
+}
+''', {'depicted_person': 'depicted_persons',
+                'depicted_cat': 'depicted_cats'}),
+        )
+        s = query_service or sparql.SparqlQuery()
+        pool = ThreadPool(min(QUERY_WORKERS, len(parts)))
+        try:
+            results = pool.map(
+                functools.partial(NatmusInfo.select_with_retries, s),
+                [query for query, variables in parts])
+        finally:
+            pool.close()
+            pool.join()
+
+        # group the values per item, keeping the order they were found in
+        entity_url = ENTITY_URL
+        grouped_keys = []
+        for part in parts:
+            grouped_keys += part[1].values()
+        items = {}
+        for (query, variables), data in zip(parts, results):
+            for row in data:
+                qid = row['item'].replace(entity_url, '')
+                if qid not in items:
+                    items[qid] = dict((k, []) for k in grouped_keys)
+                for variable, key in variables.iteritems():
+                    value = row.get(variable)
+                    if value:
+                        value = value.replace(entity_url, '')
+                        if value not in items[qid][key]:
+                            items[qid][key].append(value)
+
+        # key on obj_id, as done by load_painting_items()
+        new_data = {}
+        for qid, values in items.iteritems():
+            for obj_id in values['obj_id']:
+                new_data[obj_id] = dict(
+                    (k, list(v)) for k, v in values.iteritems())
+                new_data[obj_id]['item'] = [qid, ]
+                new_data[obj_id]['obj_id'] = [obj_id, ]
+        pywikibot.output(
+            "Loaded %d paintings from wikidata" % len(new_data))
+        return new_data
+
+    @staticmethod
+    def iter_select(query_service, query):
+        """
+        Run a SELECT query, streaming the rows if the service supports it.
+
+        @param query_service: service used to run the query, defaults to
+            an uncached sparql.SparqlQuery
+        @param query: the SPARQL query
+        @return: iterable of dicts
+        """
+        s = query_service or sparql.SparqlQuery()
+        if hasattr(s, 'iter_select'):
+            return s.iter_select(query)
+        return s.select(query)
+
+    @staticmethod
+    def select_with_retries(query_service, query, retries=QUERY_RETRIES):
+        """
+        Run a SELECT query, retrying it if it fails.
+
+        @param query_service: service used to run the query
+        @param query: the SPARQL query
+        @param retries: the number of times to retry a failed query
+        @return: list of dicts
+        """
+        for attempt in range(retries + 1):
+            try:
+                data = query_service.select(query)
+            except common.MyError:
+                raise
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                pywikibot.warning(u"Query failed, retrying: %s" % e)
+                continue
+            if data is not None:
+                return data
+            if attempt < retries:
+                pywikibot.warning(u"Query returned no data, retrying")
+        raise common.MyError(
+            u"Query failed after %d attempts: %s" % (
+                retries + 1, query.split('\n')[0]))
+
+    @staticmethod
+    def load_creator_items(query_service=None):
+        """
+        Store all nsid people in Wikidata.
+
+        @param query_service: service used to run the query, defaults to
+            an uncached sparql.SparqlQuery
+        """
         query = u'''\
 # Nationalmuseum import
 SELECT ?item ?itemLabel ?nsid
@@ -214,17 +1350,27 @@ WHERE
 }
 group by ?item ?itemLabel ?nsid
 '''
-        s = sparql.SparqlQuery()
-        data = s.select(query)
+        data = NatmusInfo.clean_sparql_output(
+            NatmusInfo.iter_select(query_service, query), 'nsid')
         pywikibot.output("Loaded %d artists from wikidata" % len(data))
-        return NatmusInfo.clean_sparql_output(data, 'nsid')
+        return data
 
     @staticmethod
-    def load_local_nsid_commonscats(qids):
+    def load_local_nsid_commonscats(qids, query_service=None,
+                                    chunk_size=VALUES_CHUNK_SIZE,
+                                    workers=QUERY_WORKERS):
         """
         Get commonscats for the locally loaded list of qids.
 
+        The qids are split into chunks which are queried concurrently. Each
+        chunk is retried separately on failure, a MyError is raised if it
+        still fails.
+
         qids: list of qids
+        query_service: service used to run the query, defaults to an
+            uncached sparql.SparqlQuery
+        chunk_size: the max number of qids per query
+        workers: the max number of concurrent queries
         """
         query = u'''\
 # Nationalmuseum import
@@ -232,28 +1378,234 @@ SELECT ?item ?commons_cat WHERE {
   ?item wdt:P373 ?commons_cat .
   VALUES ?item { wd:%s } .
 }
-''' % ' wd:'.join(qids)
-        s = sparql.SparqlQuery()
-        data = s.select(query)
+'''
+        s = query_service or sparql.SparqlQuery()
+        qids = sorted(set(qids))
+        queries = [query % ' wd:'.join(qids[i:i + chunk_size])
+                   for i in range(0, len(qids), chunk_size)]
+        if not queries:
+            return {}
+
+        pool = ThreadPool(min(workers, len(queries)))
+        try:
+            results = pool.map(
+                functools.partial(NatmusInfo.select_with_retries, s),
+                queries)
+        finally:
+            pool.close()
+            pool.join()
+
+        cats = {}
+        num_cats = 0
+        for data in results:
+            if data:
+                num_cats += len(data)
+                cats.update(NatmusInfo.clean_sparql_output(data, 'item'))
         pywikibot.output(
-            "Loaded %d cats via wikidata from local mappings" % len(data))
-        return NatmusInfo.clean_sparql_output(data, 'item')
+            "Loaded %d cats via wikidata from local mappings" % num_cats)
+        return cats
+
+    @staticmethod
+    def load_local_nsid_mappings(filename, query_service=None,
+                                 chunk_size=VALUES_CHUNK_SIZE):
+        """
+        Load the local nsid mappings and the commonscats of the mapped qids.
+
+        @param filename: path to the local json with nsid mappings
+        @param query_service: service used to run the query, defaults to
+            an uncached sparql.SparqlQuery
+        @param chunk_size: the max number of qids per commonscat query
+        @return: (dict, dict)
+        """
+        local_nsid_mapping = common.open_and_read_file(
+            filename, as_json=True)
+        local_cats = NatmusInfo.load_local_nsid_commonscats(
+            local_nsid_mapping.values(), query_service, chunk_size)
+        return (local_nsid_mapping, local_cats)
+
+    @staticmethod
+    def iter_lido_lines(filename):
+        """
+        Lazily load the records of a json lines lido file.
+
+        @param filename: the path to the json lines file
+        @return: generator of (obj_id, record) tuples
+        """
+        with open(filename, 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                yield (record['obj_id'], record)
+
+    @staticmethod
+    def iter_selected_records(filename, obj_ids):
+        """
+        Load only the records for the given obj_ids.
+
+        The index of a json lines file is used, if available, to avoid
+        decoding any other records. An index in an older format is
+        ignored.
+
+        @param filename: the path to the json or json lines lido file
+        @param obj_ids: list of obj_ids to load
+        @return: generator of (obj_id, record) tuples
+        """
+        if filename.endswith('.jsonl') and \
+                LidoRecordStore.has_index(filename):
+            records = LidoRecordStore(filename)
+        elif filename.endswith('.jsonl'):
+            records = dict(NatmusInfo.iter_lido_lines(filename))
+        else:
+            records = common.open_and_read_file(filename, as_json=True)
+
+        try:
+            for obj_id in obj_ids:
+                if obj_id not in records:
+                    pywikibot.warning(
+                        "Found no lido record for obj_id: %s" % obj_id)
+                    continue
+                yield (obj_id, records[obj_id])
+        finally:
+            if isinstance(records, LidoRecordStore):
+                records.close()
+
+    def load_lido_data(self, filename):
+        """
+        Load the lido records, lazily unless a json file is used.
+
+        @param filename: the path to the json or json lines lido file
+        @return: dict or iterator of (obj_id, record) tuples
+        """
+        if self.obj_ids:
+            return NatmusInfo.iter_selected_records(filename, self.obj_ids)
+        elif filename.endswith('.jsonl'):
+            return NatmusInfo.iter_lido_lines(filename)
+        return common.open_and_read_file(filename, as_json=True)
 
     def load_data(self, in_file):
         """
         Load the provided data files.
 
-        Outputs a tuple with lido data as a dict and image filenames as a list.
+        Outputs a tuple with lido data and image filenames as a list. The
+        lido data is a dict, or for json lines files or when only some
+        obj_ids are requested an iterator of (obj_id, record) tuples.
+
+        The image filenames are either read from a file or found by
+        scanning a list of image directories.
 
-        @param in_file: the path to the metadata file
-        @return: (dict, list)
+        @param in_file: (path to the metadata file, path to the image
+            filenames file or list of paths to image directories)
+        @return: (dict|iterator, list)
         """
-        lido_data = common.open_and_read_file(in_file[0], as_json=True)
-        image_files = common.open_and_read_file(in_file[1]).split('\n')
-        image_files = common.trim_list(image_files)
+        if self.snapshot_data:
+            lido_data, image_files = self.snapshot_data
+            if lido_data is None:  # snapshotted by reference
+                lido_data = self.load_lido_data(self.lido_file[0])
+            return (lido_data, image_files)
+
+        start = time.time()
+        self.lido_file = NatmusInfo.describe_file(in_file[0])
+        lido_data = self.load_lido_data(in_file[0])
+        if isinstance(in_file[1], list):
+            self.image_info = NatmusInfo.load_image_dirs(
+                in_file[1], self.image_index)
+            image_files = sorted(self.image_info.keys())
+        else:
+            image_files = common.open_and_read_file(in_file[1]).split('\n')
+            image_files = common.trim_list(image_files)
+        pywikibot.output(
+            u"Loaded data files in %.2f s" % (time.time() - start))
 
         return (lido_data, image_files)
 
+    @staticmethod
+    def scan_image_dir(directory):
+        """
+        List the files in an image directory with their size and mtime.
+
+        Uses scandir, if available, to avoid a separate stat call for any
+        non-file entries.
+
+        @param directory: the path to the directory
+        @return: sorted list of [filename, size, mtime] lists
+        """
+        files = []
+        if scandir:
+            for entry in scandir(directory):
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                files.append([entry.name, stat.st_size, stat.st_mtime])
+        else:
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if name.startswith('.') or not os.path.isfile(path):
+                    continue
+                stat = os.stat(path)
+                files.append([name, stat.st_size, stat.st_mtime])
+        return sorted(files)
+
+    @staticmethod
+    def load_image_dirs(image_dirs, index_file):
+        """
+        Find all image files in the given directories.
+
+        The directories are scanned concurrently. The results are stored in
+        an index file and reused for any directory whose mtime is unchanged
+        (i.e. where no files were added, removed or renamed).
+
+        Since a file which is replaced in place does not change the mtime
+        of its directory the size and mtime of such a file remain those of
+        the last scan. These are only informative, remove the index file to
+        force a rescan.
+
+        @param image_dirs: list of paths to image directories
+        @param index_file: path to the index file
+        @return: dict of filename: (directory, size, mtime)
+        @raises common.MyError: if an image directory does not exist
+        """
+        index = {}
+        if os.path.isfile(index_file):
+            index = common.open_and_read_file(index_file, as_json=True)
+
+        to_scan = []
+        for directory in image_dirs:
+            key = os.path.abspath(directory)
+            if not os.path.isdir(directory):
+                raise common.MyError(
+                    u'The provided image directory was not a valid '
+                    u'directory: %s' % directory)
+            mtime = os.stat(directory).st_mtime
+            if key not in index or index[key]['mtime'] != mtime:
+                index[key] = {'mtime': mtime}
+                to_scan.append(key)
+        if to_scan:
+            pool = ThreadPool(min(SCAN_WORKERS, len(to_scan)))
+            try:
+                results = pool.map(NatmusInfo.scan_image_dir, to_scan)
+            finally:
+                pool.close()
+                pool.join()
+            for key, files in zip(to_scan, results):
+                index[key]['files'] = files
+            common.open_and_write_file(index_file, index, as_json=True)
+        pywikibot.output(
+            u"Scanned %d of %d image directories" % (
+                len(to_scan), len(image_dirs)))
+
+        image_info = {}
+        for directory in image_dirs:
+            for name, size, mtime in index[os.path.abspath(directory)][
+                    'files']:
+                if name in image_info:
+                    pywikibot.warning(
+                        u"Found %s in both %s and %s, using the former" % (
+                            name, image_info[name][0], directory))
+                    continue
+                image_info[name] = (directory, size, mtime)
+        return image_info
+
     def load_mappings(self, update=True):
         """
         Load the mapping files and package them appropriately.
@@ -267,18 +1619,15 @@ SELECT ?item ?commons_cat WHERE {
             'Q3305213': 'painting'
         }
 
-        # load mapping and store in uri_ids
-        local_nsid_mapping = common.open_and_read_file(
-            self.local_nsid_mappings, as_json=True)
-        # get common cat for the mapping
-        local_cats = NatmusInfo.load_local_nsid_commonscats(
-            local_nsid_mapping.values())
-
-        # store data in uri_ids
-        for k, v in local_nsid_mapping.iteritems():
-            self.uri_ids[k]['mapped'] = v
-            if v in local_cats.keys():
-                self.uri_ids[k]['cat'] = local_cats[v].get('commons_cat')
+        # store local mapping and common cats in uri_ids, these need not
+        # all be present in the processed data (e.g. if only some obj_ids
+        # are processed)
+        self.wait_for_loaders()
+        for k, v in self.local_nsid_mapping.iteritems():
+            self.uri_ids.setdefault(k, {})['mapped'] = v
+            if v in self.local_cats.keys():
+                self.uri_ids[k]['cat'] = \
+                    self.local_cats[v].get('commons_cat')
 
     def process_data(self, raw_data):
         """
@@ -286,11 +1635,29 @@ SELECT ?item ?commons_cat WHERE {
 
         @param raw_data: output from load_data()
         """
+        self.wait_for_loaders()
         lido_data, image_files = raw_data
+        if self.snapshot and not self.snapshot_data:
+            self.save_snapshot(raw_data)
+        if isinstance(lido_data, dict):
+            lido_data = lido_data.iteritems()
+
+        loose = self.loose_image_matching
+        image_index = NatmusInfo.index_images(image_files, loose)
+        image_set = None if loose else set(image_files)
+        claimed_images = set()
+
         d = {}
-        for key, value in lido_data.iteritems():
+        num_records = 0
+        for key, value in lido_data:
+            num_records += 1
             potential_images = value['images'].keys()
-            matches = set(potential_images) & set(image_files)
+            matches = {}  # filename on disk: filename in LIDO
+            for image in potential_images:
+                for image_file in image_index.get(
+                        NatmusInfo.image_key(image, loose), []):
+                    matches[image_file] = image
+            claimed_images.update(matches)
             if not potential_images:
                 self.log(
                     u"skip_1: "
@@ -300,22 +1667,69 @@ SELECT ?item ?commons_cat WHERE {
                     u"skip_2: "
                     u"%s did not have any associated images on disk" % key)
             elif len(matches) > 1:
+                if loose:
+                    matched = sorted(matches)
+                else:
+                    # same order as when matching without an index
+                    matched = set(potential_images) & image_set
                 self.log(
                     u"skip_3: "
                     u"%s had multiple matching images: %s"
-                    % (key, ', '.join(matches)))
+                    % (key, ', '.join(matched)))
             else:
+                image_file, lido_image = matches.popitem()
                 try:
                     d[key] = NatmusItem.make_item_from_raw(
-                        value, matches.pop(), self)
+                        value, image_file, self, lido_image)
                 except common.MyError as e:
                     self.log(str(e))
 
         pywikibot.output(
             "Identified %d valid paintings out of %d records and %d files" %
-            (len(d), len(lido_data), len(image_files)))
+            (len(d), num_records, len(image_files)))
         self.data = d
 
+        # report images not associated with any record, unless only some
+        # records were processed
+        if not self.obj_ids:
+            orphans = sorted(set(image_files) - claimed_images)
+            for image_file in orphans:
+                self.log(
+                    u"orphan: "
+                    u"%s is not associated with any LIDO record" % image_file)
+            pywikibot.output(
+                "Found %d images not associated with any record" %
+                len(orphans))
+
+    @staticmethod
+    def image_key(filename, loose=False):
+        """
+        Return the key used to match an image filename.
+
+        @param filename: the image filename
+        @param loose: whether to ignore case and file extension
+        @return: str
+        """
+        if loose:
+            return os.path.splitext(filename)[0].lower()
+        return filename
+
+    @staticmethod
+    def index_images(image_files, loose=False):
+        """
+        Index the image filenames by their matching key.
+
+        @param image_files: list of image filenames
+        @param loose: whether to ignore case and file extension
+        @return: dict of lists
+        """
+        index = {}
+        for image_file in image_files:
+            index.setdefault(
+                NatmusInfo.image_key(image_file, loose), []).append(
+                    image_file)
+        return index
+
     @staticmethod
     def get_institution(item):
         """Identify institution and subcollection based on filename."""
@@ -328,7 +1742,7 @@ SELECT ?item ?commons_cat WHERE {
 
     def get_creation_place(self, item):
         """Return a formatted list of creation places."""
-        places = item.get_creation_place()
+        places = item.get_creation_place(self.warning)
         if not places:
             return ''
 
@@ -366,30 +1780,26 @@ SELECT ?item ?commons_cat WHERE {
             nsid = nsid.pop()
         else:
             if len(nsid) > 1:
-                pywikibot.warning(
+                self.warning(
                     "Found multiple ids for depicted person: %s" %
                     ', '.join(nsid))
             nsid = None
 
-        wd_artist = self.wd_creators.get(nsid)
-
-        if wd_artist and wd_artist.get('item') != [ANON_Q]:
-            if wd_artist.get('commons_cats'):
-                item.add_to_tracker('depicted', wd_artist.get('commons_cats'))
-
-            return {
-                'link': wd_artist.get('item')[0],
-                'name': name
-                }
+        resolved = self.resolve_wd_depicted(nsid, name)
+        if resolved:
+            data, trackers = resolved
+            for tracker, entry in trackers:
+                item.add_to_tracker(tracker, entry)
+            return dict(data)
         else:
             # log as missing in wikidata
-            if 'wd' not in self.uri_ids[other_id].keys():
-                self.uri_ids[other_id]['wd'] = set()
+            self.add_wd_candidate('uri_ids', other_id)
 
             # try to use info in wikidata painting object but only in
             # cases where wrong guesses are unlikely
             if len(wd_painting_depicted) == 1 and depicted_count == 1:
-                self.uri_ids[other_id]['wd'].add(wd_painting_depicted[0])
+                self.add_wd_candidate(
+                    'uri_ids', other_id, wd_painting_depicted[0])
 
                 wd_painting = self.wd_paintings.get(item.get_obj_id())
                 if wd_painting.get('depicted_cats'):
@@ -426,6 +1836,37 @@ SELECT ?item ?commons_cat WHERE {
                     'name': name
                     }
 
+    def resolve_wd_depicted(self, nsid, name):
+        """
+        Resolve a depicted person using their wikidata entry, if any.
+
+        The resolutions are cached since the same person is often depicted
+        in several paintings.
+
+        @param nsid: nsid or uri id of the depicted person
+        @param name: name of the depicted person in the lido data
+        @return: (formatting data, tracker entries) tuple, or None if the
+            person has no (non-anonymous) wikidata entry
+        """
+        key = ('depicted', nsid, name, None)
+        if key in self.resolved:
+            self.resolutions['depicted hits'] += 1
+            return self.resolved[key]
+        self.resolutions['depicted misses'] += 1
+
+        resolved = None
+        wd_artist = self.wd_creators.get(nsid)
+        if wd_artist and wd_artist.get('item') != [ANON_Q]:
+            trackers = []
+            if wd_artist.get('commons_cats'):
+                trackers.append(('depicted', wd_artist.get('commons_cats')))
+            resolved = ({
+                'link': wd_artist.get('item')[0],
+                'name': name
+                }, trackers)
+        self.resolved[key] = resolved
+        return resolved
+
     @staticmethod
     def format_depicted_name(depicted_data):
         """Given depicted_data return formatted output."""
@@ -506,36 +1947,16 @@ SELECT ?item ?commons_cat WHERE {
         """
         Return the latest of all found death dates related to a item.
 
+        Makes use of the death years indexed for the painting (via
+        wikidata) and for any of its known lido artists.
+
         @return: int or None
         """
-        # internal markup for unknown or something weird
-        unknown = (u't329875228', u't318787658', u't329488873', u't318035461')
-        deathyears = []
-
-        # via wikidata for item
-        wd_painting = self.wd_paintings.get(item.get_obj_id())
-        if wd_painting and wd_painting.get('death_dates'):
-            deathyears += wd_painting.get('death_dates')
-
-        # via wikidata for knwon lido artist
-        lido_artists = item.get_artists()
-        for nsid in lido_artists.keys():
-            wd_artist = self.wd_creators.get(nsid)
-            if wd_artist and wd_artist.get('death_dates'):
-                deathyears += wd_artist.get('death_dates')
-
-        # remove dupes and unknowns
-        deathyears = list(set(deathyears) - set(unknown))
-
-        # identify the largest
-        year = None
-        for deathyear in deathyears:
-            if not common.is_pos_int(deathyear[:4]):
-                pywikibot.error("Found non-integer deathyear: %s" % deathyear)
-            deathyear = int(deathyear[:4])
+        year = self.deathyears['obj_id'].get(item.get_obj_id())
+        for nsid in item.get_artists().keys():
+            deathyear = self.deathyears['nsid'].get(nsid)
             if deathyear > year:  # works as any int > None
                 year = deathyear
-
         return year
 
     def get_attribution(self, item):
@@ -576,7 +1997,7 @@ SELECT ?item ?commons_cat WHERE {
             if len(types) == 1:
                 typ = types[0]
             elif len(types) > 1:
-                pywikibot.warning(
+                self.warning(
                     "Found %d matching types for %s" %
                     (len(types), item.get_obj_id()))
         return typ
@@ -607,40 +2028,25 @@ SELECT ?item ?commons_cat WHERE {
             qualifier = self.qualifier_mappings.get(artist.get('qualifier'))
 
         name = artist['name']
-        wd_artist = self.wd_creators.get(nsid)
         if not name:  # no name means unknown
             # handle anons
             return None
-        elif wd_artist and wd_artist.get('item') != [ANON_Q]:
-            # use wikidata artist info if exists
-            if wd_artist.get('commons_cats'):
-                item.add_to_tracker('artist', wd_artist.get('commons_cats'))
-            else:
-                item.add_to_tracker('issues', 'wd artist no commonscat')
 
-            creator_templates = wd_artist.get('creator_templates')
-            qid = wd_artist.get('item')[0]
-            if creator_templates and len(creator_templates) == 1:
-                return {
-                    'template': creator_templates[0],
-                    'link': qid,
-                    'qualifier': qualifier
-                    }
-            else:
-                return {
-                    'link': qid,
-                    'name': name,
-                    'qualifier': qualifier
-                    }
+        # use wikidata artist info if exists
+        resolved = self.resolve_wd_artist(nsid, name, artist.get('qualifier'))
+        if resolved:
+            data, trackers = resolved
+            for tracker, entry in trackers:
+                item.add_to_tracker(tracker, entry)
+            return dict(data)
         else:
             # log as missing in wikidata
-            if 'wd' not in self.nsid[nsid].keys():
-                self.nsid[nsid]['wd'] = set()
+            self.add_wd_candidate('nsid', nsid)
 
             # try to use info in wikidata painting object but only in
             # cases where wrong guesses are unlikely
             if len(wd_painting_artists) == 1 and artist_count < 2:
-                self.nsid[nsid]['wd'].add(wd_painting_artists[0])
+                self.add_wd_candidate('nsid', nsid, wd_painting_artists[0])
 
                 wd_painting = self.wd_paintings.get(item.get_obj_id())
                 creator_cats = wd_painting.get('creator_cats')
@@ -681,6 +2087,56 @@ SELECT ?item ?commons_cat WHERE {
                     'qualifier': qualifier
                     }
 
+    def resolve_wd_artist(self, nsid, name, qualifier):
+        """
+        Resolve an artist using their wikidata entry, if any.
+
+        The resolutions are cached since the same artist is often
+        responsible for many paintings.
+
+        @param nsid: nsid of artist
+        @param name: name of artist in the lido data
+        @param qualifier: the unmapped qualifier in the lido data, if any
+        @return: (formatting data, tracker entries) tuple, or None if the
+            artist has no (non-anonymous) wikidata entry
+        """
+        key = ('artist', nsid, name, qualifier)
+        if key in self.resolved:
+            self.resolutions['artist hits'] += 1
+            return self.resolved[key]
+        self.resolutions['artist misses'] += 1
+
+        resolved = None
+        wd_artist = self.wd_creators.get(nsid)
+        if wd_artist and wd_artist.get('item') != [ANON_Q]:
+            if qualifier:
+                qualifier = self.qualifier_mappings.get(qualifier)
+            else:
+                qualifier = None
+
+            if wd_artist.get('commons_cats'):
+                trackers = [('artist', wd_artist.get('commons_cats'))]
+            else:
+                trackers = [('issues', 'wd artist no commonscat')]
+
+            creator_templates = wd_artist.get('creator_templates')
+            qid = wd_artist.get('item')[0]
+            if creator_templates and len(creator_templates) == 1:
+                data = {
+                    'template': creator_templates[0],
+                    'link': qid,
+                    'qualifier': qualifier
+                    }
+            else:
+                data = {
+                    'link': qid,
+                    'name': name,
+                    'qualifier': qualifier
+                    }
+            resolved = (data, trackers)
+        self.resolved[key] = resolved
+        return resolved
+
     @staticmethod
     def format_artist_name(artist_data):
         """Given aritst_data return formatted output."""
@@ -878,6 +2334,202 @@ SELECT ?item ?commons_cat WHERE {
         """Return the original image filename without file extension."""
         return os.path.splitext(item.image)[0]
 
+    def make_item_info(self, item):
+        """
+        Construct the info for a single item.
+
+        The template must be made before the categories since it fills
+        the trackers from which these are taken.
+
+        @param item: the NatmusItem in question
+        @return: dict
+        """
+        info = self.make_info_template(item)
+        content_cats = self.generate_content_cats(item)
+        meta_cats = self.generate_meta_cats(item, content_cats)
+        return {
+            'info': info,
+            'cats': content_cats,
+            'meta_cats': meta_cats,
+            'filename': self.generate_filename(item),
+            'orig_filename': self.get_original_filename(item),
+        }
+
+    def render_item(self, key):
+        """
+        Render a single item, recording rather than applying side effects.
+
+        The side effects, i.e. any logging, warnings and any potential
+        wikidata matches for nsid and uri ids, are returned in the order
+        they occurred so that they can be replayed using replay_effects.
+
+        @param key: the key of the item in self.data
+        @return: (output, side effects) tuple
+        """
+        self.effects = []
+        try:
+            output = self.make_item_info(self.data[key])
+            return output, self.effects
+        finally:
+            self.effects = None
+
+    def render_items(self, keys):
+        """
+        Render several items, in parallel if more than one worker is used.
+
+        The items are rendered by forked worker processes, sharing the
+        already loaded data.
+
+        @param keys: the keys of the items in self.data
+        @return: list of (output, side effects) tuples, see render_item
+        """
+        if self.workers < 2 or len(keys) < 2 or not hasattr(os, 'fork'):
+            return [self.render_item(key) for key in keys]
+
+        global _renderer
+        size = -(-len(keys) // (self.workers * RENDER_CHUNKS))
+        chunks = [keys[i:i + size] for i in range(0, len(keys), size)]
+        _renderer = self
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            results = pool.map(render_items, chunks)
+        finally:
+            pool.close()
+            pool.join()
+            _renderer = None
+        for _, resolutions in results:
+            self.resolutions.update(resolutions)
+        return list(itertools.chain.from_iterable(
+            result for result, _ in results))
+
+    @staticmethod
+    def make_code_fingerprint():
+        """
+        Fingerprint the code used to render the items.
+
+        This is the source of this module and of the batchupload modules
+        it uses for formatting, so that any change to the rendering code
+        invalidates the render cache.
+
+        @return: str
+        """
+        sha1 = hashlib.sha1()
+        for module in (sys.modules[__name__], helpers, common):
+            try:
+                sha1.update(inspect.getsource(module))
+            except (IOError, TypeError):
+                # no source available, use the compiled module
+                with open(module.__file__, 'rb') as f:
+                    sha1.update(f.read())
+        return sha1.hexdigest()
+
+    def item_fingerprint(self, item):
+        """
+        Fingerprint everything which affects the rendering of an item.
+
+        This is the rendering code and the item metadata together with the
+        wikidata data and the mappings used for the painting, its artists
+        and depicted people.
+
+        @param item: the NatmusItem in question
+        @return: str
+        """
+        if self.code_fingerprint is None:
+            self.code_fingerprint = NatmusInfo.make_code_fingerprint()
+        obj_id = item.get_obj_id()
+        fingerprint = [
+            self.code_fingerprint, self.batch_cat, item.get_metadata(),
+            self.wd_paintings.get(obj_id),
+            self.deathyears['obj_id'].get(obj_id)]
+        for nsid, artist in sorted(item.get_artists().iteritems()):
+            fingerprint.append([
+                nsid, self.wd_creators.get(nsid),
+                self.deathyears['nsid'].get(nsid),
+                self.qualifier_mappings.get(artist.get('qualifier'))])
+        for depicted in item.get_depicted():
+            for nsid in (depicted.get('nsid'), depicted.get('other_id')):
+                mapping = self.uri_ids.get(nsid, {})
+                fingerprint.append([
+                    nsid, self.wd_creators.get(nsid),
+                    mapping.get('mapped'), mapping.get('cat')])
+        places = (item.creation_place or {}).get('sv')
+        for place in places.split(', ') if places else []:
+            place = place.split('(')[0].strip()
+            fingerprint.append([place, self.place_mappings.get(place)])
+        return hashlib.sha1(
+            json.dumps(fingerprint, sort_keys=True)).hexdigest()
+
+    def load_render_cache(self):
+        """
+        Load the previously rendered items from the render cache.
+
+        @return: dict of cached items, see save_render_cache
+        """
+        if not self.render_cache or not os.path.isfile(self.render_cache):
+            return {}
+        with open(self.render_cache, 'rb') as f:
+            return cPickle.load(f)
+
+    def save_render_cache(self, cache):
+        """
+        Store the rendered items in the render cache.
+
+        @param cache: dict with the fingerprint, output and side effects
+            of each item
+        """
+        with open(self.render_cache, 'wb') as f:
+            cPickle.dump(cache, f, cPickle.HIGHEST_PROTOCOL)
+        pywikibot.output(u"Created render cache %s" % self.render_cache)
+
+    def make_info(self):
+        """
+        Overload make_info to allow parallel and incremental rendering.
+
+        Items whose fingerprint is unchanged since the previous run are
+        copied from the render cache, the others are rendered, possibly in
+        parallel. The side effects of each item are then replayed in the
+        same order as in a serial run so that the output is identical.
+        """
+        if self.workers < 2 and not self.render_cache:
+            out_data = {}
+            for key, item in self.data.iteritems():
+                out_data[key] = self.make_item_info(item)
+            return out_data
+
+        keys = list(self.data.keys())
+        cache = self.load_render_cache()
+        fingerprints = {}
+        if self.render_cache:
+            for key in keys:
+                fingerprints[key] = self.item_fingerprint(self.data[key])
+        changed = [key for key in keys
+                   if key not in cache or
+                   cache[key]['fingerprint'] != fingerprints.get(key)]
+        rendered = dict(zip(changed, self.render_items(changed)))
+
+        out_data = {}
+        new_cache = {}
+        for key in keys:
+            if key in rendered:
+                output, effects = rendered[key]
+            else:
+                output = cache[key]['output']
+                effects = cache[key]['effects']
+            out_data[key] = output
+            self.replay_effects(effects)
+            new_cache[key] = {
+                'fingerprint': fingerprints.get(key),
+                'output': output,
+                'effects': effects,
+            }
+
+        if self.render_cache:
+            pywikibot.output(
+                u"Rendered %d items and reused %d from the render cache" % (
+                    len(changed), len(keys) - len(changed)))
+            self.save_render_cache(new_cache)
+        return out_data
+
     def run(self, in_file, base_name=None):
         """Overload run to add log outputting."""
         super(NatmusInfo, self).run(in_file, base_name)
@@ -894,6 +2546,12 @@ SELECT ?item ?commons_cat WHERE {
             elif not v.get('wd') and not v.get('mapped') and v.get('freq') > 5:
                 self.log(u'%s: %s' % (k, v))
 
+        for kind in ('artist', 'depicted'):
+            pywikibot.output(
+                u"Resolved %s: %d cache hits and %d misses" % (
+                    kind, self.resolutions['%s hits' % kind],
+                    self.resolutions['%s misses' % kind]))
+
         if base_name:
             logfile = u'%s.log' % base_name
             common.open_and_write_file(logfile, '\n'.join(self.logger))
@@ -915,11 +2573,28 @@ SELECT ?item ?commons_cat WHERE {
             'in_file': None,
             'base_name': None,
             'skip_non_wikidata': False,
-            'nsid_file': None
+            'nsid_file': None,
+            'obj_ids': None,
+            'cache_dir': None,
+            'cache_ttl': CACHE_TTL,
+            'refresh_wikidata': False,
+            'offline': False,
+            'values_chunk_size': VALUES_CHUNK_SIZE,
+            'split_painting_query': False,
+            'wd_index': None,
+            'wd_store': None,
+            'sparql_endpoint': None,
+            'stream_sparql': False,
+            'snapshot': None,
+            'loose_image_matching': False,
+            'image_index': None,
+            'workers': 1,
+            'render_cache': None,
         }
         natmus_options = {
             'lido_file': None,
             'image_files': None,
+            'image_dirs': None,
         }
 
         for arg in pywikibot.handle_args(args):
@@ -935,13 +2610,59 @@ SELECT ?item ?commons_cat WHERE {
                     helpers.convertFromCommandline(value)
             elif option == '-skip_non_wikidata':
                 options['skip_non_wikidata'] = True
+            elif option == '-obj_ids':
+                options['obj_ids'] = common.trim_list(
+                    helpers.convertFromCommandline(value).split(','))
+            elif option == '-cache_dir':
+                options['cache_dir'] = helpers.convertFromCommandline(value)
+            elif option == '-cache_ttl':
+                options['cache_ttl'] = float(value)
+            elif option == '-refresh_wikidata':
+                options['refresh_wikidata'] = True
+            elif option == '-offline':
+                options['offline'] = True
+            elif option == '-values_chunk_size':
+                options['values_chunk_size'] = int(value)
+            elif option == '-split_painting_query':
+                options['split_painting_query'] = True
+            elif option == '-wd_index':
+                options['wd_index'] = helpers.convertFromCommandline(value)
+            elif option == '-wd_store':
+                options['wd_store'] = helpers.convertFromCommandline(value)
+            elif option == '-sparql_endpoint':
+                options['sparql_endpoint'] = value
+            elif option == '-stream_sparql':
+                options['stream_sparql'] = True
+            elif option == '-snapshot':
+                options['snapshot'] = helpers.convertFromCommandline(value)
+            elif option == '-loose_image_matching':
+                options['loose_image_matching'] = True
+            elif option == '-image_dirs':
+                natmus_options['image_dirs'] = common.trim_list(
+                    helpers.convertFromCommandline(value).split(','))
+            elif option == '-image_index':
+                options['image_index'] = \
+                    helpers.convertFromCommandline(value)
+            elif option == '-workers':
+                options['workers'] = int(value)
+            elif option == '-render_cache':
+                options['render_cache'] = \
+                    helpers.convertFromCommandline(value)
 
-        if natmus_options['lido_file'] and natmus_options['image_files']:
-            options['in_file'] = \
-                (natmus_options['lido_file'], natmus_options['image_files'])
+        images = natmus_options['image_dirs'] or natmus_options['image_files']
+        if natmus_options['lido_file'] and images:
+            options['in_file'] = (natmus_options['lido_file'], images)
             options['base_name'] = os.path.join(
                 os.path.split(natmus_options['lido_file'])[0],
                 BASE_NAME)
+            if not options['cache_dir']:
+                options['cache_dir'] = os.path.join(
+                    os.path.split(natmus_options['lido_file'])[0],
+                    CACHE_DIR)
+            if not options['image_index']:
+                options['image_index'] = os.path.join(
+                    os.path.split(natmus_options['lido_file'])[0],
+                    IMAGE_INDEX)
 
         return options
 
@@ -951,10 +2672,43 @@ SELECT ?item ?commons_cat WHERE {
         usage = \
             u'Usage:' \
             u'\tpython Batches/Nationalmuseum/make_Natmus_info.py -lido_file:PATH -image_files:PATH -nsid_file:PATH -dir:PATH\n' \
-            u'\t-lido_file:PATH path to lido metadata file\n' \
+            u'\t-lido_file:PATH path to lido metadata file (.json or .jsonl)\n' \
             u'\t-image_files:PATH path to image filenames file\n' \
+            u'\t-image_dirs:PATH1,PATH2 paths to image directories to scan ' \
+            u'instead of using -image_files\n' \
+            u'\t-image_index:PATH file in which to store the scanned ' \
+            u'image directories (default: image_index.json next to the ' \
+            u'lido file)\n' \
             u'\t-nsid_file:PATH path to local json with nsid mappings\n' \
             u'\t-skip_non_wikidata to skip images without a wikidata entry\n' \
+            u'\t-obj_ids:ID1,ID2 to only process the given obj_ids\n' \
+            u'\t-cache_dir:PATH directory for cached Wikidata query results ' \
+            u'(default: wikidata_cache next to the lido file)\n' \
+            u'\t-cache_ttl:HOURS age after which cached results are ' \
+            u'refetched (default: 24)\n' \
+            u'\t-refresh_wikidata to refetch all Wikidata query results\n' \
+            u'\t-offline to only use cached Wikidata query results\n' \
+            u'\t-values_chunk_size:N max number of qids per commonscat ' \
+            u'query (default: 200)\n' \
+            u'\t-split_painting_query to load the Wikidata paintings ' \
+            u'through several narrow queries\n' \
+            u'\t-wd_index:PATH to load the Wikidata data from an index ' \
+            u'made by make_wikidata_index.py instead of through SPARQL\n' \
+            u'\t-wd_store:PATH sqlite file in which to store the Wikidata ' \
+            u'paintings and artists, reused while from the same source ' \
+            u'and younger than -cache_ttl\n' \
+            u'\t-sparql_endpoint:URL SPARQL endpoint to use instead of the ' \
+            u'Wikidata Query Service, e.g. sparql_standin.py\n' \
+            u'\t-stream_sparql decode the SPARQL responses row by row ' \
+            u'instead of all at once\n' \
+            u'\t-snapshot:PATH file in which to store the loaded data, ' \
+            u'reused while the inputs are unchanged\n' \
+            u'\t-loose_image_matching to ignore case and file extension ' \
+            u'when matching images to records\n' \
+            u'\t-workers:N number of processes in which to render the ' \
+            u'items (default: 1)\n' \
+            u'\t-render_cache:PATH file in which to store the rendered ' \
+            u'items, only items whose inputs changed are then rerendered\n' \
             u'\t-dir:PATH specifies the path to the directory containing a ' \
             u'user_config.py file (optional)\n' \
             u'\tExample:\n' \
@@ -985,17 +2739,20 @@ class NatmusItem(object):
         }
 
     @staticmethod
-    def make_item_from_raw(entry, image_file, natmus_info):
+    def make_item_from_raw(entry, image_file, natmus_info, lido_image=None):
         """
         Given the raw metadata for an item, construct an NatmusItem.
 
         @param entry: the raw metadata entry as a dict
+        @param image_file: the filename of the image on disk
         @param natmus_info: the parent NatmusInfo instance
+        @param lido_image: the filename of the image in the metadata, if
+            different from image_file
         @return: NatmusItem
         """
         d = entry.copy()
         # skip paintings not in wikidata
-        if d['obj_id'] not in natmus_info.wd_paintings.keys() and \
+        if d['obj_id'] not in natmus_info.wd_paintings and \
                 natmus_info.skip_non_wikidata:
             raise common.MyError(
                 u"skip_4: "
@@ -1003,7 +2760,7 @@ class NatmusItem(object):
 
         # add specific image info
         d['image'] = image_file
-        d['photographer'] = d['images'].get(image_file)
+        d['photographer'] = d['images'].get(lido_image or image_file)
 
         # collect nsid entries
         for k in d['creator'].keys():
@@ -1117,6 +2874,13 @@ class NatmusItem(object):
             return u'%s (%s)' % (title, named_creators)
         return title
 
+    def get_metadata(self):
+        """Return the metadata of the item, i.e. excluding any trackers."""
+        return dict(
+            (k, v) for k, v in vars(self).iteritems()
+            if k not in ('issues', 'depicted_cats', 'artist_cats',
+                         'known_trackers'))
+
     def get_obj_id(self):
         """Return the obj_id."""
         return self.obj_id
@@ -1225,12 +2989,16 @@ class NatmusItem(object):
         # all else has failed
         return None
 
-    def get_creation_place(self):
-        """Return a list of creation places in Swedish."""
+    def get_creation_place(self, warning=pywikibot.warning):
+        """
+        Return a list of creation places in Swedish.
+
+        @param warning: the function used to output any warning
+        """
         if not self.creation_place:
             return []
         elif self.creation_place.keys() != ['sv']:
-            pywikibot.warning(
+            warning(
                 "Found unexpected creation_place language: %s" %
                 ', '.join(self.creation_place.keys()))
             return []
@@ -0,0 +1,363 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+Build a local index of the Wikidata entities used by make_Natmus_info.
+
+Streams a Wikidata JSON dump, keeping only the entities with a
+Nationalmuseum object id (P2539) or NSID (P2538), as well as the creators
+and depicted people of the paintings. The index can be passed to
+make_Natmus_info using -wd_index:PATH to run without any SPARQL queries.
+
+Creators and depicted people without a P2538 of their own are picked up
+in the same pass if they come after the painting referring to them. A
+second pass is only made for those which came before it. Only truthy
+statements (i.e. those a wdt: query would return) are used.
+
+usage:
+    python Nationalmuseum/make_wikidata_index.py -dump:PATH [OPTIONS]
+
+&params;
+    -dump:PATH path to the Wikidata JSON dump (optionally .gz or .bz2)
+    -out:PATH path to the index file to create (default:
+        wikidata_index.json)
+    -nsid_file:PATH path to local json with nsid mappings, the commonscats
+        of the mapped qids are then also included in the index
+"""
+import bz2
+import gzip
+import json
+import os
+import re
+import time
+
+import pywikibot
+
+import batchupload.common as common
+
+OUT_FILE = u'wikidata_index.json'
+READ_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 1000000  # number of entities between progress output
+ENTITY_ID = re.compile(r'"id":"(Q\d+)"')
+ENTITY_PROPERTIES = {  # property: key in the index entities
+    'P31': 'types',
+    'P570': 'death_dates',
+    'P1472': 'creator_templates',
+    'P373': 'commons_cats',
+}
+PAINTING_PROPERTIES = {
+    'P2539': 'obj_ids',
+    'P170': 'creators',
+    'P180': 'depicted',
+}
+CREATOR_PROPERTIES = {
+    'P2538': 'nsids',
+}
+
+
+def iter_bz2_chunks(filename):
+    """
+    Read a, possibly multi-stream, bz2 compressed file.
+
+    @param filename: the path to the file to read
+    @return: generator of decompressed strings
+    """
+    decompressor = bz2.BZ2Decompressor()
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            while data:
+                try:
+                    chunk = decompressor.decompress(data)
+                except EOFError:
+                    # the previous stream ended exactly at the end of a read
+                    decompressor = bz2.BZ2Decompressor()
+                    continue
+                yield chunk
+                data = ''
+                if decompressor.unused_data:
+                    # start of a new stream
+                    data = decompressor.unused_data
+                    decompressor = bz2.BZ2Decompressor()
+
+
+def iter_dump_lines(filename):
+    """
+    Read the lines of a, possibly compressed, Wikidata JSON dump.
+
+    @param filename: the path to the dump
+    @return: generator of lines
+    """
+    if filename.endswith('.bz2'):
+        remainder = ''
+        for chunk in iter_bz2_chunks(filename):
+            lines = (remainder + chunk).split('\n')
+            remainder = lines.pop()
+            for line in lines:
+                yield line
+        if remainder:
+            yield remainder
+    else:
+        if filename.endswith('.gz'):
+            dump = gzip.open(filename, 'rb')
+        else:
+            dump = open(filename, 'rb')
+        try:
+            for line in dump:
+                yield line
+        finally:
+            dump.close()
+
+
+def iter_entities(filename, entity_filter):
+    """
+    Load the entities of a Wikidata JSON dump matching a filter.
+
+    The dump contains a json array with one entity per line. The filter
+    is applied to the undecoded line so as to avoid decoding the json of
+    any irrelevant entities.
+
+    @param filename: the path to the dump
+    @param entity_filter: function taking a line and returning a bool
+    @return: generator of dicts
+    """
+    for i, line in enumerate(iter_dump_lines(filename)):
+        if i and not i % PROGRESS_INTERVAL:
+            pywikibot.output(u"Read %d entities" % i)
+        line = line.strip().rstrip(',')
+        if line in ('', '[', ']') or not entity_filter(line):
+            continue
+        yield json.loads(line)
+
+
+def truthy_values(entity, prop):
+    """
+    Return the values of the truthy statements for a property.
+
+    These are the preferred rank statements if there are any, otherwise
+    the normal rank ones. Items are given as qids and dates without any
+    leading +.
+
+    @param entity: the decoded entity
+    @param prop: the property id
+    @return: list
+    """
+    claims = entity.get('claims', {}).get(prop, [])
+    preferred = [c for c in claims if c.get('rank') == 'preferred']
+    claims = preferred or [c for c in claims if c.get('rank') == 'normal']
+
+    values = []
+    for claim in claims:
+        snak = claim['mainsnak']
+        if snak.get('snaktype') != 'value':
+            continue
+        value = snak['datavalue']['value']
+        if isinstance(value, dict):
+            if 'id' in value:
+                value = value['id']
+            elif 'numeric-id' in value:
+                value = u'Q%d' % value['numeric-id']
+            elif 'time' in value:
+                value = value['time'].lstrip('+')
+            else:
+                continue
+        if value not in values:
+            values.append(value)
+    return values
+
+
+def extract_properties(entity, properties):
+    """
+    Extract the truthy values for the given properties.
+
+    @param entity: the decoded entity
+    @param properties: dict of property ids and the keys to store them as
+    @return: dict
+    """
+    data = {}
+    for prop, key in properties.iteritems():
+        data[key] = truthy_values(entity, prop)
+    return data
+
+
+def merge_values(entities, qids, key):
+    """
+    Merge the values for a key across several entities.
+
+    @param entities: dict of extracted entity data
+    @param qids: list of the entities to merge
+    @param key: the key of the values to merge
+    @return: list
+    """
+    values = []
+    for qid in qids:
+        for value in entities.get(qid, {}).get(key, []):
+            if value not in values:
+                values.append(value)
+    return values
+
+
+def build_index(dump, nsid_file=None):
+    """
+    Build the index from a Wikidata JSON dump.
+
+    @param dump: the path to the dump
+    @param nsid_file: path to local json with nsid mappings
+    @return: dict
+    """
+    entities = {}
+    paintings = {}
+    creators = {}
+
+    # other related entities, these are picked up during the first pass if
+    # they follow the painting referring to them. Keeping every entity
+    # which could potentially be needed, i.e. every person and anything
+    # with a commonscat, would not fit in memory for a full dump.
+    needed = set()
+    if nsid_file:
+        needed.update(common.open_and_read_file(
+            nsid_file, as_json=True).values())
+
+    def is_needed(line):
+        match = ENTITY_ID.search(line)
+        return match and match.group(1) in needed
+
+    # first pass: paintings, people with an nsid and any related entities
+    pywikibot.output(u"First pass through %s" % dump)
+    for entity in iter_entities(
+            dump, lambda line: '"P2539"' in line or '"P2538"' in line or
+            is_needed(line)):
+        qid = entity['id']
+        entities[qid] = extract_properties(entity, ENTITY_PROPERTIES)
+        painting = extract_properties(entity, PAINTING_PROPERTIES)
+        if painting['obj_ids']:
+            paintings[qid] = painting
+            needed.update(painting['creators'])
+            needed.update(painting['depicted'])
+        creator = extract_properties(entity, CREATOR_PROPERTIES)
+        if creator['nsids']:
+            creator['label'] = entity.get(
+                'labels', {}).get('sv', {}).get('value', qid)
+            creators[qid] = creator
+
+    # second pass: related entities preceding the painting referring to them
+    needed -= set(entities.keys())
+    if needed:
+        pywikibot.output(
+            u"Second pass through %s for %d entities" % (dump, len(needed)))
+        for entity in iter_entities(dump, is_needed):
+            if entity['id'] in needed:
+                entities[entity['id']] = extract_properties(
+                    entity, ENTITY_PROPERTIES)
+
+    return {
+        'created': time.time(),
+        'dump': os.path.split(dump)[-1],
+        'paintings': format_paintings(paintings, entities),
+        'creators': format_creators(creators, entities),
+        'commons_cats': dict(
+            (qid, data['commons_cats'])
+            for qid, data in entities.iteritems() if data['commons_cats']),
+    }
+
+
+def format_paintings(paintings, entities):
+    """
+    Format the paintings in the same way as NatmusInfo.load_painting_items.
+
+    @param paintings: dict of extracted painting data
+    @param entities: dict of extracted entity data
+    @return: dict
+    """
+    formatted = {}
+    for qid, painting in paintings.iteritems():
+        depicted = [d for d in painting['depicted']
+                    if 'Q5' in entities.get(d, {}).get('types', [])]
+        for obj_id in painting['obj_ids']:
+            formatted[obj_id] = {
+                'item': [qid, ],
+                'obj_id': [obj_id, ],
+                'types': entities[qid]['types'],
+                'creators': painting['creators'],
+                'creator_templates': merge_values(
+                    entities, painting['creators'], 'creator_templates'),
+                'creator_cats': merge_values(
+                    entities, painting['creators'], 'commons_cats'),
+                'death_dates': merge_values(
+                    entities, painting['creators'], 'death_dates'),
+                'commons_cats': entities[qid]['commons_cats'],
+                'depicted_persons': depicted,
+                'depicted_cats': merge_values(
+                    entities, depicted, 'commons_cats'),
+            }
+    return formatted
+
+
+def format_creators(creators, entities):
+    """
+    Format the creators in the same way as NatmusInfo.load_creator_items.
+
+    @param creators: dict of extracted creator data
+    @param entities: dict of extracted entity data
+    @return: dict
+    """
+    formatted = {}
+    for qid, creator in creators.iteritems():
+        for nsid in creator['nsids']:
+            formatted[nsid] = {
+                'item': [qid, ],
+                'itemLabel': [creator['label'], ],
+                'nsid': [nsid, ],
+                'creator_templates': entities[qid]['creator_templates'],
+                'commons_cats': entities[qid]['commons_cats'],
+                'death_dates': entities[qid]['death_dates'],
+            }
+    return formatted
+
+
+def handle_args(args):
+    """
+    Parse and load all of the basic arguments.
+
+    @param args: arguments to be handled
+    @type args: list of strings
+    @return: list of options
+    @rtype: dict
+    """
+    options = {
+        'dump': None,
+        'out': OUT_FILE,
+        'nsid_file': None,
+    }
+
+    for arg in pywikibot.handle_args(args):
+        option, sep, value = arg.partition(':')
+        if option == '-dump':
+            options['dump'] = value
+        elif option == '-out':
+            options['out'] = value
+        elif option == '-nsid_file':
+            options['nsid_file'] = value
+
+    return options
+
+
+def main(*args):
+    """Command line entry-point."""
+    options = handle_args(args)
+    if not options['dump']:
+        pywikibot.error(u"A -dump:PATH must be provided")
+        return
+
+    start = time.time()
+    index = build_index(options['dump'], options['nsid_file'])
+    common.open_and_write_file(options['out'], index, as_json=True)
+    pywikibot.output(
+        u"Created %s with %d paintings and %d artists in %.1f s" % (
+            options['out'], len(index['paintings']),
+            len(index['creators']), time.time() - start))
+
+
+if __name__ == "__main__":
+    main()
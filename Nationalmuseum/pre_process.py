@@ -6,16 +6,122 @@ Isolate relevant information from Lido XML files and dump to local json
 Any unrecognized LIDO tags are flagged so that they can be processed later.
 
 run as python Batches/Nationalmuseum/pre_process.py
+options:
+    -workers:N to spread the parsing over N processes (N defaults to the
+        number of cpus)
+    -streaming to use the incremental reader instead of xmltodict
+    -dump:PATH to read all records from a single (optionally gzip or bz2
+        compressed) LIDO file instead of from the xml directory
+    -archive:PATH to read the xml files directly from a .zip or .tar (.tar.gz,
+        .tar.bz2) archive instead of from the xml directory
+    -incremental to only re-parse the xml files which were added or modified
+        since the last run with this option, not together with -dump or
+        -archive
+    -verbose_tags to output any unhandled LIDO tags for each file rather
+        than only a summary at the end
+    -jsonl to write the output as json lines (one record per line, written
+        as soon as it is processed) instead of as a single json dict. A
+        sorted binary index of the position of each record in the file is
+        written to processed_lido.jsonl.idx
 """
 import batchupload.common as common  # temp before this is merged with helper
 import batchupload.prepUpload as prep
+import bz2
+import functools
+import gzip
+import hashlib
+import inspect
+import io
+import re
+import itertools
+import json
+import multiprocessing
 import os
 import pywikibot
+import struct
+import sys
+import tarfile
 import xmltodict
+import zipfile
 from collections import OrderedDict
+from xml.parsers import expat
 
 MAIN_DIR = u'Batches/Nationalmuseum/'
 XML_DIR = u'LIDO XML/valid_items_transform_1618/16-09-07_14_46_28/'
+CHUNK_SIZE = 16  # number of files handed to a worker process at a time
+READ_SIZE = 64 * 1024  # bytes fed to the streaming reader at a time
+MANIFEST_FILE = u'processed_lido.manifest.json'
+# the index of a json lines output is a header followed by one fixed width
+# entry per record, sorted by obj_id, see LidoLinesOutput
+INDEX_MAGIC = b'LIDX1'
+INDEX_HEADER = struct.Struct('<5sI')  # magic, width of the obj_id field
+INDEX_ENTRY = '<%dsQI'  # obj_id (utf-8, null padded), offset, length
+MEASUREMENT_CACHE_SIZE = 4096
+MISSED_TAG_EXAMPLES = 3  # number of example files to give per missed tag
+
+MEASUREMENT_UNITS = ('cm', 'mm')
+MEASUREMENT_PREFIXES = {  # prefix: key used in output
+    u'_': u'_',
+    u'Mått': u'_',
+    u'Ram': u'Framed',
+}
+SKIPPED_MEASUREMENT_PREFIXES = (
+    u'Vikt', u'Trpram', u'Spännram', u'Montering', u'Yttermått',
+    u'Rymd', u'Passepartout')
+# the words of a measurement are separated by single spaces, the prefix is
+# the first word unless that is numeric, in which case there is no prefix.
+# The unit is normally the last word, otherwise it is guessed from its
+# position after one, two or three values (each value being followed by an
+# x, except the last).
+MEASUREMENT = re.compile(r'''
+    (?:(?![0-9,]*(?:\ |\Z))(?P<prefix>[^\ ]*)(?:\ |\Z))?
+    (?:
+        # any values followed by the unit
+        (?:(?P<values>.*)\ )?(?P<unit>%(units)s)
+        # one value, normally indicates a comment
+      | (?P<comment>[^\ ]*\ (?:%(units)s)\ .*)
+        # two or three values followed by something else
+      | (?P<trimmed_values>[^\ ]*(?:\ [^\ ]*){2}|[^\ ]*(?:\ [^\ ]*){4})
+        \ (?P<trimmed_unit>%(units)s)\ .*
+      | (?P<no_unit>.*)
+    )\Z''' % {'units': '|'.join(MEASUREMENT_UNITS)},
+    re.DOTALL | re.VERBOSE)
+
+# The children whose content is read by InfoEntry, for each level (given as
+# the path below lido:lido) where it only reads some of the children. Any
+# other children at these levels are kept as empty tags by the streaming
+# reader so that flag_missed_tags() still sees them.
+USED_LIDO_TAGS = {
+    (): (
+        u'lido:objectPublishedID', u'lido:administrativeMetadata',
+        u'lido:descriptiveMetadata'),
+    (u'lido:administrativeMetadata', ): (
+        u'lido:recordWrap', u'lido:resourceWrap'),
+    (u'lido:administrativeMetadata', u'lido:recordWrap'): (
+        u'lido:recordID', ),
+    (u'lido:administrativeMetadata', u'lido:resourceWrap'): (
+        u'lido:resourceSet', ),
+    (u'lido:administrativeMetadata', u'lido:resourceWrap',
+     u'lido:resourceSet'): (
+        u'lido:resourceRepresentation', u'lido:rightsResource'),
+    (u'lido:descriptiveMetadata', ): (
+        u'lido:objectIdentificationWrap', u'lido:eventWrap',
+        u'lido:objectRelationWrap'),
+    (u'lido:descriptiveMetadata', u'lido:objectIdentificationWrap'): (
+        u'lido:titleWrap', u'lido:inscriptionsWrap',
+        u'lido:objectDescriptionWrap', u'lido:objectMeasurementsWrap',
+        u'lido:repositoryWrap'),
+    (u'lido:descriptiveMetadata', u'lido:eventWrap'): (
+        u'lido:eventSet', ),
+    (u'lido:descriptiveMetadata', u'lido:eventWrap', u'lido:eventSet'): (
+        u'lido:event', ),
+    (u'lido:descriptiveMetadata', u'lido:eventWrap', u'lido:eventSet',
+     u'lido:event'): (
+        u'lido:eventType', u'lido:eventActor', u'lido:eventDate',
+        u'lido:eventPlace', u'lido:eventMaterialsTech'),
+    (u'lido:descriptiveMetadata', u'lido:objectRelationWrap'): (
+        u'lido:subjectWrap', ),
+}
 
 
 def load_xml(filename):
@@ -32,44 +138,846 @@ def load_xml(filename):
     return data
 
 
-def process_all_files(base_dir=MAIN_DIR, xml_dir=XML_DIR):
-    """Identify all xml files in a directory, load the data and process."""
+class LidoRecordHandler(object):
+    """
+    Expat handler building xmltodict style dicts for each lido:lido record.
+
+    The structure mimics that of xmltodict.parse() but the content of any
+    tag not listed in USED_LIDO_TAGS is discarded as soon as it is
+    encountered.
+    """
+
+    def __init__(self):
+        """Initialise an empty handler."""
+        self.records = []  # completed records not yet collected
+        self.path = None  # tags below lido:lido, None outside of a record
+        self.stack = []
+        self.item = None
+        self.data = []
+        self.skipped = 0  # depth within a discarded tag
+
+    @staticmethod
+    def push_data(item, key, data):
+        """Add data to an item, converting repeated keys to a list."""
+        if item is None:
+            item = OrderedDict()
+        if key in item:
+            value = item[key]
+            if isinstance(value, list):
+                value.append(data)
+            else:
+                item[key] = [value, data]
+        else:
+            item[key] = data
+        return item
+
+    def start_element(self, name, attrs):
+        """Handle the opening of a tag."""
+        if self.skipped:
+            self.skipped += 1
+            return
+        if self.path is None:
+            if name != u'lido:lido':
+                return
+            self.path = []
+        else:
+            used_tags = USED_LIDO_TAGS.get(tuple(self.path))
+            self.path.append(name)
+            if used_tags is not None and name not in used_tags:
+                self.skipped = 1
+                return
+            self.stack.append((self.item, self.data))
+
+        self.item = OrderedDict(
+            (u'@%s' % attrs[i], attrs[i + 1])
+            for i in range(0, len(attrs), 2)) or None
+        self.data = []
+
+    def end_element(self, name):
+        """Handle the closing of a tag."""
+        if self.skipped:
+            self.skipped -= 1
+            if not self.skipped:
+                self.path.pop()
+                self.item = self.push_data(self.item, name, None)
+            return
+        if self.path is None:
+            return
+
+        data = u''.join(self.data).strip() or None
+        item = self.item
+        if item is not None and data:
+            self.push_data(item, u'#text', data)
+        elif item is None:
+            item = data
+
+        if not self.path:
+            # closing lido:lido
+            self.records.append(item)
+            self.path = None
+            self.item = None
+            self.data = []
+            return
+
+        self.path.pop()
+        self.item, self.data = self.stack.pop()
+        self.item = self.push_data(self.item, name, item)
+
+    def characters(self, data):
+        """Handle text content."""
+        if self.path is not None and not self.skipped:
+            self.data.append(data)
+
+
+def iter_lido_records(xml_file):
+    """
+    Incrementally parse an xml file and yield each lido:lido record.
+
+    @param xml_file: an open file object, read as bytes
+    @return: generator of xmltodict style dicts
+    """
+    handler = LidoRecordHandler()
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start_element
+    parser.EndElementHandler = handler.end_element
+    parser.CharacterDataHandler = handler.characters
+
+    while True:
+        chunk = xml_file.read(READ_SIZE)
+        parser.Parse(chunk, not chunk)
+        for record in handler.records:
+            yield record
+        del handler.records[:]
+        if not chunk:
+            break
+
+
+def wrap_records(records, source_file):
+    """
+    Wrap lido:lido records in the same structure as given by load_xml().
+
+    @param records: list of records as output by iter_lido_records()
+    @param source_file: the name of the file the records came from
+    @return: dict
+    """
+    if not records:
+        records = None
+    elif len(records) == 1:
+        records = records[0]
+    data = OrderedDict()
+    data[u'lido:lidoWrap'] = OrderedDict([(u'lido:lido', records)])
+    data['source_file'] = source_file
+    return data
+
+
+def load_xml_streaming(filename):
+    """
+    Load the data from an xml file using the incremental reader.
+
+    The output can be used in place of that of load_xml() but only retains
+    the parts of the LIDO record which are used by InfoEntry.
+
+    @param filename: the path to the file to open
+    @return: dict
+    """
+    with open(filename, 'rb') as f:
+        records = list(iter_lido_records(f))
+    return wrap_records(records, os.path.split(filename)[-1])
+
+
+def load_xml_content(content, source_file, streaming=False):
+    """
+    Load the data from the contents of an xml file.
+
+    @param content: the contents of the xml file, as bytes
+    @param source_file: the name of the xml file
+    @param streaming: whether to use the incremental reader
+    @return: dict
+    """
+    if streaming:
+        return wrap_records(
+            list(iter_lido_records(io.BytesIO(content))), source_file)
+    data = xmltodict.parse(content)
+    data['source_file'] = source_file
+    return data
+
+
+def load_dump(filename):
+    """
+    Load the records from an aggregated LIDO file one at a time.
+
+    The file may be gzip or bz2 compressed. Only a single record is held in
+    memory at any time.
+
+    @param filename: the path to the file to open
+    @return: generator of dicts in the same format as load_xml()
+    """
+    dump_name = os.path.split(filename)[-1]
+    if filename.endswith('.gz'):
+        dump = gzip.open(filename, 'rb')
+    elif filename.endswith('.bz2'):
+        dump = bz2.BZ2File(filename, 'rb')
+    else:
+        dump = open(filename, 'rb')
+
+    try:
+        for i, record in enumerate(iter_lido_records(dump)):
+            yield wrap_records([record, ], u'%s:%d' % (dump_name, i + 1))
+    finally:
+        dump.close()
+
+
+def list_zip_members(filename):
+    """Return the sorted names of all xml files in a zip archive."""
+    zip_file = zipfile.ZipFile(filename)
+    try:
+        return sorted(name for name in zip_file.namelist()
+                      if name.endswith('.xml'))
+    finally:
+        zip_file.close()
+
+
+def iter_tar_members(filename):
+    """
+    Read the xml files in a tar archive one at a time.
+
+    The archive is read as a stream so compressed archives are only
+    decompressed once. The files are therefore returned in archive order.
+
+    @param filename: the path to the tar archive
+    @return: generator of (member name, content) tuples
+    """
+    tar_file = tarfile.open(filename, 'r|*')
+    try:
+        for member in tar_file:
+            if member.isfile() and member.name.endswith('.xml'):
+                yield (member.name, tar_file.extractfile(member).read())
+    finally:
+        tar_file.close()
+
+
+class ProcessingStats(object):
+    """
+    Statistics gathered while processing records.
+
+    These are gathered per record so that they can be passed back from a
+    worker process and merged in the parent.
+    """
+
+    def __init__(self):
+        """Initialise empty statistics."""
+        self.measurement_hits = 0
+        self.measurement_misses = 0
+        self.missed_tags = {}  # level: {tag: count}
+        self.missed_tag_examples = {}  # level: {tag: [source files]}
+        self.messages = []  # (pywikibot output function, text) tuples
+
+    def add_message(self, text, level='warning'):
+        """
+        Add a message to be output once the record is reported on.
+
+        @param text: the message
+        @param level: the name of the pywikibot function used to output it
+        """
+        self.messages.append((level, text))
+
+    def output_messages(self):
+        """Output, and then forget, any collected messages in order."""
+        for level, text in self.messages:
+            getattr(pywikibot, level)(text)
+        del self.messages[:]
+
+    def add_missed_tags(self, level, tags, source_file, count=1):
+        """
+        Add any unhandled tags encountered on a given level.
+
+        @param level: the LIDO level on which the tags were found
+        @param tags: list of unhandled tags
+        @param source_file: the file in which the tags were found
+        @param count: the number of times the tags were encountered
+        """
+        for tag in tags:
+            counts = self.missed_tags.setdefault(level, {})
+            counts[tag] = counts.get(tag, 0) + count
+            examples = self.missed_tag_examples.setdefault(
+                level, {}).setdefault(tag, [])
+            if len(examples) < MISSED_TAG_EXAMPLES and \
+                    source_file not in examples:
+                examples.append(source_file)
+
+    def merge(self, other):
+        """Add the statistics from another ProcessingStats object."""
+        self.measurement_hits += other.measurement_hits
+        self.measurement_misses += other.measurement_misses
+        for level, counts in other.missed_tags.iteritems():
+            for tag, count in counts.iteritems():
+                counts = self.missed_tags.setdefault(level, {})
+                counts[tag] = counts.get(tag, 0) + count
+                examples = self.missed_tag_examples.setdefault(
+                    level, {}).setdefault(tag, [])
+                for example in other.missed_tag_examples[level][tag]:
+                    if len(examples) < MISSED_TAG_EXAMPLES and \
+                            example not in examples:
+                        examples.append(example)
+
+    def output(self):
+        """Output a summary of the statistics."""
+        if self.missed_tags:
+            pywikibot.output(
+                u"Missed the following tags (level: tag (count) examples):")
+            for level in sorted(self.missed_tags.keys()):
+                counts = self.missed_tags[level]
+                for tag in sorted(counts.keys()):
+                    pywikibot.output(u"  '%s': %s (%d) %s" % (
+                        level, tag, counts[tag],
+                        u', '.join(self.missed_tag_examples[level][tag])))
+
+        lookups = self.measurement_hits + self.measurement_misses
+        if lookups:
+            pywikibot.output(
+                "Measurement cache: %d hits out of %d lookups (%.1f%%)" % (
+                    self.measurement_hits, lookups,
+                    100.0 * self.measurement_hits / lookups))
+
+
+def process_xml_data(xml_data, verbose_tags=False):
+    """
+    Process the loaded data for a single record.
+
+    Any error is returned rather than raised, and any warnings are collected
+    in the returned ProcessingStats, so that the output can be done by the
+    parent process, in input order, when this is run in a worker process.
+
+    @param xml_data: the loaded xml data, as output by load_xml()
+    @param verbose_tags: whether to directly output any unhandled tags
+    @return: (dict, None, ProcessingStats) on success,
+        (None, error message, ProcessingStats) on failure
+    """
+    stats = ProcessingStats()
+    hits = MEASUREMENT_CACHE.hits
+    misses = MEASUREMENT_CACHE.misses
+    try:
+        entry = InfoEntry(
+            xml_data, stats=stats, verbose_tags=verbose_tags)
+    except Exception as e:
+        return (None, u"Encountered error while processing %s: %s" %
+                (xml_data['source_file'], e), stats)
+    finally:
+        stats.measurement_hits = MEASUREMENT_CACHE.hits - hits
+        stats.measurement_misses = MEASUREMENT_CACHE.misses - misses
+    return (entry.output(), None, stats)
+
+
+def process_file(xml_file, loader=load_xml, verbose_tags=False):
+    """
+    Load and process a single xml file.
+
+    @param xml_file: the path to the file to process
+    @param loader: the function used to load the xml file
+    @param verbose_tags: whether to directly output any unhandled tags
+    @return: (dict, None, ProcessingStats) on success,
+        (None, error message, None) on failure
+    """
+    try:
+        xml_data = loader(xml_file)
+    except Exception as e:
+        return (None, u"Encountered error while processing %s: %s" %
+                (os.path.split(xml_file)[-1], e), None)
+    return process_xml_data(xml_data, verbose_tags)
+
+
+def process_xml_content(member, streaming=False, verbose_tags=False):
+    """
+    Load and process the contents of a single xml file.
+
+    @param member: (name, content) tuple for the file
+    @param streaming: whether to use the incremental reader
+    @param verbose_tags: whether to directly output any unhandled tags
+    @return: (dict, None, ProcessingStats) on success,
+        (None, error message, None) on failure
+    """
+    name, content = member
+    source_file = name.split('/')[-1]
+    try:
+        xml_data = load_xml_content(content, source_file, streaming)
+    except Exception as e:
+        return (None, u"Encountered error while processing %s: %s" %
+                (source_file, e), None)
+    return process_xml_data(xml_data, verbose_tags)
+
+
+def process_zip_members(names, archive=None, streaming=False,
+                        verbose_tags=False):
+    """
+    Load and process a chunk of xml files in a zip archive.
+
+    The archive is opened once per chunk, and closed again afterwards, so
+    that each worker process can read its members independently.
+
+    @param names: the names of the files in the archive
+    @param archive: the path to the zip archive
+    @param streaming: whether to use the incremental reader
+    @param verbose_tags: whether to directly output any unhandled tags
+    @return: list with, for each file, (dict, None, ProcessingStats) on
+        success and (None, error message, None) on failure
+    """
+    results = []
+    zip_file = zipfile.ZipFile(archive)
+    try:
+        for name in names:
+            try:
+                content = zip_file.read(name)
+            except Exception as e:
+                results.append((
+                    None, u"Encountered error while processing %s: %s" %
+                    (name.split('/')[-1], e), None))
+                continue
+            results.append(
+                process_xml_content((name, content), streaming, verbose_tags))
+    finally:
+        zip_file.close()
+    return results
+
+
+class WorkerCall(object):
+    """
+    Wrap a function run in a worker process.
+
+    Anything raised by the function, including SystemExit, is returned
+    together with the result rather than killing the worker, which would
+    leave the parent waiting for the result forever.
+    """
+
+    def __init__(self, function):
+        """
+        Initialise the wrapper.
+
+        @param function: a module level function taking a single job
+        """
+        self.function = function
+
+    def __call__(self, job):
+        """Return a (result, raised exception) tuple for the job."""
+        try:
+            return (self.function(job), None)
+        except BaseException as e:
+            return (None, e)
+
+
+def map_in_order(function, jobs, workers=None):
+    """
+    Apply a function to each job and yield the results in job order.
+
+    When run in parallel the jobs are handed over in batches so that only a
+    limited number of them are read from the iterable at any one time.
+
+    @param function: a module level function taking a single job
+    @param jobs: iterable of jobs
+    @param workers: number of worker processes to use, anything below 2
+        processes the jobs in this process
+    @return: generator
+    @raises: anything raised by the function, also from a worker process
+    """
+    if not workers or workers < 2:
+        for job in jobs:
+            yield function(job)
+        return
+
+    jobs = iter(jobs)
+    batch_size = workers * CHUNK_SIZE * 4
+    pool = multiprocessing.Pool(workers)
+    try:
+        while True:
+            batch = list(itertools.islice(jobs, batch_size))
+            if not batch:
+                break
+            for result, error in pool.imap(
+                    WorkerCall(function), batch, CHUNK_SIZE):
+                if error is not None:
+                    raise error
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def file_hash(filename):
+    """Return the sha1 hex digest of the contents of a file."""
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def make_code_fingerprint(verbose_tags=False):
+    """
+    Fingerprint the code and settings used to process the files.
+
+    This is the source of this module together with the settings which
+    affect the processing results, so that any change to either
+    invalidates the results stored in the manifest.
+
+    @param verbose_tags: whether unhandled tags are output for each file
+    @return: str
+    """
+    sha1 = hashlib.sha1()
+    module = sys.modules[__name__]
+    try:
+        sha1.update(inspect.getsource(module))
+    except (IOError, TypeError):
+        # no source available, use the compiled module
+        with open(module.__file__, 'rb') as f:
+            sha1.update(f.read())
+    sha1.update(repr({'verbose_tags': verbose_tags}))
+    return sha1.hexdigest()
+
+
+class FileManifest(object):
+    """
+    Fingerprints and processing results of previously processed files.
+
+    Each file is identified by its path relative to the base directory and
+    is considered unchanged if the size and modification time, or failing
+    that the content hash, are the same as when it was last processed.
+
+    The results of the previous run are only reused if they were produced
+    by the same code and settings, as given by the code fingerprint.
+    """
+
+    def __init__(self, filename, base_dir, code_fingerprint=None):
+        """
+        Load a manifest file, if one exists.
+
+        @param filename: the path to the manifest file
+        @param base_dir: the directory to which file paths are relative
+        @param code_fingerprint: fingerprint of the code and settings used
+            to process the files, defaults to make_code_fingerprint()
+        """
+        self.filename = filename
+        self.base_dir = base_dir
+        self.code_fingerprint = code_fingerprint or make_code_fingerprint()
+        self.old_entries = {}
+        self.reuse = True  # whether the previous results can be reused
+        if os.path.isfile(filename):
+            manifest = common.open_and_read_file(filename, as_json=True)
+            self.old_entries = manifest.get('files', {})
+            if manifest.get('code_fingerprint') != self.code_fingerprint:
+                pywikibot.output(
+                    u"The processing code or settings changed since the last "
+                    u"run, re-processing all files")
+                self.reuse = False
+        self.entries = {}
+        self.changes = {'unchanged': [], 'new': [], 'modified': []}
+
+    def check_file(self, xml_file):
+        """
+        Fingerprint a file and compare it to the previous run.
+
+        @param xml_file: the path to the file
+        @return: the previous (output, error, ProcessingStats) if unchanged
+            and reusable, otherwise None
+        """
+        key = os.path.relpath(xml_file, self.base_dir)
+        stat = os.stat(xml_file)
+        old_entry = self.old_entries.get(key)
+        entry = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+        }
+        if old_entry and old_entry['size'] == entry['size'] and \
+                old_entry['mtime'] == entry['mtime']:
+            entry['sha1'] = old_entry['sha1']
+        else:
+            entry['sha1'] = file_hash(xml_file)
+        self.entries[key] = entry
+
+        if not old_entry:
+            self.changes['new'].append(key)
+        elif old_entry['sha1'] != entry['sha1']:
+            self.changes['modified'].append(key)
+        else:
+            self.changes['unchanged'].append(key)
+            if not self.reuse:
+                return None
+            stats = ProcessingStats()
+            missed_tags = old_entry['missed_tags']
+            for level, counts in missed_tags.iteritems():
+                for tag, count in counts.iteritems():
+                    stats.add_missed_tags(
+                        level, [tag, ], os.path.split(xml_file)[-1], count)
+            for level, text in old_entry['messages']:
+                stats.add_message(text, level)
+            stats.measurement_hits, stats.measurement_misses = \
+                old_entry['measurements']
+            result = (old_entry['output'], old_entry['error'], stats)
+            self.store_result(xml_file, result)
+            return result
+
+    def store_result(self, xml_file, result):
+        """Store the result of processing a file."""
+        entry = self.entries[os.path.relpath(xml_file, self.base_dir)]
+        entry['output'], entry['error'], stats = result
+        entry['missed_tags'] = {}
+        entry['messages'] = []
+        entry['measurements'] = (0, 0)
+        if stats:
+            entry['missed_tags'] = stats.missed_tags
+            # copied since the messages are forgotten once output
+            entry['messages'] = list(stats.messages)
+            entry['measurements'] = (
+                stats.measurement_hits, stats.measurement_misses)
+        entry['obj_id'] = None
+        if entry['output']:
+            entry['obj_id'] = entry['output']['obj_id']
+
+    def map_in_order(self, function, xml_files, workers=None):
+        """
+        Variant of map_in_order() which skips any unchanged files.
+
+        The results for any unchanged files are instead taken from the
+        previous run.
+
+        @param function: a module level function taking a single file path
+        @param xml_files: list of file paths
+        @param workers: number of worker processes to use
+        @return: generator
+        """
+        previous = {}
+        to_process = []
+        for xml_file in xml_files:
+            result = self.check_file(xml_file)
+            if result:
+                previous[xml_file] = result
+            else:
+                to_process.append(xml_file)
+
+        processed = map_in_order(function, to_process, workers)
+        for xml_file in xml_files:
+            if xml_file in previous:
+                yield previous[xml_file]
+            else:
+                result = next(processed)
+                self.store_result(xml_file, result)
+                yield result
+
+    def save(self):
+        """Write the manifest to disk and report on any changes."""
+        removed = sorted(set(self.old_entries.keys()) -
+                         set(self.entries.keys()))
+        for key in self.changes['modified']:
+            pywikibot.output(u"Modified file: %s" % key)
+        for key in removed:
+            pywikibot.output(u"Removed file: %s (obj_id: %s)" % (
+                key, self.old_entries[key]['obj_id']))
+        pywikibot.output(
+            "Manifest: %d unchanged, %d new, %d modified and %d removed "
+            "files" % (len(self.changes['unchanged']),
+                       len(self.changes['new']),
+                       len(self.changes['modified']), len(removed)))
+        common.open_and_write_file(
+            self.filename,
+            {'code_fingerprint': self.code_fingerprint,
+             'files': self.entries},
+            as_json=True)
+
+
+class LidoOutput(object):
+    """Collect the processed records and write them as a single json dict."""
+
+    extension = u'json'
+
+    def __init__(self, base_dir):
+        """
+        Initialise the output.
+
+        @param base_dir: the directory in which to store the output
+        """
+        self.filename = os.path.join(
+            base_dir, u'processed_lido.%s' % self.extension)
+        self.source_files = {}  # source file of each added obj_id
+        self.data = {}
+
+    def __len__(self):
+        """Return the number of added records."""
+        return len(self.source_files)
+
+    def add(self, entry):
+        """Add a processed record."""
+        self.source_files[entry['obj_id']] = entry['source_file']
+        self.data[entry['obj_id']] = entry
+
+    def close(self):
+        """Write the output file."""
+        common.open_and_write_file(self.filename, self.data, as_json=True)
+
+
+class LidoLinesOutput(LidoOutput):
+    """
+    Write each processed record as a json line as soon as it is added.
+
+    An index with the byte offset and length of each record is written to
+    a separate file, allowing individual records to be read without
+    decoding the rest of the file. The index entries have a fixed width and
+    are sorted by obj_id so that a record can be looked up by bisecting
+    the index without loading it.
+    """
+
+    extension = u'jsonl'
+
+    def __init__(self, base_dir):
+        """
+        Initialise the output and open the output file.
+
+        @param base_dir: the directory in which to store the output
+        """
+        super(LidoLinesOutput, self).__init__(base_dir)
+        self.index_filename = u'%s.idx' % self.filename
+        self.index = {}  # obj_id: (offset, length)
+        self.out_file = open(self.filename, 'wb')
+
+    def add(self, entry):
+        """Add a processed record."""
+        self.source_files[entry['obj_id']] = entry['source_file']
+        line = json.dumps(entry, sort_keys=True)
+        self.index[entry['obj_id']] = (self.out_file.tell(), len(line))
+        self.out_file.write(line)
+        self.out_file.write('\n')
+
+    def close(self):
+        """Close the output file and write the index."""
+        self.out_file.close()
+        entries = sorted(
+            (obj_id.encode('utf-8'), offset, length)
+            for obj_id, (offset, length) in self.index.iteritems())
+        width = max([len(entry[0]) for entry in entries] or [0])
+        entry_struct = struct.Struct(INDEX_ENTRY % width)
+        with open(self.index_filename, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, width))
+            for entry in entries:
+                f.write(entry_struct.pack(*entry))
+
+
+def process_all_files(base_dir=MAIN_DIR, xml_dir=XML_DIR, workers=None,
+                      streaming=False, dump=None, incremental=False,
+                      jsonl=False, archive=None, verbose_tags=False):
+    """
+    Identify all xml files in a directory, load the data and process.
+
+    @param base_dir: the directory in which to store the output
+    @param xml_dir: the directory, relative to base_dir, with the xml files
+    @param workers: number of processes over which to spread the parsing
+    @param streaming: whether to use the incremental reader
+    @param dump: path to an aggregated LIDO file to use instead of xml_dir
+    @param incremental: whether to only process files which changed since
+        the last run, not used together with dump or archive
+    @param jsonl: whether to output json lines instead of a json dict
+    @param archive: path to a zip or tar archive to use instead of xml_dir,
+        not used together with dump
+    @param verbose_tags: whether to output unhandled tags for each file
+        rather than only as a summary at the end
+    @raises common.MyError: if incremental is combined with dump or
+        archive
+    """
+    if incremental and (dump or archive):
+        raise common.MyError(
+            u'Incremental processing is only possible for the xml directory, '
+            u'not together with a dump or an archive')
+
     # Check categories
-    xml_dir = os.path.join(base_dir, xml_dir)
-    for directory in (base_dir, xml_dir):
+    directories = [base_dir, ]
+    if not (dump or archive):
+        xml_dir = os.path.join(base_dir, xml_dir)
+        directories.append(xml_dir)
+    for directory in directories:
         if not os.path.isdir(directory):
             raise common.MyError(
                 u'The provided directory was not a valid directory: %s'
                 % directory)
 
-    # Find candidate files
-    found_files = prep.find_files(
-        path=xml_dir, file_exts=('.xml', ), subdir=False)
-    pywikibot.output("Found %d .xml files" % len(found_files))
-
-    data = {}
-    for xml_file in found_files:
-        try:
-            test = InfoEntry(load_xml(xml_file))
-        except Exception as e:
-            pywikibot.output(
-                u"Encountered error while processing %s: %s" %
-                (os.path.split(xml_file)[-1], e))
+    chunked = False  # whether each job is a list of files
+    if dump:
+        if not os.path.isfile(dump):
+            raise common.MyError(
+                u'The provided dump was not a valid file: %s' % dump)
+        jobs = load_dump(dump)
+        process = functools.partial(
+            process_xml_data, verbose_tags=verbose_tags)
+    elif archive:
+        if not os.path.isfile(archive):
+            raise common.MyError(
+                u'The provided archive was not a valid file: %s' % archive)
+        if zipfile.is_zipfile(archive):
+            # members can be read independently by each worker
+            names = list_zip_members(archive)
+            pywikibot.output("Found %d .xml files" % len(names))
+            jobs = [names[i:i + CHUNK_SIZE]
+                    for i in range(0, len(names), CHUNK_SIZE)]
+            process = functools.partial(
+                process_zip_members, archive=archive, streaming=streaming,
+                verbose_tags=verbose_tags)
+            chunked = True
+        else:
+            jobs = iter_tar_members(archive)
+            process = functools.partial(
+                process_xml_content, streaming=streaming,
+                verbose_tags=verbose_tags)
+    else:
+        # Find candidate files
+        jobs = prep.find_files(
+            path=xml_dir, file_exts=('.xml', ), subdir=False)
+        pywikibot.output("Found %d .xml files" % len(jobs))
+
+        loader = load_xml
+        if streaming:
+            loader = load_xml_streaming
+        process = functools.partial(
+            process_file, loader=loader, verbose_tags=verbose_tags)
+
+    manifest = None
+    results = map_in_order(process, jobs, workers)
+    if chunked:
+        results = itertools.chain.from_iterable(results)
+    if incremental:
+        manifest = FileManifest(
+            os.path.join(base_dir, MANIFEST_FILE), base_dir,
+            make_code_fingerprint(verbose_tags))
+        results = manifest.map_in_order(process, jobs, workers)
+
+    output = LidoOutput(base_dir)
+    if jsonl:
+        output = LidoLinesOutput(base_dir)
+
+    # results arrive in the same order as the jobs even when run in
+    # parallel so the reporting is the same as for a serial run
+    stats = ProcessingStats()
+    for entry, error, entry_stats in results:
+        if entry_stats:
+            entry_stats.output_messages()
+            stats.merge(entry_stats)
+        if error:
+            pywikibot.output(error)
             continue
-        if test.obj_id in data.keys():
+        if entry['obj_id'] in output.source_files:
             pywikibot.output(
                 u"Multiple files for same object: %s, %s, %s" % (
-                    test.obj_id, test.source_file,
-                    data[test.obj_id]['source_file']))
+                    entry['obj_id'], entry['source_file'],
+                    output.source_files[entry['obj_id']]))
             continue
-        data[test.obj_id] = test.output()
+        output.add(entry)
+
+    output.close()
+    pywikibot.output(
+        "Created %s with %d entries" % (output.filename, len(output)))
+    stats.output()
 
-    out_file = os.path.join(base_dir, u'processed_lido.json')
-    common.open_and_write_file(out_file, data, as_json=True)
-    pywikibot.output("Created %s with %d entries" % (out_file, len(data)))
+    if manifest:
+        manifest.save()
 
 
-def get_lang_values_from_set(value_list, subtags=None):
+def get_lang_values_from_set(value_list, subtags=None, stats=None):
     """
     Given a listified result return any non-empty language fields.
 
@@ -79,6 +987,8 @@ def get_lang_values_from_set(value_list, subtags=None):
     @param subtags: the subtag(s) under the value where the data is expected
         must be a tuple if provided with each subsequent tag being one level
         deeper
+    @param stats: ProcessingStats in which to collect any warnings, if not
+        given they are output directly
     @return: dict
     """
     unknown = '_'
@@ -87,10 +997,9 @@ def get_lang_values_from_set(value_list, subtags=None):
         if subtags:
             for tag in subtags:
                 if value_entry.keys() != [tag]:  # expect no other subtag
-                    pywikibot.output(
-                        "Found unexpected tags: %s"
+                    raise common.MyError(
+                        u"Found unexpected tags: %s"
                         % ', '.join(value_entry.keys()))
-                    exit()
                 value_entry = value_entry[tag]
 
         # skip empty entries
@@ -105,19 +1014,135 @@ def get_lang_values_from_set(value_list, subtags=None):
             if value:
                 lang = value_entry.get('@xml:lang') or unknown
                 if lang in result.keys() and value != result[lang]:
-                    pywikibot.warning(
+                    text = (
                         "Found double entries for the same language: %s <-> %s"
                         % (value, result[lang]))
+                    if stats:
+                        stats.add_message(text)
+                    else:
+                        pywikibot.warning(text)
                 result[lang] = value
     return result
 
 
-def flag_missed_tags(data, level, handled, skipped):
-    """Highlight any tags which have not been considered."""
+def flag_missed_tags(data, level, handled, skipped, stats=None,
+                     source_file=None, verbose=True):
+    """
+    Highlight any tags which have not been considered.
+
+    @param stats: ProcessingStats in which to collect any missed tags
+    @param source_file: the file the data came from, used with stats
+    @param verbose: whether to also output any missed tags, via stats if
+        given
+    """
     missed = list(set(data.keys()) - set(handled + skipped))
     if missed:
-        pywikibot.output(u"Missed the following tags on level '%s': %s" % (
-                         level, u', '.join(missed)))
+        if stats:
+            stats.add_missed_tags(level, missed, source_file)
+        if verbose:
+            text = u"Missed the following tags on level '%s': %s" % (
+                level, u', '.join(missed))
+            if stats:
+                stats.add_message(text, 'output')
+            else:
+                pywikibot.output(text)
+
+
+class BoundedCache(object):
+    """
+    Memoize a single argument function using a cache of bounded size.
+
+    Once the cache is full the least recently used entry is dropped for
+    each new one. The number of cache hits and misses are counted.
+    """
+
+    def __init__(self, function, max_size):
+        """
+        Wrap a function in a cache.
+
+        @param function: the function to wrap, it should have no side effects
+        @param max_size: the maximum number of results to store
+        """
+        self.function = function
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, arg):
+        """Return the (possibly cached) result of the function for arg."""
+        try:
+            result = self.cache.pop(arg)
+        except KeyError:
+            self.misses += 1
+            result = self.function(arg)
+            if len(self.cache) >= self.max_size:
+                self.cache.popitem(last=False)
+        else:
+            self.hits += 1
+        self.cache[arg] = result  # (re-)insert as the most recently used
+        return result
+
+
+def _parse_measurement(measurement):
+    """
+    Parse a measurement string, use the cached parse_measurement().
+
+    @return: (prefix, problem, values) where values is a tuple of the unit,
+        height, width and depth
+    """
+    match = MEASUREMENT.match(measurement)
+    prefix = match.group('prefix') or u'_'
+
+    # handle prefix
+    if prefix not in MEASUREMENT_PREFIXES:
+        if prefix in SKIPPED_MEASUREMENT_PREFIXES:
+            return (prefix, 'skipped prefix', None)
+        return (prefix, 'unrecognized prefix', None)
+
+    # handle units
+    if match.group('comment') is not None:
+        return (prefix, 'comment', None)
+    elif match.group('no_unit') is not None:
+        return (prefix, 'unrecognized unit', None)
+    elif match.group('unit'):
+        unit = match.group('unit')
+        values = match.group('values') or u''
+    else:
+        unit = match.group('trimmed_unit')
+        values = match.group('trimmed_values')
+
+    # rejoin numbers and use english decimal sign
+    values = values.replace(' ', '').replace(',', '.').split('x')
+    if len(values) > 3:
+        return (prefix, 'unexpected formating', None)
+
+    values += [None] * (3 - len(values))
+    return (prefix, None, tuple([unit] + values))
+
+
+MEASUREMENT_CACHE = BoundedCache(_parse_measurement, MEASUREMENT_CACHE_SIZE)
+
+
+def parse_measurement(measurement):
+    """
+    Parse a displayObjectMeasurements string, e.g. u'Mått 73 x 60 cm'.
+
+    The parsing is cached, but each call returns a new measurement dict.
+
+    The returned problem is None for a successful parse, in which case
+    measurement is a dict with the unit and values. Otherwise it is one of
+    'skipped prefix', 'unrecognized prefix', 'comment', 'unrecognized unit'
+    or 'unexpected formating'.
+
+    @param measurement: the measurement string
+    @return: (prefix, problem, measurement) where prefix is u'_' if the
+        string had none
+    """
+    prefix, problem, values = MEASUREMENT_CACHE(measurement)
+    if values:
+        values = dict(zip(('unit', 'height', 'width', 'depth'), values))
+    return (prefix, problem, values)
 
 
 def handle_actor(actor):
@@ -136,14 +1161,37 @@ def handle_actor(actor):
 
 
 class InfoEntry(object):
-    """A store for the data extracted from a single xml file."""
+    """
+    A store for the data extracted from a single xml file.
+
+    Uses __slots__ and, unless keep_raw is set, drops the loaded xml tree
+    once the data has been extracted, so as to keep the footprint of
+    each entry small when many are held in memory.
+    """
 
-    def __init__(self, xml_data, debug=False):
-        """Construct an info object from the loaded xml data."""
+    __slots__ = (
+        'source_file', 'raw_data', 'debug', 'stats', 'verbose_tags',
+        'inv_nr', 'obj_id', 'image_license', 'images', 'titles',
+        'inscriptions', 'descriptions', 'measurements', 'techniques',
+        'creation_place', 'creation_date', 'creator', 'subjects')
+
+    def __init__(self, xml_data, debug=False, stats=None, verbose_tags=True,
+                 keep_raw=False):
+        """
+        Construct an info object from the loaded xml data.
+
+        @param xml_data: the loaded xml data, as output by load_xml()
+        @param debug: whether to output debugging info
+        @param stats: ProcessingStats in which to collect any unhandled tags
+        @param verbose_tags: whether to directly output any unhandled tags
+        @param keep_raw: whether to retain the loaded xml data as raw_data
+        """
         # definie any internals
         self.source_file = xml_data['source_file']
-        self.raw_data = xml_data
+        self.raw_data = xml_data if keep_raw else None
         self.debug = debug
+        self.stats = stats
+        self.verbose_tags = verbose_tags
 
         # for debugging
         self._debug(self.source_file)
@@ -156,6 +1204,18 @@ class InfoEntry(object):
         if self.debug:
             pywikibot.output(text)
 
+    def warning(self, text):
+        """Output a warning, or collect it in stats if given."""
+        if self.stats:
+            self.stats.add_message(text)
+        else:
+            pywikibot.warning(text)
+
+    def flag_missed_tags(self, data, level, handled, skipped):
+        """Highlight any tags which have not been considered."""
+        flag_missed_tags(data, level, handled, skipped, self.stats,
+                         self.source_file, self.verbose_tags)
+
     def output(self):
         return {
             'source_file': self.source_file,
@@ -193,7 +1253,7 @@ class InfoEntry(object):
         handled_tags.append(u'lido:descriptiveMetadata')
         self.add_descriptive_data(data[u'lido:descriptiveMetadata'])
 
-        flag_missed_tags(data, '', handled_tags, skipped_tags)
+        self.flag_missed_tags(data, '', handled_tags, skipped_tags)
 
     def add_admin_data(self, data):
         handled_tags = list()
@@ -210,7 +1270,7 @@ class InfoEntry(object):
         handled_tags.append(u'lido:resourceWrap')
         self.add_image_data(data[u'lido:resourceWrap'][u'lido:resourceSet'])
 
-        flag_missed_tags(data, tag, handled_tags, skipped_tags)
+        self.flag_missed_tags(data, tag, handled_tags, skipped_tags)
 
     def add_image_data(self, data):
         handled_tags = list()
@@ -234,7 +1294,7 @@ class InfoEntry(object):
             data[u'lido:rightsResource'].get(u'lido:rightsHolder'))
         if attributions:
             if len(attributions) != len(images):
-                pywikibot.warning(
+                self.warning(
                     "image-attribution missmatch in %s" % self.source_file)
             for i, attribution in enumerate(attributions):
                 self.images[images[i]] = attribution[u'lido:legalBodyName'][u'lido:appellationValue']
@@ -247,7 +1307,7 @@ class InfoEntry(object):
         # add license, just in case
         self.image_license = data[u'lido:rightsResource'][u'lido:rightsType'][u'lido:term']['#text']
 
-        flag_missed_tags(data, tag, handled_tags, skipped_tags)
+        self.flag_missed_tags(data, tag, handled_tags, skipped_tags)
 
     def add_descriptive_data(self, data):
         handled_tags = list()
@@ -267,7 +1327,7 @@ class InfoEntry(object):
         handled_tags.append(u'lido:objectRelationWrap')
         self.add_relation_data(data[u'lido:objectRelationWrap'])
 
-        flag_missed_tags(data, tag, handled_tags, skipped_tags)
+        self.flag_missed_tags(data, tag, handled_tags, skipped_tags)
 
     def add_identification_data(self, data):
         handled_tags = list()
@@ -278,31 +1338,32 @@ class InfoEntry(object):
         handled_tags.append(u'lido:titleWrap')
         titles = common.listify(data[u'lido:titleWrap'][u'lido:titleSet'])
         self.titles = get_lang_values_from_set(
-            titles, (u'lido:appellationValue', ))
+            titles, (u'lido:appellationValue', ), self.stats)
 
         # add incription
         handled_tags.append(u'lido:inscriptionsWrap')
         inscriptions = common.listify(
             data[u'lido:inscriptionsWrap'][u'lido:inscriptions'])
         self.inscriptions = get_lang_values_from_set(
-            inscriptions, (u'lido:inscriptionTranscription', ))
+            inscriptions, (u'lido:inscriptionTranscription', ), self.stats)
 
         # add decription
         handled_tags.append(u'lido:objectDescriptionWrap')
         description_set = data[u'lido:objectDescriptionWrap'][u'lido:objectDescriptionSet']
         if not isinstance(description_set, OrderedDict):
-            pywikibot.warning(
+            self.warning(
                 "Weird things are happening in description field for %s:\n%s"
                 % (self.source_file, description_set))
         descriptions = common.listify(
             description_set[u'lido:descriptiveNoteValue'])
-        self.descriptions = get_lang_values_from_set(descriptions)
+        self.descriptions = get_lang_values_from_set(
+            descriptions, stats=self.stats)
 
         # add measurements
         handled_tags.append(u'lido:objectMeasurementsWrap')
         measurement_set = data[u'lido:objectMeasurementsWrap'][u'lido:objectMeasurementsSet']
         if set(measurement_set.keys()) - set([u'lido:displayObjectMeasurements', u'lido:objectMeasurements']):
-            pywikibot.warning(
+            self.warning(
                 "Weird things are happening in measurement field for %s:\n%s"
                 % (self.source_file, measurement_set))
         self._debug(measurement_set.get(u'lido:displayObjectMeasurements'))
@@ -315,82 +1376,46 @@ class InfoEntry(object):
         handled_tags.append(u'lido:repositoryWrap')
         repository_viaf = data[u'lido:repositoryWrap']['lido:repositorySet']['lido:repositoryName']['lido:legalBodyID']['#text']
         if repository_viaf != u'http://viaf.org/viaf/147742988':
-            pywikibot.warning(
+            self.warning(
                 "Unexpected repoitory in %s: %s"
                 % (self.source_file, repository_viaf))
 
-        flag_missed_tags(data, tag, handled_tags, skipped_tags)
+        self.flag_missed_tags(data, tag, handled_tags, skipped_tags)
 
     def add_meaurements(self, measurements):
-        recognised_units = ('cm', 'mm')
-        recognied_prefixes = {
-            u'_': u'_',
-            u'Mått': u'_',
-            u'Ram': u'Framed',
-        }
-        skipped_prefixes = (
-            u'Vikt', u'Trpram', u'Spännram', u'Montering', u'Yttermått',
-            u'Rymd', u'Passepartout')
         self.measurements = {}
         if not measurements:
             return
 
         for measurement in measurements:
-            parts = measurement.split(' ')
-            # interpret numeric first part as there being no prefix
-            if parts[0].strip('0123456789,') == '':
-                parts.insert(0, '_')
+            prefix, problem, values = parse_measurement(measurement)
 
             # handle prefix
-            if parts[0] not in recognied_prefixes.keys():
-                if parts[0] not in skipped_prefixes:
-                    pywikibot.warning(
+            if problem in ('skipped prefix', 'unrecognized prefix'):
+                if problem == 'unrecognized prefix':
+                    self.warning(
                         "Unrecognized prefix in measurement for %s:\n%s"
                         % (self.source_file, measurement))
                 continue
-            if parts[0] in self.measurements.keys():
-                pywikibot.warning(
+            if prefix in self.measurements.keys():
+                self.warning(
                     "Reused prefix in measurement for %s:\n%s"
                     % (self.source_file, measurement))
                 continue
 
-            # handle units
-            if parts[-1] not in recognised_units:
-                # try an inteligent guess for unit placement
-                if len(parts) > 2 and parts[2] in recognised_units:
-                    # one values (normally indicates a comment)
-                    continue
-                elif len(parts) > 4 and parts[4] in recognised_units:
-                    # two values
-                    parts = parts[:5]
-                elif len(parts) > 6 and parts[6] in recognised_units:
-                    # three values
-                    parts = parts[:7]
-                else:
-                    pywikibot.warning(
-                        "Unrecognized unit in measurement for %s:\n%s"
-                        % (self.source_file, measurement))
-                    continue
-
-            # rejoin numbers and use english decimal sign
-            values = ''.join(parts[1:-1]).replace(',', '.')
-            values = values.split('x')
-            if len(values) not in (1, 2, 3):
-                pywikibot.warning(
+            # handle units and values
+            if problem == 'comment':
+                continue
+            elif problem == 'unrecognized unit':
+                self.warning(
+                    "Unrecognized unit in measurement for %s:\n%s"
+                    % (self.source_file, measurement))
+            elif problem == 'unexpected formating':
+                self.warning(
                     "Unexpected formating of measurement for %s:\n%s"
                     % (self.source_file, measurement))
             else:
-                key = recognied_prefixes[parts[0]]
-                self.measurements[key] = {
-                    'unit': parts[-1],
-                    'height': values[0],
-                    'width': None,
-                    'depth': None
-                }
-                if len(values) >= 2:
-                    self.measurements[key]['width'] = values[1]
-                if len(values) == 3:
-                    self.measurements[key]['depth'] = values[2]
+                self.measurements[MEASUREMENT_PREFIXES[prefix]] = values
 
     def add_event_data(self, events):
         creation_concept = 'http://terminology.lido-schema.org/lido00012'
@@ -403,18 +1428,18 @@ class InfoEntry(object):
         for event in events:
             concept = event[u'lido:event'][u'lido:eventType']['lido:conceptID'][u'#text']
             if concept not in recognised_concepts.values():
-                pywikibot.warning(
+                self.warning(
                     "Unrecognized event concept for %s: %s"
                     % (self.source_file, concept))
             elif concept == creation_concept:
                 if found_creation:
-                    pywikibot.warning(
+                    self.warning(
                         "Multiple creation events for %s" % self.source_file)
                 found_creation = True
                 self.add_creation(event[u'lido:event'])
 
         if not found_creation:
-            pywikibot.warning(
+            self.warning(
                 "No creation event for %s" % self.source_file)
 
     def add_creation(self, event):
@@ -435,22 +1460,24 @@ class InfoEntry(object):
             self.creation_date['earliest'] = event[u'lido:eventDate'][u'lido:date'].get(u'lido:earliestDate')
             self.creation_date['latest'] = event[u'lido:eventDate'][u'lido:date'].get(u'lido:latestDate')
             self.creation_date['text'] = get_lang_values_from_set(
-                common.listify(event[u'lido:eventDate'][u'lido:displayDate']))
+                common.listify(event[u'lido:eventDate'][u'lido:displayDate']),
+                stats=self.stats)
 
         # add creation place
         handled_tags.append(u'lido:eventPlace')
         self.creation_place = get_lang_values_from_set(
             common.listify(
                 event[u'lido:eventPlace'][u'lido:place'][u'lido:namePlaceSet']),
-            (u'lido:appellationValue', ))
+            (u'lido:appellationValue', ), self.stats)
 
         # add materialtech
         handled_tags.append(u'lido:eventMaterialsTech')
         self.techniques = get_lang_values_from_set(
             common.listify(event[u'lido:eventMaterialsTech']),
-            (u'lido:materialsTech', u'lido:termMaterialsTech', u'lido:term'))
+            (u'lido:materialsTech', u'lido:termMaterialsTech', u'lido:term'),
+            self.stats)
 
-        flag_missed_tags(event, tag, handled_tags, skipped_tags)
+        self.flag_missed_tags(event, tag, handled_tags, skipped_tags)
 
     def handle_creators(self, actors):
         creator_roles = (u'Konstnär', u'Utförd av', u'Komp. och utförd av')
@@ -477,7 +1504,7 @@ class InfoEntry(object):
 
         for actor in actors:
             if actor.keys() != [u'lido:actorInRole', ]:
-                pywikibot.warning(
+                self.warning(
                     "Unexpected actor tag for %s:\n%s"
                     % (self.source_file, actor))
                 continue
@@ -487,7 +1514,7 @@ class InfoEntry(object):
             if not actor_role:
                 continue  # empty entry
             elif actor_role not in all_roles:
-                pywikibot.warning(
+                self.warning(
                     "Unexpected actor role for %s:\n%s"
                     % (self.source_file, actor[u'lido:actorInRole'][u'lido:roleActor']))
                 continue
@@ -497,7 +1524,7 @@ class InfoEntry(object):
             # check qualifier
             qualifier = actor[u'lido:actorInRole'].get(u'lido:attributionQualifierActor')
             if qualifier and qualifier not in qualifiers:
-                pywikibot.warning(
+                self.warning(
                     "Unhandled actor qualifier for %s:\n%s"
                     % (self.source_file, qualifier))
                 continue
@@ -528,7 +1555,7 @@ class InfoEntry(object):
                 self.subjects.append(
                     handle_actor(subject[u'lido:actor']))
 
-        flag_missed_tags(data, tag, handled_tags, skipped_tags)
+        self.flag_missed_tags(data, tag, handled_tags, skipped_tags)
 
 
 def test():
@@ -539,9 +1566,58 @@ def test():
     ]
     for filename in filenames:
         data = load_xml(os.path.join(xml_dir, filename))
-        test = InfoEntry(data, debug=True)
+        test = InfoEntry(data, debug=True, keep_raw=True)
         print test.source_file, test.obj_id
 
+
+def handle_args(args):
+    """
+    Parse and load all of the basic arguments.
+
+    @param args: arguments to be handled
+    @type args: list of strings
+    @return: list of options
+    @rtype: dict
+    """
+    options = {
+        'workers': None,
+        'streaming': False,
+        'dump': None,
+        'incremental': False,
+        'jsonl': False,
+        'archive': None,
+        'verbose_tags': False,
+    }
+
+    for arg in pywikibot.handle_args(args):
+        option, sep, value = arg.partition(':')
+        if option == '-workers':
+            if value:
+                options['workers'] = int(value)
+            else:
+                options['workers'] = multiprocessing.cpu_count()
+        elif option == '-streaming':
+            options['streaming'] = True
+        elif option == '-dump':
+            options['dump'] = value
+        elif option == '-incremental':
+            options['incremental'] = True
+        elif option == '-jsonl':
+            options['jsonl'] = True
+        elif option == '-archive':
+            options['archive'] = value
+        elif option == '-verbose_tags':
+            options['verbose_tags'] = True
+
+    return options
+
+
+def main(*args):
+    """Command line entry-point."""
+    options = handle_args(args)
+    process_all_files(**options)
+
+
 if __name__ == "__main__":
-    process_all_files()
+    main()
     #test()
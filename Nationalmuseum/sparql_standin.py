@@ -0,0 +1,403 @@
+#!/usr/bin/python
+# -*- coding: utf-8  -*-
+"""
+A local stand-in for the Wikidata Query Service.
+
+Makes it possible to run, benchmark and test make_Natmus_info without any
+network access. The stand-in answers the queries made by make_Natmus_info,
+either by replaying the results recorded in a query cache directory (as
+created by make_Natmus_info) or from synthetic data scaled relative to
+the size of the real collection.
+
+To record the results of a live run use make_Natmus_info with
+-cache_dir:PATH -refresh_wikidata, to replay them directly from the files
+use -cache_dir:PATH -offline. To instead replay them over HTTP, serve
+them with this script and pass -sparql_endpoint:URL to make_Natmus_info.
+
+usage:
+    python Nationalmuseum/sparql_standin.py [OPTIONS]
+
+&params;
+    -cache_dir:PATH directory with recorded query results to serve, or in
+        which to record the synthetic results when using -generate
+    -scale:N serve synthetic results for a collection N times the size of
+        the real one, used if no -cache_dir is given (default: 1)
+    -port:N the port on which to serve the results (default: 8000)
+    -generate to record the synthetic results for all queries made by
+        make_Natmus_info in -cache_dir, rather than serving anything
+    -nsid_file:PATH where to write the synthetic local nsid mappings when
+        using -generate (default: synthetic_nsid_mapping.json in cache_dir)
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from collections import OrderedDict
+import itertools
+import json
+import os
+import random
+import re
+import urlparse
+
+import pywikibot
+
+import batchupload.common as common
+
+from make_Natmus_info import (
+    CachedQueryService,
+    ENTITY_URL,
+    NatmusInfo,
+    VALUES_CHUNK_SIZE
+)
+
+PORT = 8000
+NUM_PAINTINGS = 5000  # approximate size of the real collection
+NUM_ARTISTS = 1000
+NUM_PEOPLE = 2000  # including the artists
+NUM_MAPPINGS = 50  # entries in the local nsid mapping
+PAINTING_TYPES = ('Q3305213', 'Q132137')
+SELECT_VARIABLES = re.compile(r'SELECT (.*?) WHERE', re.DOTALL)
+VALUES_QIDS = re.compile(r'wd:(Q\d+)')
+
+
+class SyntheticQueryService(object):
+    """
+    Answers the queries made by make_Natmus_info using synthetic data.
+
+    The data is generated from a fixed seed, so identical for a given
+    scale, and is internally consistent so that e.g. the split and the
+    combined painting queries describe the same paintings.
+    """
+
+    def __init__(self, scale=1, seed=0):
+        """
+        Generate the synthetic entities.
+
+        @param scale: the size relative to the real collection
+        @param seed: the seed for the random generator
+        """
+        rand = random.Random(seed)
+        self.people = []
+        for i in range(int(NUM_PEOPLE * scale)):
+            self.people.append({
+                'qid': u'Q%d' % (10000000 + i),
+                'nsid': u'%d' % (1000 + i)
+                if i < NUM_ARTISTS * scale else None,
+                'label': u'Konstnär %d' % i,
+                'human': bool(i % 7),
+                'death_dates': [u'18%02d-01-01T00:00:00Z' % (i % 100)]
+                if i % 3 else [],
+                'creator_templates': [u'Person %d' % i] if not i % 4 else [],
+                'commons_cats': [u'Person %d' % i] if i % 2 else [],
+            })
+        self.entities = dict((p['qid'], p) for p in self.people)
+
+        self.paintings = []
+        for i in range(int(NUM_PAINTINGS * scale)):
+            self.paintings.append({
+                'qid': u'Q%d' % (20000000 + i),
+                'obj_id': u'%d' % (17000000 + i),
+                'types': rand.sample(PAINTING_TYPES, rand.randint(0, 2)),
+                'creators': [p['qid'] for p in rand.sample(
+                    self.people, rand.randint(0, 2))],
+                'commons_cats': [u'Painting %d' % i] if i % 3 else [],
+                'depicted': [p['qid'] for p in rand.sample(
+                    self.people, rand.randint(0, 1))],
+            })
+
+    def local_nsid_mapping(self, size=NUM_MAPPINGS):
+        """
+        Return local nsid mappings to some of the people.
+
+        @param size: the number of mappings
+        @return: dict
+        """
+        return dict(
+            (u'http://kulturnav.org/%d' % i, person['qid'])
+            for i, person in enumerate(self.people[-size:]))
+
+    def values(self, qids, key):
+        """Return the combined values for a key of several entities."""
+        values = []
+        for qid in qids:
+            for value in self.entities[qid][key]:
+                if value not in values:
+                    values.append(value)
+        return values
+
+    def select(self, query):
+        """
+        Answer a SELECT query.
+
+        @param query: the SPARQL query
+        @return: list of dicts
+        """
+        if 'VALUES' in query:
+            return self.select_commonscats(VALUES_QIDS.findall(query))
+        elif 'P2538' in query:
+            return self.select_creators()
+        elif 'P2539' in query and 'group_concat' in query:
+            return self.select_paintings()
+        elif 'P2539' in query:
+            variables = SELECT_VARIABLES.search(query).group(1)
+            return self.select_painting_part(
+                variables.replace('?', '').split())
+        raise common.MyError(u"Unrecognised query: %s" % query)
+
+    def select_commonscats(self, qids):
+        """Answer the commonscat query for the given qids."""
+        rows = []
+        for qid in qids:
+            for cat in self.entities.get(qid, {}).get('commons_cats', []):
+                rows.append({'item': ENTITY_URL + qid, 'commons_cat': cat})
+        return rows
+
+    def select_creators(self):
+        """Answer the query for all people with an nsid."""
+        rows = []
+        for person in self.people:
+            if not person['nsid']:
+                continue
+            rows.append({
+                'item': ENTITY_URL + person['qid'],
+                'itemLabel': person['label'],
+                'nsid': person['nsid'],
+                'creator_templates': u'|'.join(person['creator_templates']),
+                'commons_cats': u'|'.join(person['commons_cats']),
+                'death_dates': u'|'.join(person['death_dates']),
+            })
+        return rows
+
+    def select_paintings(self):
+        """Answer the combined query for all paintings."""
+        rows = []
+        for painting in self.paintings:
+            creators = painting['creators']
+            depicted = [qid for qid in painting['depicted']
+                        if self.entities[qid]['human']]
+            rows.append({
+                'item': ENTITY_URL + painting['qid'],
+                'obj_id': painting['obj_id'],
+                'types': u'|'.join(
+                    ENTITY_URL + qid for qid in painting['types']),
+                'creators': u'|'.join(ENTITY_URL + qid for qid in creators),
+                'creator_templates': u'|'.join(
+                    self.values(creators, 'creator_templates')),
+                'creator_cats': u'|'.join(
+                    self.values(creators, 'commons_cats')),
+                'death_dates': u'|'.join(
+                    self.values(creators, 'death_dates')),
+                'commons_cats': u'|'.join(painting['commons_cats']),
+                'depicted_persons': u'|'.join(
+                    ENTITY_URL + qid for qid in depicted),
+                'depicted_cats': u'|'.join(
+                    self.values(depicted, 'commons_cats')),
+            })
+        return rows
+
+    def select_painting_part(self, variables):
+        """
+        Answer one of the narrow painting queries.
+
+        @param variables: the variables selected by the query
+        @return: list of dicts
+        """
+        rows = []
+        for painting in self.paintings:
+            item = ENTITY_URL + painting['qid']
+            if variables[1] == 'obj_id':
+                for qid in painting['types'] or [None]:
+                    rows.append({
+                        'item': item, 'obj_id': painting['obj_id'],
+                        'type': ENTITY_URL + qid if qid else None})
+            elif variables[1] == 'creator':
+                for qid in painting['creators']:
+                    person = self.entities[qid]
+                    for values in itertools.product(
+                            person['death_dates'] or [None],
+                            person['creator_templates'] or [None],
+                            person['commons_cats'] or [None]):
+                        rows.append(dict(zip(variables, (
+                            item, ENTITY_URL + qid) + values)))
+            elif variables[1] == 'commons_cat':
+                for cat in painting['commons_cats']:
+                    rows.append({'item': item, 'commons_cat': cat})
+            elif variables[1] == 'depicted_person':
+                for qid in painting['depicted']:
+                    person = self.entities[qid]
+                    if not person['human']:
+                        continue
+                    for cat in person['commons_cats'] or [None]:
+                        rows.append({
+                            'item': item,
+                            'depicted_person': ENTITY_URL + qid,
+                            'depicted_cat': cat})
+            else:
+                raise common.MyError(
+                    u"Unrecognised variables: %s" % ', '.join(variables))
+        return rows
+
+
+def to_sparql_json(rows):
+    """
+    Convert query results to the SPARQL 1.1 query results json format.
+
+    @param rows: list of dicts, as returned by select()
+    @return: dict
+    """
+    variables = []
+    bindings = []
+    for row in rows:
+        binding = {}
+        for variable, value in row.iteritems():
+            if variable not in variables:
+                variables.append(variable)
+            if value is None:
+                continue
+            binding[variable] = {
+                'type': 'uri' if value.startswith('http') else 'literal',
+                'value': value,
+            }
+        bindings.append(binding)
+    # the head goes first, as in the responses of the Wikidata Query Service
+    return OrderedDict((
+        ('head', {'vars': variables}),
+        ('results', {'bindings': bindings})))
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Answer SPARQL queries sent by GET or POST using the server's service."""
+
+    def do_GET(self):
+        """Handle a query given in the url."""
+        self.answer(urlparse.urlparse(self.path).query)
+
+    def do_POST(self):
+        """Handle a query given in the request body."""
+        length = int(self.headers.getheader('content-length') or 0)
+        self.answer(self.rfile.read(length))
+
+    def answer(self, parameters):
+        """Answer the query in the url encoded parameters."""
+        query = urlparse.parse_qs(parameters).get('query')
+        if not query:
+            self.send_error(400, 'No query given')
+            return
+        try:
+            rows = self.server.query_service.select(
+                query[0].decode('utf-8'))
+        except common.MyError as e:
+            self.send_error(404, str(e))
+            return
+
+        body = json.dumps(to_sparql_json(rows))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/sparql-results+json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class QueryServer(ThreadingMixIn, HTTPServer):
+    """A threaded HTTP server holding the query service to use."""
+
+    daemon_threads = True
+
+    def __init__(self, port, query_service):
+        """
+        Initialise the server.
+
+        @param port: the port on which to listen
+        @param query_service: object with a select(query) method
+        """
+        HTTPServer.__init__(self, ('localhost', port), QueryHandler)
+        self.query_service = query_service
+
+
+def generate(cache_dir, scale=1, nsid_file=None,
+             chunk_size=VALUES_CHUNK_SIZE):
+    """
+    Record the synthetic results for all queries made by make_Natmus_info.
+
+    @param cache_dir: the directory in which to record the results
+    @param scale: the size relative to the real collection
+    @param nsid_file: where to write the synthetic local nsid mappings
+    @param chunk_size: the max number of qids per commonscat query
+    """
+    synthetic = SyntheticQueryService(scale)
+    nsid_file = nsid_file or os.path.join(
+        cache_dir, u'synthetic_nsid_mapping.json')
+    recorder = CachedQueryService(cache_dir, refresh=True, backend=synthetic)
+
+    common.open_and_write_file(
+        nsid_file, synthetic.local_nsid_mapping(int(NUM_MAPPINGS * scale)),
+        as_json=True)
+    NatmusInfo.load_painting_items(recorder)
+    NatmusInfo.load_painting_items_split(recorder)
+    NatmusInfo.load_creator_items(recorder)
+    NatmusInfo.load_local_nsid_mappings(nsid_file, recorder, chunk_size)
+    pywikibot.output(
+        u"Recorded synthetic results in %s, use with -nsid_file:%s" % (
+            cache_dir, nsid_file))
+
+
+def handle_args(args):
+    """
+    Parse and load all of the basic arguments.
+
+    @param args: arguments to be handled
+    @type args: list of strings
+    @return: list of options
+    @rtype: dict
+    """
+    options = {
+        'cache_dir': None,
+        'scale': 1,
+        'port': PORT,
+        'generate': False,
+        'nsid_file': None,
+    }
+
+    for arg in pywikibot.handle_args(args):
+        option, sep, value = arg.partition(':')
+        if option == '-cache_dir':
+            options['cache_dir'] = value
+        elif option == '-scale':
+            options['scale'] = float(value)
+        elif option == '-port':
+            options['port'] = int(value)
+        elif option == '-generate':
+            options['generate'] = True
+        elif option == '-nsid_file':
+            options['nsid_file'] = value
+
+    return options
+
+
+def main(*args):
+    """Command line entry-point."""
+    options = handle_args(args)
+    if options['generate']:
+        if not options['cache_dir']:
+            pywikibot.error(u"-generate requires a -cache_dir:PATH")
+            return
+        generate(options['cache_dir'], options['scale'],
+                 options['nsid_file'])
+        return
+
+    if options['cache_dir']:
+        query_service = CachedQueryService(options['cache_dir'], offline=True)
+    else:
+        query_service = SyntheticQueryService(options['scale'])
+    server = QueryServer(options['port'], query_service)
+    pywikibot.output(u"Serving SPARQL results on http://localhost:%d/sparql"
+                     % options['port'])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
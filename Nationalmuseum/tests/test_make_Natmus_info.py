@@ -0,0 +1,1460 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for make_Natmus_info."""
+import cPickle
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib
+import urllib2
+
+import batchupload.common as common
+import pywikibot.data.sparql as sparql
+
+import make_Natmus_info
+import pre_process
+from make_Natmus_info import (
+    ENTITY_URL,
+    CachedQueryService,
+    EntityStore,
+    LidoRecordStore,
+    NatmusInfo,
+    iter_sparql_bindings
+)
+from sparql_standin import (
+    QueryHandler,
+    QueryServer,
+    SyntheticQueryService,
+    to_sparql_json
+)
+from tests.utils import DATA_DIR, RecordOutput
+
+MAKE_INFO_DIR = os.path.join(DATA_DIR, u'make_info')
+TIMING = re.compile(r' in \d+\.\d+ s$')
+RENDERED = re.compile(r'Rendered (\d+) items and reused (\d+) ')
+
+
+class FailingQueryService(object):
+    """Query service failing the first queries containing a given text."""
+
+    def __init__(self, backend, match, failures=1, error=None):
+        """
+        Initialise the service.
+
+        @param backend: the query service answering the queries
+        @param match: text contained in the queries which fail
+        @param failures: the number of times the queries fail
+        @param error: the exception raised on failure, None is returned
+            if not given
+        """
+        self.backend = backend
+        self.match = match
+        self.failures = failures
+        self.error = error
+        self.queries = []
+
+    def select(self, query):
+        self.queries.append(query.split('\n')[0])
+        if self.match in query and self.failures:
+            self.failures -= 1
+            if self.error:
+                raise self.error
+            return None
+        return self.backend.select(query)
+
+
+class RecordingQueryService(object):
+    """Query service recording the queries it answers."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.queries = []
+
+    def select(self, query):
+        self.queries.append(query)
+        return self.backend.select(query)
+
+
+class QuietQueryHandler(QueryHandler):
+    """Query handler not logging each request."""
+
+    def log_message(self, *args):
+        pass
+
+
+class MakeInfoTestCase(unittest.TestCase):
+    """Run make_Natmus_info on a small set of records."""
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        for filename in os.listdir(MAKE_INFO_DIR):
+            shutil.copy(os.path.join(MAKE_INFO_DIR, filename), self.base_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def path(self, filename):
+        return os.path.join(self.base_dir, filename)
+
+    def run_make_info(self, *args):
+        """
+        Run make_Natmus_info with the given extra arguments.
+
+        @return: the NatmusInfo object, the output, the log file and the
+            output through pywikibot, leaving out any timings
+        """
+        options = NatmusInfo.handle_args([
+            u'-lido_file:%s' % self.path(u'processed_lido.json'),
+            u'-image_files:%s' % self.path(u'image_files.txt'),
+            u'-nsid_file:%s' % self.path(u'nsid.json'),
+            u'-wd_index:%s' % self.path(u'wd_index.json'),
+        ] + list(args))
+        with RecordOutput() as lines:
+            info = NatmusInfo(**options)
+            info.run(options['in_file'], options['base_name'])
+        with io.open(self.path(u'artwork.json'), encoding='utf-8') as f:
+            output = json.load(f)
+        with io.open(self.path(u'artwork.log'), encoding='utf-8') as f:
+            log = [line for line in f.read().split(u'\n')
+                   if not TIMING.search(line)]
+        lines = [line for line in lines if not TIMING.search(line[1])]
+        return info, output, log, lines
+
+    @staticmethod
+    def without_resolutions(lines):
+        """Leave out the resolution counts, these depend on the caching."""
+        return [line for line in lines if not line[1].startswith(u'Resolved')]
+
+    def update_json(self, filename, function):
+        """Update the contents of a json file in place."""
+        with io.open(self.path(filename), encoding='utf-8') as f:
+            data = json.load(f)
+        function(data)
+        with io.open(self.path(filename), 'w', encoding='utf-8') as f:
+            f.write(json.dumps(data, ensure_ascii=False))
+
+
+class TestWorkers(MakeInfoTestCase):
+    """Test that rendering with -workers gives the same result as without."""
+
+    def test_workers(self):
+        info, output, log, lines = self.run_make_info()
+        self.assertEqual(len(output), 12)
+        self.assertItemsEqual(
+            [text for function, text in lines if function == 'warning'],
+            [u'Found unexpected creation_place language: en, sv',
+             u'Found unexpected creation_place language: en',
+             u'Found unexpected creation_place language: de, sv'])
+        for workers in (2, 3):
+            info, w_output, w_log, w_lines = self.run_make_info(
+                u'-workers:%d' % workers)
+            self.assertEqual(w_output, output)
+            self.assertEqual(w_log, log)
+            self.assertEqual(self.without_resolutions(w_lines),
+                             self.without_resolutions(lines))
+
+
+class TestRenderCache(MakeInfoTestCase):
+    """Test that only items whose inputs changed are rerendered."""
+
+    def setUp(self):
+        super(TestRenderCache, self).setUp()
+        self.render_cache = u'-render_cache:%s' % self.path(u'render.pkl')
+
+    def run_cached(self):
+        """
+        Run make_Natmus_info using the render cache.
+
+        @return: the number of rendered and reused items, and the output,
+            log file and pywikibot output of the run with any render cache
+            reporting left out
+        """
+        info, output, log, lines = self.run_make_info(self.render_cache)
+        counts = None
+        for function, text in lines:
+            match = RENDERED.match(text)
+            if match:
+                counts = (int(match.group(1)), int(match.group(2)))
+        lines = [line for line in self.without_resolutions(lines)
+                 if not (RENDERED.match(line[1]) or
+                         line[1].startswith(u'Created render cache'))]
+        return counts, output, log, lines
+
+    def run_uncached(self):
+        """Run make_Natmus_info without the render cache."""
+        info, output, log, lines = self.run_make_info()
+        return output, log, self.without_resolutions(lines)
+
+    def assert_rerendered_changed_only(self, change):
+        """
+        Check that a change only rerenders the affected items.
+
+        The output with the render cache must be identical to that of a
+        run without it. Any item whose output changed must be rerendered,
+        but not the items unaffected by the change.
+        """
+        old_output = self.run_cached()[1]
+        change()
+        counts, output, log, lines = self.run_cached()
+        self.assertEqual(self.run_uncached(), (output, log, lines))
+        changed = [key for key in output if output[key] != old_output[key]]
+        self.assertTrue(changed)
+        self.assertGreaterEqual(counts[0], len(changed))
+        self.assertLess(counts[0], 12)
+        self.assertEqual(sum(counts), 12)
+
+    def test_unchanged(self):
+        expected = self.run_uncached()
+        counts, output, log, lines = self.run_cached()
+        self.assertEqual(counts, (12, 0))
+        self.assertEqual((output, log, lines), expected)
+        counts, output, log, lines = self.run_cached()
+        self.assertEqual(counts, (0, 12))
+        self.assertEqual((output, log, lines), expected)
+
+    def test_changed_record(self):
+        def change():
+            self.update_json(
+                u'processed_lido.json',
+                lambda data: data[u'7000001'][u'title'].update(
+                    {u'en': u'Another title'}))
+        self.assert_rerendered_changed_only(change)
+
+    def test_changed_wikidata(self):
+        def change(data):
+            data[u'creators'][u'102'][u'creator_templates'] = [
+                u'Another artist']
+        self.assert_rerendered_changed_only(
+            lambda: self.update_json(u'wd_index.json', change))
+
+    def test_changed_mapping(self):
+        def change(data):
+            data[u'http://kulturnav.org/2'] = u'Q801'
+        self.assert_rerendered_changed_only(
+            lambda: self.update_json(u'nsid.json', change))
+
+    def test_changed_code(self):
+        self.run_cached()
+        make_code_fingerprint = NatmusInfo.__dict__['make_code_fingerprint']
+        NatmusInfo.make_code_fingerprint = staticmethod(lambda: u'changed')
+        try:
+            counts = self.run_cached()[0]
+        finally:
+            NatmusInfo.make_code_fingerprint = make_code_fingerprint
+        self.assertEqual(counts, (12, 0))
+
+
+class TestResolutionCache(MakeInfoTestCase):
+    """Test the caching of artist and depicted resolutions."""
+
+    kinds = ('artist', 'depicted')
+
+    def run_uncached(self):
+        """Run make_Natmus_info with the resolution cache emptied on use."""
+        originals = {}
+        for kind in self.kinds:
+            name = 'resolve_wd_%s' % kind
+            originals[name] = getattr(NatmusInfo, name)
+            setattr(NatmusInfo, name, self.uncached(originals[name]))
+        try:
+            return self.run_make_info()
+        finally:
+            for name, original in originals.iteritems():
+                setattr(NatmusInfo, name, original)
+
+    @staticmethod
+    def uncached(resolve):
+        def wrapper(self, *args):
+            self.resolved.clear()
+            return resolve(self, *args)
+        return wrapper
+
+    def lookups(self, info):
+        """Return the number of resolutions of each kind."""
+        return dict(
+            (kind, info.resolutions['%s hits' % kind] +
+             info.resolutions['%s misses' % kind])
+            for kind in self.kinds)
+
+    def test_same_output_as_uncached(self):
+        info, output, log, lines = self.run_make_info()
+        u_info, u_output, u_log, u_lines = self.run_uncached()
+        self.assertEqual((output, log), (u_output, u_log))
+        self.assertEqual(self.without_resolutions(lines),
+                         self.without_resolutions(u_lines))
+
+        self.assertEqual(self.lookups(info), self.lookups(u_info))
+        for kind in self.kinds:
+            self.assertEqual(u_info.resolutions['%s hits' % kind], 0)
+            self.assertGreater(info.resolutions['%s hits' % kind], 0)
+            self.assertEqual(
+                info.resolutions['%s misses' % kind],
+                len([key for key in info.resolved if key[0] == kind]))
+            self.assertIn(
+                ('output', u'Resolved %s: %d cache hits and %d misses' % (
+                    kind, info.resolutions['%s hits' % kind],
+                    info.resolutions['%s misses' % kind])),
+                lines)
+
+    def test_trackers_added_to_each_item(self):
+        info, output = self.run_make_info()[:2]
+        # the artist with nsid 100 has a commonscat in wikidata
+        keys = [key for key, item in info.data.iteritems()
+                if u'100' in item.get_artists()]
+        self.assertGreater(len(keys), 1)
+        for key in keys:
+            self.assertIn(u'Cat artist 0', output[key]['cats'])
+
+    def test_cached_data_is_not_modified(self):
+        info = self.run_make_info()[0]
+        key, resolved = next((key, value)
+                             for key, value in info.resolved.iteritems()
+                             if key[0] == 'artist' and value)
+        data = dict(resolved[0])
+        item = next(item for item in info.data.values()
+                    if key[1] in item.get_artists())
+        artist = info.get_single_artist(
+            key[1], {'name': key[2], 'qualifier': key[3]}, 1, [], item)
+        artist['name'] = u'Changed'
+        self.assertEqual(info.resolved[key][0], data)
+
+    def test_workers(self):
+        info = self.run_make_info()[0]
+        w_info = self.run_make_info(u'-workers:3')[0]
+        self.assertEqual(self.lookups(w_info), self.lookups(info))
+
+
+class TestEntityStore(unittest.TestCase):
+    """Test the sqlite backed mapping of wikidata data."""
+
+    data = {
+        u'Q1': {u'types': [u'Q3305213'], u'creators': []},
+        u'Q2': {u'types': [], u'creators': [u'Q5']},
+        u'Q3': {},
+    }
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.base_dir, u'store.sqlite')
+        EntityStore.create(self.filename, 'paintings', self.data, u'source')
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_mapping(self):
+        store = EntityStore(self.filename, 'paintings')
+        self.assertEqual(len(store), 3)
+        self.assertItemsEqual(store.keys(), self.data.keys())
+        self.assertEqual(dict(store.iteritems()), self.data)
+        for key, value in self.data.iteritems():
+            self.assertIn(key, store)
+            self.assertEqual(store[key], value)
+            self.assertEqual(store.get(key), value)
+        self.assertNotIn(u'Q4', store)
+        self.assertIsNone(store.get(u'Q4'))
+        self.assertEqual(store.get(u'Q4', {}), {})
+        with self.assertRaises(KeyError):
+            store[u'Q4']
+
+    def test_info(self):
+        created, source = EntityStore.info(self.filename, 'paintings')
+        self.assertEqual(source, u'source')
+        self.assertLessEqual(created, time.time())
+        self.assertIsNone(EntityStore.info(self.filename, 'creators'))
+        self.assertIsNone(EntityStore.info(
+            os.path.join(self.base_dir, u'missing.sqlite'), 'paintings'))
+
+        # recreating the table replaces the data and the info
+        EntityStore.create(self.filename, 'paintings', {u'Q4': {}}, u'new')
+        self.assertEqual(
+            EntityStore.info(self.filename, 'paintings')[1], u'new')
+        self.assertEqual(
+            EntityStore(self.filename, 'paintings').keys(), [u'Q4'])
+
+    def test_least_recently_used_evicted(self):
+        store = EntityStore(self.filename, 'paintings', cache_size=2)
+        for key in (u'Q1', u'Q2', u'Q1', u'Q3'):
+            store.get(key)
+        self.assertEqual(store.cache.keys(), [u'Q1', u'Q3'])
+
+        # a cached value is not read from the database
+        store.cache[u'Q1'] = u'cached'
+        self.assertEqual(store[u'Q1'], u'cached')
+        self.assertEqual(store.cache.keys(), [u'Q3', u'Q1'])
+        self.assertEqual(store[u'Q2'], self.data[u'Q2'])
+        self.assertEqual(store.cache.keys(), [u'Q1', u'Q2'])
+
+    def test_pickled(self):
+        store = EntityStore(self.filename, 'paintings')
+        store.get(u'Q1')
+        unpickled = cPickle.loads(cPickle.dumps(store))
+        self.assertEqual(len(unpickled.cache), 0)
+        self.assertIsNone(unpickled.connection)
+        self.assertEqual(unpickled[u'Q2'], self.data[u'Q2'])
+
+    def test_reconnect_after_fork(self):
+        store = EntityStore(self.filename, 'paintings', cache_size=1)
+        self.assertEqual(store[u'Q1'], self.data[u'Q1'])
+        connection = store.connection
+        queue = multiprocessing.Queue()
+
+        def lookup():
+            queue.put((store[u'Q2'], store.connection is connection))
+
+        process = multiprocessing.Process(target=lookup)
+        process.start()
+        result = queue.get(timeout=10)
+        process.join()
+        self.assertEqual(result, (self.data[u'Q2'], False))
+        self.assertIs(store.connection, connection)
+        self.assertEqual(store[u'Q3'], self.data[u'Q3'])
+
+
+class TestWikidataStore(MakeInfoTestCase):
+    """Test the reuse of the wikidata data stored with -wd_store."""
+
+    def setUp(self):
+        super(TestWikidataStore, self).setUp()
+        self.wd_store = self.path(u'wikidata.sqlite')
+
+    def run_stored(self, *args):
+        """
+        Run make_Natmus_info using the wikidata store.
+
+        @return: the NatmusInfo object, the output and log file, and
+            whether the wikidata data was stored anew
+        """
+        info, output, log, lines = self.run_make_info(
+            u'-wd_store:%s' % self.wd_store, *args)
+        stored = (u'output', u'Stored wikidata data in %s' % self.wd_store)
+        return info, output, log, stored in lines, lines
+
+    def assert_same_lookups(self, info, expected):
+        for name in ('wd_paintings', 'wd_creators'):
+            store = getattr(info, name)
+            data = getattr(expected, name)
+            self.assertIsInstance(store, EntityStore)
+            self.assertItemsEqual(store.keys(), data.keys())
+            for key, value in data.iteritems():
+                self.assertEqual(store[key], value)
+            self.assertNotIn(u'missing', store)
+        self.assertEqual(info.deathyears, expected.deathyears)
+
+    def test_reused(self):
+        expected, output, log = self.run_make_info()[:3]
+        for stored in (True, False):
+            info, s_output, s_log, s_stored = self.run_stored()[:4]
+            self.assertEqual(s_stored, stored)
+            self.assertEqual(s_output, output)
+            self.assertEqual(s_log, log)
+            self.assert_same_lookups(info, expected)
+
+    def test_changed_source(self):
+        self.run_stored()
+        os.utime(self.path(u'wd_index.json'), (0, 0))
+        info, output, log, stored, lines = self.run_stored()
+        self.assertTrue(stored)
+        self.assertIn(
+            (u'output', u'Ignoring outdated wikidata store: source changed'),
+            lines)
+
+    def test_expired(self):
+        self.run_stored()
+        info, output, log, stored, lines = self.run_stored(u'-cache_ttl:0')
+        self.assertTrue(stored)
+        self.assertIn(
+            (u'output', u'Ignoring outdated wikidata store: too old'), lines)
+
+        # an expired store is still used offline
+        self.assertFalse(
+            self.run_stored(u'-cache_ttl:0', u'-offline')[3])
+
+    def test_refresh(self):
+        self.run_stored()
+        self.assertTrue(self.run_stored(u'-refresh_wikidata')[3])
+
+
+class TestSnapshot(MakeInfoTestCase):
+    """Test the reuse and invalidation of the loaded state snapshot."""
+
+    def setUp(self):
+        super(TestSnapshot, self).setUp()
+        self.snapshot = self.path(u'snapshot.pkl')
+        self.expected = self.run_make_info()[1:3]
+
+    def run_snapshot(self, *args):
+        """
+        Run make_Natmus_info using the snapshot.
+
+        @return: whether the snapshot was restored, and the pywikibot
+            output about any ignored snapshot
+        """
+        info, output, log, lines = self.run_make_info(
+            u'-snapshot:%s' % self.snapshot, *args)
+        if not args:
+            self.assertEqual((output, log), self.expected)
+        ignored = [text for function, text in lines
+                   if text.startswith(u'Ignoring')]
+        return info.snapshot_data is not None, ignored
+
+    def test_reused(self):
+        self.assertEqual(self.run_snapshot(), (False, []))
+        self.assertTrue(os.path.isfile(self.snapshot))
+        self.assertEqual(self.run_snapshot(), (True, []))
+
+    def test_changed_input(self):
+        for filename in (u'processed_lido.json', u'image_files.txt',
+                         u'nsid.json', u'wd_index.json'):
+            self.run_snapshot()
+            os.utime(self.path(filename), (0, 0))
+            self.assertEqual(
+                self.run_snapshot(),
+                (False, [u'Ignoring outdated snapshot: inputs changed']))
+
+    def test_changed_obj_ids(self):
+        self.run_snapshot(u'-obj_ids:7000000,7000001')
+        self.assertTrue(self.run_snapshot(u'-obj_ids:7000000,7000001')[0])
+        self.assertEqual(
+            self.run_snapshot(u'-obj_ids:7000000'),
+            (False, [u'Ignoring outdated snapshot: inputs changed']))
+
+    def test_expired(self):
+        self.run_snapshot()
+        self.assertEqual(
+            self.run_snapshot(u'-cache_ttl:0'),
+            (False, [u'Ignoring outdated snapshot: too old']))
+        self.run_snapshot()
+        self.assertTrue(self.run_snapshot(u'-cache_ttl:0', u'-offline')[0])
+
+    def test_changed_version(self):
+        self.run_snapshot()
+        version = make_Natmus_info.SNAPSHOT_VERSION
+        make_Natmus_info.SNAPSHOT_VERSION += 1
+        try:
+            self.assertEqual(
+                self.run_snapshot(),
+                (False, [u'Ignoring outdated snapshot: inputs changed']))
+        finally:
+            make_Natmus_info.SNAPSHOT_VERSION = version
+
+    def test_refresh(self):
+        self.run_snapshot()
+        self.assertEqual(self.run_snapshot(u'-refresh_wikidata'),
+                         (False, []))
+
+    def test_unreadable(self):
+        self.run_snapshot()
+        with open(self.snapshot, 'rb') as f:
+            content = f.read()
+        for corrupt in (b'', b'not a pickle', content[:len(content) // 2],
+                        cPickle.dumps([u'old', u'format'])):
+            with open(self.snapshot, 'wb') as f:
+                f.write(corrupt)
+            restored, ignored = self.run_snapshot()
+            self.assertFalse(restored)
+            self.assertEqual(len(ignored), 1)
+            self.assertTrue(
+                ignored[0].startswith(u'Ignoring unreadable snapshot: '))
+            # a new snapshot is stored
+            self.assertTrue(self.run_snapshot()[0])
+
+
+class TestImageDirs(unittest.TestCase):
+    """Test the scanning and indexing of image directories."""
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.index_file = os.path.join(self.base_dir, u'image_index.json')
+        self.image_dirs = [os.path.join(self.base_dir, u'images_%d' % i)
+                           for i in range(2)]
+        for image_dir, names in zip(self.image_dirs, (
+                (u'NM 1.tif', u'NM 2.tif', u'.hidden.tif'),
+                (u'NM 3.tif', u'NM 1.tif'))):
+            os.mkdir(image_dir)
+            for name in names:
+                self.write_file(os.path.join(image_dir, name), name)
+        os.mkdir(os.path.join(self.image_dirs[1], u'NM 4.tif'))
+        self.set_dir_mtimes(1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    @staticmethod
+    def write_file(path, content):
+        with open(path, 'wb') as f:
+            f.write(content.encode('utf-8'))
+
+    def set_dir_mtimes(self, mtime):
+        """Set the mtime of the image directories, without a race."""
+        for image_dir in self.image_dirs:
+            os.utime(image_dir, (mtime, mtime))
+
+    def load(self):
+        """Return the image info and the number of scanned directories."""
+        with RecordOutput() as lines:
+            image_info = NatmusInfo.load_image_dirs(
+                self.image_dirs, self.index_file)
+        scanned = [text for function, text in lines
+                   if text.startswith(u'Scanned')]
+        warnings = [text for function, text in lines
+                    if function == 'warning']
+        return image_info, scanned, warnings
+
+    def expected(self, image_dir, name):
+        stat = os.stat(os.path.join(image_dir, name))
+        return (image_dir, stat.st_size, stat.st_mtime)
+
+    def test_scan(self):
+        image_info, scanned, warnings = self.load()
+        self.assertEqual(image_info, {
+            u'NM 1.tif': self.expected(self.image_dirs[0], u'NM 1.tif'),
+            u'NM 2.tif': self.expected(self.image_dirs[0], u'NM 2.tif'),
+            u'NM 3.tif': self.expected(self.image_dirs[1], u'NM 3.tif'),
+        })
+        self.assertEqual(scanned, [u'Scanned 2 of 2 image directories'])
+        self.assertEqual(warnings, [u'Found NM 1.tif in both %s and %s, '
+                                    u'using the former' % tuple(
+                                        self.image_dirs)])
+        self.assertTrue(os.path.isfile(self.index_file))
+
+    def test_scan_without_scandir(self):
+        expected = self.load()[0]
+        os.remove(self.index_file)
+        original = make_Natmus_info.scandir
+        make_Natmus_info.scandir = None
+        try:
+            self.assertEqual(self.load()[0], expected)
+        finally:
+            make_Natmus_info.scandir = original
+
+    def test_index_reused(self):
+        expected = self.load()[0]
+        original = NatmusInfo.__dict__['scan_image_dir']
+        NatmusInfo.scan_image_dir = staticmethod(None)
+        try:
+            image_info, scanned, warnings = self.load()
+        finally:
+            NatmusInfo.scan_image_dir = original
+        self.assertEqual(image_info, expected)
+        self.assertEqual(scanned, [u'Scanned 0 of 2 image directories'])
+
+    def test_rescan_after_file_added(self):
+        expected = self.load()[0]
+        self.write_file(
+            os.path.join(self.image_dirs[1], u'NM 5.tif'), u'new')
+        os.utime(self.image_dirs[1], (2000, 2000))
+        image_info, scanned, warnings = self.load()
+        self.assertEqual(scanned, [u'Scanned 1 of 2 image directories'])
+        expected[u'NM 5.tif'] = self.expected(self.image_dirs[1], u'NM 5.tif')
+        self.assertEqual(image_info, expected)
+
+    def test_replaced_file_not_rescanned(self):
+        self.load()
+        self.write_file(
+            os.path.join(self.image_dirs[0], u'NM 2.tif'), u'replaced')
+        self.set_dir_mtimes(1000)
+        image_info = self.load()[0]
+        # the size and mtime are those of the last scan
+        self.assertEqual(image_info[u'NM 2.tif'][1], len(u'NM 2.tif'))
+
+        os.remove(self.index_file)
+        image_info = self.load()[0]
+        self.assertEqual(image_info[u'NM 2.tif'][1], len(u'replaced'))
+
+    def test_missing_directory(self):
+        self.load()
+        shutil.rmtree(self.image_dirs[1])
+        with self.assertRaises(common.MyError):
+            self.load()
+        self.image_dirs[1] = os.path.join(self.image_dirs[0], u'NM 1.tif')
+        with self.assertRaises(common.MyError):
+            self.load()
+
+
+def per_item_deathyear(wd_paintings, wd_creators, item):
+    """
+    Compute the death year of an item from all of its death dates.
+
+    This is how the death year was computed, for each item, before the
+    death year index was added.
+    """
+    unknown = (u't329875228', u't318787658', u't329488873', u't318035461')
+    deathyears = []
+    wd_painting = wd_paintings.get(item.get_obj_id())
+    if wd_painting and wd_painting.get('death_dates'):
+        deathyears += wd_painting.get('death_dates')
+    for nsid in item.get_artists().keys():
+        wd_artist = wd_creators.get(nsid)
+        if wd_artist and wd_artist.get('death_dates'):
+            deathyears += wd_artist.get('death_dates')
+    year = None
+    for deathyear in set(deathyears) - set(unknown):
+        deathyear = int(deathyear[:4])
+        if deathyear > year:
+            year = deathyear
+    return year
+
+
+class DeathyearItem(object):
+    """Stand-in for a NatmusItem with only an obj_id and artists."""
+
+    def __init__(self, obj_id, nsids):
+        self.obj_id = obj_id
+        self.nsids = nsids
+
+    def get_obj_id(self):
+        return self.obj_id
+
+    def get_artists(self):
+        return dict((nsid, {}) for nsid in self.nsids)
+
+
+class TestDeathyears(MakeInfoTestCase):
+    """Test that the death year index matches the per item computation."""
+
+    wd_paintings = {
+        u'1': {u'death_dates': [u'1850-01-01T00:00:00Z', u'1790']},
+        u'2': {u'death_dates': []},
+        u'3': {u'death_dates': [u't329875228', u't318787658']},
+        u'4': {},
+        u'5': {u'death_dates': [u'1910', u'c. 1900']},
+    }
+    wd_creators = {
+        u'a': {u'death_dates': [u'1870-05-01T00:00:00Z', u'1870']},
+        u'b': {u'death_dates': [u't329488873', u'1700-01-01T00:00:00Z']},
+        u'c': {u'death_dates': None},
+        u'd': {u'death_dates': [u'-0050', u'1600']},
+    }
+    valid_dates = {
+        u'5': {u'death_dates': [u'1910']},
+        u'd': {u'death_dates': [u'1600']},
+    }
+
+    def build_index(self):
+        info = NatmusInfo.__new__(NatmusInfo)
+        info.wd_paintings = self.wd_paintings
+        info.wd_creators = self.wd_creators
+        info.effects = None
+        info.logger = []
+        with RecordOutput() as lines:
+            info.build_deathyear_index()
+        return info, lines
+
+    def test_same_as_per_item(self):
+        info, lines = self.build_index()
+        self.assertItemsEqual(
+            lines, [(u'error', u'Found non-integer deathyear: c. 1900'),
+                    (u'error', u'Found non-integer deathyear: -0050')])
+        self.assertEqual(info.deathyears, {
+            'obj_id': {u'1': 1850, u'5': 1910},
+            'nsid': {u'a': 1870, u'b': 1700, u'd': 1600}})
+
+        # the non-integer dates are ignored
+        wd_paintings = dict(self.wd_paintings, **self.valid_dates)
+        wd_creators = dict(self.wd_creators, **self.valid_dates)
+        nsids = self.wd_creators.keys() + [u'missing']
+        for obj_id in self.wd_paintings.keys() + [u'missing']:
+            for length in range(3):
+                for combination in itertools.combinations(nsids, length):
+                    item = DeathyearItem(obj_id, combination)
+                    self.assertEqual(
+                        info.get_deathyear(item),
+                        per_item_deathyear(wd_paintings, wd_creators, item),
+                        (obj_id, combination))
+
+    def test_rendered_items(self):
+        info = self.run_make_info()[0]
+        self.assertTrue(info.data)
+        for item in info.data.values():
+            self.assertEqual(
+                info.get_deathyear(item),
+                per_item_deathyear(info.wd_paintings, info.wd_creators,
+                                   item))
+
+
+class TestImageMatching(MakeInfoTestCase):
+    """Test the matching of the LIDO images to the image files."""
+
+    def read_image_files(self):
+        with io.open(self.path(u'image_files.txt'), encoding='utf-8') as f:
+            return f.read().split(u'\n')
+
+    def write_image_files(self, image_files):
+        with io.open(self.path(u'image_files.txt'), 'w',
+                     encoding='utf-8') as f:
+            f.write(u'\n'.join(image_files))
+
+    @staticmethod
+    def skipped(info_log):
+        """Return the log lines about any skipped records."""
+        return [line for line in info_log if line.startswith(u'skip_')]
+
+    @staticmethod
+    def orphans(info_log):
+        """Return the log lines about any images without a record."""
+        return [line for line in info_log if line.startswith(u'orphan: ')]
+
+    def without_index_log(self):
+        """
+        Return the log lines of matching the images without an index.
+
+        This is how the images were matched before the index was added.
+        """
+        lido_data = common.open_and_read_file(
+            self.path(u'processed_lido.json'), as_json=True)
+        image_files = self.read_image_files()
+        log = []
+        for key, value in lido_data.iteritems():
+            potential_images = value['images'].keys()
+            matches = set(potential_images) & set(image_files)
+            if not potential_images:
+                log.append(u"skip_1: "
+                           u"%s did not have any associated images in LIDO"
+                           % key)
+            elif not matches:
+                log.append(u"skip_2: "
+                           u"%s did not have any associated images on disk"
+                           % key)
+            elif len(matches) > 1:
+                log.append(u"skip_3: %s had multiple matching images: %s"
+                           % (key, ', '.join(matches)))
+        return log
+
+    def test_index_images(self):
+        image_files = [u'NM 1.tif', u'nm 1.JPG', u'NM 2.tif', u'NM 1']
+        self.assertEqual(NatmusInfo.index_images(image_files), dict(
+            (image_file, [image_file]) for image_file in image_files))
+        self.assertEqual(NatmusInfo.index_images(image_files, True), {
+            u'nm 1': [u'NM 1.tif', u'nm 1.JPG', u'NM 1'],
+            u'nm 2': [u'NM 2.tif'],
+        })
+
+    def test_same_as_without_index(self):
+        image_files = self.read_image_files()
+        image_files.remove(u'NM 4.tif')
+        self.write_image_files(image_files)
+        log = self.run_make_info()[2]
+        self.assertIn(u'skip_2: 7000004 did not have any associated images '
+                      u'on disk', log)
+        self.assertEqual(self.skipped(log), self.without_index_log())
+        self.assertEqual(self.orphans(log), [])
+
+    def test_orphans(self):
+        self.write_image_files(
+            [u'Other.jpg'] + self.read_image_files() + [u'NM 99.tif'])
+        info, output, log, lines = self.run_make_info()
+        self.assertEqual(
+            self.orphans(log),
+            [u'orphan: NM 99.tif is not associated with any LIDO record',
+             u'orphan: Other.jpg is not associated with any LIDO record'])
+        self.assertIn(
+            ('output', u'Found 2 images not associated with any record'),
+            lines)
+
+        # not reported when only some records are processed
+        info, output, log, lines = self.run_make_info(
+            u'-obj_ids:7000001,7000004')
+        self.assertEqual(len(output), 2)
+        self.assertFalse(self.orphans(log))
+        self.assertFalse(
+            [line for line in lines if u'not associated' in line[1]])
+
+    def test_loose_matching(self):
+        expected = self.run_make_info()[1]
+        image_files = self.read_image_files()
+        image_files[image_files.index(u'NM 1.tif')] = u'nm 1.TIF'
+        image_files[image_files.index(u'NM 4.tif')] = u'NM 4.jpg'
+        image_files[image_files.index(u'NM 9b.tif')] = u'NM 9b.jpg'
+        self.write_image_files(image_files)
+
+        info, output, log, lines = self.run_make_info()
+        self.assertNotIn(u'7000001', output)
+        self.assertNotIn(u'7000004', output)
+        self.assertEqual(self.skipped(log), self.without_index_log())
+        self.assertEqual(self.orphans(log), [
+            u'orphan: %s is not associated with any LIDO record' % image
+            for image in (u'NM 4.jpg', u'NM 9b.jpg', u'nm 1.TIF')])
+
+        info, output, log, lines = self.run_make_info(
+            u'-loose_image_matching')
+        self.assertEqual(sorted(output), sorted(expected))
+        # the filenames on disk are used
+        self.assertEqual(info.data[u'7000004'].image, u'NM 4.jpg')
+        self.assertEqual(info.data[u'7000001'].image, u'nm 1.TIF')
+        self.assertEqual(output[u'7000001']['orig_filename'], u'nm 1')
+        self.assertEqual(
+            [line for line in self.skipped(log)
+             if line.startswith(u'skip_3: 7000009 ')],
+            [u'skip_3: 7000009 had multiple matching images: '
+             u'NM 9.tif, NM 9b.jpg'])
+        self.assertFalse(self.orphans(log))
+
+
+class TestLidoRecordStore(MakeInfoTestCase):
+    """Test the random access to the records of a json lines file."""
+
+    def setUp(self):
+        super(TestLidoRecordStore, self).setUp()
+        self.data = common.open_and_read_file(
+            self.path(u'processed_lido.json'), as_json=True)
+
+    def write_lines(self, data):
+        """Write the records, in unsorted order, as json lines."""
+        output = pre_process.LidoLinesOutput(self.base_dir)
+        for obj_id in sorted(data, key=lambda obj_id: obj_id[::-1]):
+            output.add(data[obj_id])
+        output.close()
+        return output.filename
+
+    def test_records(self):
+        self.data[u'7000\xe5'] = dict(
+            self.data[u'7000000'], obj_id=u'7000\xe5')
+        store = LidoRecordStore(self.write_lines(self.data))
+        try:
+            self.assertEqual(store.keys(), sorted(self.data.keys()))
+            for obj_id, record in self.data.iteritems():
+                self.assertIn(obj_id, store)
+                self.assertEqual(store[obj_id], record)
+            for obj_id in (u'', u'0', u'700000', u'7000007', u'7000022',
+                           u'70000000', u'7000000 '):
+                self.assertNotIn(obj_id, store)
+                with self.assertRaises(KeyError):
+                    store[obj_id]
+        finally:
+            store.close()
+        for closed in (store.index, store.records):
+            with self.assertRaises(ValueError):
+                closed[0]
+
+    def test_no_records(self):
+        store = LidoRecordStore(self.write_lines({}))
+        try:
+            self.assertEqual(store.keys(), [])
+            self.assertNotIn(u'7000000', store)
+        finally:
+            store.close()
+
+    def test_old_index_ignored(self):
+        filename = self.write_lines(self.data)
+        common.open_and_write_file(
+            u'%s.idx' % filename, {u'7000000': [0, 1]}, as_json=True)
+        self.assertFalse(LidoRecordStore.has_index(filename))
+        self.assertEqual(
+            dict(NatmusInfo.iter_selected_records(filename, [u'7000000'])),
+            {u'7000000': self.data[u'7000000']})
+
+    def test_obj_ids_same_as_full_load(self):
+        filename = self.write_lines(self.data)
+        obj_ids = [u'7000004', u'7000000', u'7000099', u'7000021']
+        with RecordOutput() as lines:
+            selected = list(
+                NatmusInfo.iter_selected_records(filename, obj_ids))
+        self.assertEqual(
+            selected, [(obj_id, self.data[obj_id])
+                       for obj_id in obj_ids if obj_id in self.data])
+        self.assertEqual(
+            lines, [('warning', u'Found no lido record for obj_id: 7000099')])
+
+        output = self.run_make_info()[1]
+        selected_output = self.run_make_info(
+            u'-lido_file:%s' % filename,
+            u'-obj_ids:%s' % u','.join(obj_ids))[1]
+        self.assertTrue(selected_output)
+        self.assertLess(len(selected_output), len(output))
+        for key, item in selected_output.iteritems():
+            self.assertEqual(item, output[key])
+
+
+class TestPaintingLoaders(unittest.TestCase):
+    """Test that the split painting loader matches the combined one."""
+
+    def setUp(self):
+        self.synthetic = SyntheticQueryService(0.05)
+
+    def load(self, function, query_service):
+        with RecordOutput() as lines:
+            data = function(query_service)
+        return data, lines
+
+    def test_same_as_combined_query(self):
+        paintings = self.load(
+            NatmusInfo.load_painting_items, self.synthetic)[0]
+        self.assertEqual(
+            self.load(NatmusInfo.load_painting_items_split,
+                      self.synthetic)[0],
+            paintings)
+        # the synthetic data covers paintings without any optional values
+        for key in ('types', 'creators', 'depicted_persons',
+                    'commons_cats'):
+            self.assertTrue(any(not painting[key]
+                                for painting in paintings.values()))
+
+    def test_failing_part_retried(self):
+        expected = self.load(
+            NatmusInfo.load_painting_items_split, self.synthetic)[0]
+        for error in (None, IOError('timed out')):
+            query_service = FailingQueryService(
+                self.synthetic, u'# Nationalmuseum import: depicted people',
+                error=error)
+            paintings, lines = self.load(
+                NatmusInfo.load_painting_items_split, query_service)
+            self.assertEqual(paintings, expected)
+            self.assertEqual(
+                query_service.queries.count(
+                    u'# Nationalmuseum import: depicted people'), 2)
+            # the other parts are only run once
+            self.assertEqual(len(query_service.queries), 5)
+            self.assertEqual(len(set(query_service.queries)), 4)
+            self.assertEqual(len([line for line in lines
+                                  if line[0] == 'warning']), 1)
+
+    def test_failing_part_gives_up(self):
+        query_service = FailingQueryService(
+            self.synthetic, u'# Nationalmuseum import: painting commonscats',
+            failures=3)
+        with self.assertRaises(common.MyError):
+            self.load(NatmusInfo.load_painting_items_split, query_service)
+        self.assertEqual(
+            query_service.queries.count(
+                u'# Nationalmuseum import: painting commonscats'), 3)
+
+
+class TestLocalNsidCommonscats(unittest.TestCase):
+    """Test the chunked loading of commonscats for the local mappings."""
+
+    def setUp(self):
+        self.synthetic = SyntheticQueryService(0.05)
+        self.qids = self.synthetic.local_nsid_mapping(20).values()
+
+    def load(self, query_service, chunk_size):
+        with RecordOutput() as lines:
+            cats = NatmusInfo.load_local_nsid_commonscats(
+                self.qids, query_service, chunk_size=chunk_size)
+        return cats, lines
+
+    def test_chunks_merged(self):
+        expected, lines = self.load(self.synthetic, 200)
+        self.assertEqual(len(expected), 10)
+        self.assertEqual(self.load(self.synthetic, 3), (expected, lines))
+
+    def test_failing_chunk_retried(self):
+        expected = self.load(self.synthetic, 200)[0]
+        query_service = FailingQueryService(
+            self.synthetic, u'wd:%s' % sorted(self.qids)[4])
+        cats, lines = self.load(query_service, 3)
+        self.assertEqual(cats, expected)
+        self.assertEqual(len(query_service.queries), 8)
+        self.assertIn(('warning', u'Query returned no data, retrying'), lines)
+
+    def test_failing_chunk_raises(self):
+        query_service = FailingQueryService(
+            self.synthetic, u'wd:%s' % sorted(self.qids)[4], failures=3)
+        with self.assertRaises(common.MyError):
+            self.load(query_service, 3)
+
+
+
+class TestCleanSparqlOutput(unittest.TestCase):
+    """Test the conversion of the sparql output to a dict with lists."""
+
+    def test_empty_input(self):
+        self.assertEqual(NatmusInfo.clean_sparql_output([], 'item'), {})
+        self.assertEqual(
+            NatmusInfo.clean_sparql_output(iter([]), 'item'), {})
+
+    def test_values(self):
+        data = [
+            {'item': ENTITY_URL + u'Q1', 'empty': u'', 'unbound': None,
+             'multi': u'%sQ2|%sQ3' % (ENTITY_URL, ENTITY_URL),
+             'gaps': u'|a||b|', 'literal': u'a b'},
+            {'item': ENTITY_URL + u'Q2', 'empty': u'', 'unbound': None,
+             'multi': ENTITY_URL + u'Q2', 'gaps': u'|', 'literal': u'Q1'},
+        ]
+        self.assertEqual(
+            NatmusInfo.clean_sparql_output(iter(data), 'item'),
+            {u'Q1': {'item': [u'Q1'], 'empty': [], 'unbound': [],
+                     'multi': [u'Q2', u'Q3'], 'gaps': [u'a', u'b'],
+                     'literal': [u'a b']},
+             u'Q2': {'item': [u'Q2'], 'empty': [], 'unbound': [],
+                     'multi': [u'Q2'], 'gaps': [], 'literal': [u'Q1']}})
+
+    def test_values_shared(self):
+        data = NatmusInfo.clean_sparql_output(
+            [{'item': ENTITY_URL + u'Q1', 'other': u'x|Q2'},
+             {'item': ENTITY_URL + u'Q2', 'other': ENTITY_URL + u'Q1|x'}],
+            'item')
+        self.assertIs(data[u'Q2']['other'][0], data[u'Q1']['item'][0])
+        self.assertIs(data[u'Q1']['other'][1], data[u'Q2']['item'][0])
+        self.assertIs(data[u'Q1']['other'][0], data[u'Q2']['other'][1])
+
+    def test_missing_key(self):
+        with RecordOutput() as lines:
+            with self.assertRaises(KeyError):
+                NatmusInfo.clean_sparql_output([{'other': u'x'}], 'item')
+        self.assertEqual(lines[0][0], 'error')
+
+
+class EchoQueryService(object):
+    """Query service answering each query with a row holding the query."""
+
+    def __init__(self):
+        self.queries = []
+
+    def select(self, query):
+        self.queries.append(query)
+        return [{'query': query, 'answer': unicode(len(self.queries))}]
+
+
+class TestCachedQueryService(unittest.TestCase):
+    """Test the caching and replaying of query results."""
+
+    query = u'''\
+# Nationalmuseum import
+SELECT ?item WHERE {
+  ?item wdt:P2539 ?obj_id .
+}'''
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.backend = EchoQueryService()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def service(self, **kwargs):
+        return CachedQueryService(
+            self.cache_dir, backend=self.backend, **kwargs)
+
+    def age_cache(self, query, hours):
+        """Make the cached result of a query older."""
+        filename = self.service().cache_file(query)
+        cached = common.open_and_read_file(filename, as_json=True)
+        cached['timestamp'] -= hours * 3600
+        common.open_and_write_file(filename, cached, as_json=True)
+
+    def test_cached(self):
+        result = self.service().select(self.query)
+        self.assertEqual(result, [{'query': self.query, 'answer': u'1'}])
+        self.assertEqual(self.service().select(self.query), result)
+        self.assertEqual(len(self.backend.queries), 1)
+
+        cached = common.open_and_read_file(
+            self.service().cache_file(self.query), as_json=True)
+        self.assertEqual(cached['query'], self.query)
+        self.assertEqual(cached['data'], result)
+
+    def test_ttl(self):
+        self.service(ttl=2).select(self.query)
+        self.age_cache(self.query, 1)
+        self.assertEqual(
+            self.service(ttl=2).select(self.query)[0]['answer'], u'1')
+        self.age_cache(self.query, 2)
+        self.assertEqual(
+            self.service(ttl=2).select(self.query)[0]['answer'], u'2')
+        # the new result is cached
+        self.assertEqual(
+            self.service(ttl=2).select(self.query)[0]['answer'], u'2')
+        self.assertEqual(len(self.backend.queries), 2)
+
+    def test_refresh(self):
+        self.service().select(self.query)
+        for answer in (u'2', u'3'):
+            self.assertEqual(
+                self.service(refresh=True).select(self.query)[0]['answer'],
+                answer)
+        self.assertEqual(self.service().select(self.query)[0]['answer'],
+                         u'3')
+
+    def test_refresh_wikidata_option(self):
+        options = NatmusInfo.handle_args([
+            u'-lido_file:%s' % os.path.join(self.cache_dir, u'lido.json'),
+            u'-image_files:images.txt', u'-refresh_wikidata'])
+        service = NatmusInfo.get_query_service(options)
+        self.assertTrue(service.refresh)
+        self.assertEqual(service.cache_dir,
+                         os.path.join(self.cache_dir, u'wikidata_cache'))
+
+    def test_offline(self):
+        with self.assertRaises(common.MyError):
+            self.service(offline=True).select(self.query)
+        self.service().select(self.query)
+        self.age_cache(self.query, 1000)
+        self.assertEqual(
+            self.service(offline=True).select(self.query)[0]['answer'],
+            u'1')
+        self.assertEqual(len(self.backend.queries), 1)
+        with self.assertRaises(common.MyError):
+            self.service(offline=True, refresh=True)
+
+    def test_failed_query_not_cached(self):
+        backend = FailingQueryService(self.backend, u'SELECT')
+        service = CachedQueryService(self.cache_dir, backend=backend)
+        self.assertIsNone(service.select(self.query))
+        self.assertFalse(os.path.exists(service.cache_file(self.query)))
+        self.assertEqual(service.select(self.query)[0]['answer'], u'1')
+
+    def test_replayed_offline(self):
+        synthetic = SyntheticQueryService(0.05)
+        recorder = FailingQueryService(synthetic, u'no match')
+        online = CachedQueryService(self.cache_dir, backend=recorder)
+        offline = CachedQueryService(self.cache_dir, offline=True)
+        with RecordOutput():
+            for load in (NatmusInfo.load_painting_items,
+                         NatmusInfo.load_creator_items):
+                expected = load(synthetic)
+                self.assertEqual(load(online), expected)
+                self.assertEqual(load(offline), expected)
+                self.assertEqual(load(online), expected)
+        self.assertEqual(len(recorder.queries), 2)
+
+    def test_normalised_query(self):
+        self.service().select(self.query)
+        reformatted = u'''\
+# another comment
+
+    SELECT   ?item
+WHERE {
+    # the paintings
+    ?item  wdt:P2539\t?obj_id .
+}
+'''
+        self.assertEqual(CachedQueryService.normalise_query(reformatted),
+                         CachedQueryService.normalise_query(self.query))
+        self.assertEqual(
+            self.service().select(reformatted)[0]['query'], self.query)
+        other = self.query.replace(u'P2539', u'P2538')
+        self.assertEqual(self.service().select(other)[0]['query'], other)
+        self.assertEqual(len(self.backend.queries), 2)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+
+class TestStreamingSelect(unittest.TestCase):
+    """Test the incremental decoding of SPARQL responses."""
+
+    def setUp(self):
+        self.synthetic = SyntheticQueryService(0.05)
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_iter_sparql_bindings(self):
+        rows = [{'item': ENTITY_URL + u'Q1', 'label': u'\xe5r "1"'},
+                {'item': ENTITY_URL + u'Q2', 'label': None},
+                {'item': ENTITY_URL + u'Q3', 'label': u'[]{},'}]
+        for indent in (None, 4):
+            response = json.dumps(to_sparql_json(rows), indent=indent)
+            for read_size in (1, 7, len(response)):
+                self.assertEqual(
+                    list(iter_sparql_bindings(
+                        io.BytesIO(response), read_size)),
+                    rows)
+
+    def test_iter_sparql_bindings_no_rows(self):
+        response = json.dumps(to_sparql_json([]))
+        self.assertEqual(list(iter_sparql_bindings(io.BytesIO(response))),
+                         [])
+
+    def test_iter_sparql_bindings_truncated(self):
+        response = json.dumps(to_sparql_json(
+            [{'item': ENTITY_URL + u'Q1'}, {'item': ENTITY_URL + u'Q2'}]))
+        with self.assertRaises(ValueError):
+            list(iter_sparql_bindings(io.BytesIO(response[:-20]), 7))
+
+    def test_streamed_through_server(self):
+        server = QueryServer(0, self.synthetic)
+        server.RequestHandlerClass = QuietQueryHandler
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            endpoint = u'http://localhost:%d/sparql' % server.server_port
+            query_service = CachedQueryService(
+                self.cache_dir, endpoint=endpoint, stream=True)
+            with RecordOutput():
+                paintings = NatmusInfo.load_painting_items(query_service)
+                creators = NatmusInfo.load_creator_items(query_service)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        with RecordOutput():
+            self.assertEqual(
+                NatmusInfo.load_painting_items(self.synthetic), paintings)
+            self.assertEqual(
+                NatmusInfo.load_creator_items(self.synthetic), creators)
+            # the streamed rows were cached
+            offline = CachedQueryService(self.cache_dir, offline=True)
+            self.assertEqual(
+                NatmusInfo.load_painting_items(offline), paintings)
+            self.assertEqual(
+                NatmusInfo.load_creator_items(offline), creators)
+
+
+class TestStandinServer(MakeInfoTestCase):
+    """Test answering the queries of make_Natmus_info over HTTP."""
+
+    def setUp(self):
+        super(TestStandinServer, self).setUp()
+        # synthetic paintings matching the records of the test data
+        synthetic = SyntheticQueryService(0.004)
+        with io.open(self.path(u'processed_lido.json'),
+                     encoding='utf-8') as f:
+            obj_ids = sorted(json.load(f))
+        for painting, obj_id in zip(synthetic.paintings, obj_ids):
+            painting['obj_id'] = obj_id
+        common.open_and_write_file(
+            self.path(u'nsid.json'), synthetic.local_nsid_mapping(4),
+            as_json=True)
+        self.synthetic = synthetic
+        self.servers = []
+
+    def tearDown(self):
+        for server, thread in self.servers:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        super(TestStandinServer, self).tearDown()
+
+    def serve(self, query_service):
+        """
+        Serve the query service on a free port.
+
+        @return: the url of the endpoint
+        """
+        server = QueryServer(0, query_service)
+        server.RequestHandlerClass = QuietQueryHandler
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.servers.append((server, thread))
+        return u'http://localhost:%d/sparql' % server.server_port
+
+    def run_sparql(self, *args):
+        """
+        Run make_Natmus_info using queries rather than the wikidata index.
+
+        @return: the raw output and log file
+        """
+        os.remove(self.path(u'wd_index.json'))
+        try:
+            options = NatmusInfo.handle_args([
+                u'-lido_file:%s' % self.path(u'processed_lido.json'),
+                u'-image_files:%s' % self.path(u'image_files.txt'),
+                u'-nsid_file:%s' % self.path(u'nsid.json'),
+            ] + list(args))
+            with RecordOutput():
+                info = NatmusInfo(**options)
+                info.run(options['in_file'], options['base_name'])
+        finally:
+            shutil.copy(os.path.join(MAKE_INFO_DIR, u'wd_index.json'),
+                        self.base_dir)
+        with open(self.path(u'artwork.json'), 'rb') as f:
+            output = f.read()
+        with io.open(self.path(u'artwork.log'), encoding='utf-8') as f:
+            log = [line for line in f.read().split(u'\n')
+                   if not TIMING.search(line)]
+        return output, log
+
+    def read_cache(self, cache_dir):
+        """Return the recorded queries and the raw json of their results."""
+        recorded = {}
+        for filename in os.listdir(cache_dir):
+            cached = common.open_and_read_file(
+                os.path.join(cache_dir, filename), as_json=True)
+            recorded[filename] = (cached['query'], json.dumps(cached['data']))
+        return recorded
+
+    def record_queries(self):
+        """Return the queries made by make_Natmus_info."""
+        recorder = RecordingQueryService(self.synthetic)
+        with RecordOutput():
+            NatmusInfo.load_painting_items(recorder)
+            NatmusInfo.load_creator_items(recorder)
+            NatmusInfo.load_local_nsid_commonscats(
+                [person['qid'] for person in self.synthetic.people],
+                recorder)
+        return recorder.queries
+
+    def test_valid_sparql_json(self):
+        endpoint = self.serve(self.synthetic)
+        queries = self.record_queries()
+        self.assertEqual(len(queries), 3)
+        for query in queries:
+            request = urllib2.Request(
+                endpoint + u'?' + urllib.urlencode(
+                    {'query': query.encode('utf-8')}),
+                headers={'Accept': 'application/sparql-results+json'})
+            response = urllib2.urlopen(request)
+            self.assertEqual(response.info().gettype(),
+                             'application/sparql-results+json')
+            data = json.load(response)
+            self.assertEqual(data.keys(), ['head', 'results'])
+            variables = data['head']['vars']
+            self.assertTrue(variables)
+            self.assertTrue(data['results']['bindings'])
+            for binding in data['results']['bindings']:
+                self.assertLessEqual(set(binding), set(variables))
+                for value in binding.values():
+                    self.assertEqual(set(value), set(['type', 'value']))
+                    self.assertIn(value['type'], ('uri', 'literal'))
+                    self.assertIsInstance(value['value'], unicode)
+
+            expected = self.synthetic.select(query)
+            decoded = sparql.SparqlQuery(
+                endpoint=endpoint, entity_url=ENTITY_URL).select(query)
+            self.assertEqual(decoded, [
+                dict((var, row.get(var)) for var in variables)
+                for row in expected])
+
+            # the query may also be posted
+            response = urllib2.urlopen(endpoint, urllib.urlencode(
+                {'query': query.encode('utf-8')}))
+            self.assertEqual(json.load(response), data)
+
+    def test_no_query(self):
+        endpoint = self.serve(self.synthetic)
+        with self.assertRaises(urllib2.HTTPError) as cm:
+            urllib2.urlopen(endpoint)
+        self.assertEqual(cm.exception.code, 400)
+        with self.assertRaises(urllib2.HTTPError) as cm:
+            urllib2.urlopen(endpoint + u'?query=unknown')
+        self.assertEqual(cm.exception.code, 404)
+
+    def test_record_and_replay(self):
+        recorded = self.path(u'recorded')
+        endpoint = self.serve(self.synthetic)
+        output, log = self.run_sparql(
+            u'-sparql_endpoint:%s' % endpoint, u'-cache_dir:%s' % recorded,
+            u'-refresh_wikidata')
+        self.assertIn(b'wikidata             = Q2000000', output)
+        self.assertIn(b'artist               = [[:d:Q1000000', output)
+        cache = self.read_cache(recorded)
+        self.assertEqual(len(cache), 3)
+
+        # replayed from the files
+        self.assertEqual(
+            self.run_sparql(u'-cache_dir:%s' % recorded, u'-offline'),
+            (output, log))
+        self.assertEqual(self.read_cache(recorded), cache)
+
+        # replayed over HTTP, and recorded again, streaming or not
+        endpoint = self.serve(CachedQueryService(recorded, offline=True))
+        for stream in ([], [u'-stream_sparql']):
+            rerecorded = self.path(u'rerecorded%d' % len(stream))
+            self.assertEqual(
+                self.run_sparql(
+                    u'-sparql_endpoint:%s' % endpoint,
+                    u'-cache_dir:%s' % rerecorded, *stream),
+                (output, log))
+            self.assertEqual(self.read_cache(rerecorded), cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
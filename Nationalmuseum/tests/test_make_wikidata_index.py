@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for make_wikidata_index."""
+import bz2
+import os
+import shutil
+import tempfile
+import unittest
+
+import batchupload.common as common
+
+import make_wikidata_index
+from make_Natmus_info import ENTITY_URL, NatmusInfo, WikidataIndex
+from tests.utils import DATA_DIR, RecordOutput
+
+WIKIDATA_DIR = os.path.join(DATA_DIR, u'wikidata')
+NSID_FILE = os.path.join(WIKIDATA_DIR, u'nsid.json')
+
+
+def claim(value, rank='normal', snaktype='value'):
+    """Return a minimal statement for a string value."""
+    mainsnak = {'snaktype': snaktype}
+    if snaktype == 'value':
+        mainsnak['datavalue'] = {'value': value, 'type': 'string'}
+    return {'mainsnak': mainsnak, 'rank': rank}
+
+
+class TestTruthyValues(unittest.TestCase):
+    """Test the selection of truthy statements."""
+
+    def truthy_values(self, *claims):
+        return make_wikidata_index.truthy_values(
+            {'claims': {'P1': list(claims)}}, 'P1')
+
+    def test_normal_rank(self):
+        self.assertEqual(
+            self.truthy_values(claim(u'a'), claim(u'b'), claim(u'a')),
+            [u'a', u'b'])
+
+    def test_preferred_rank(self):
+        self.assertEqual(
+            self.truthy_values(claim(u'a'), claim(u'b', 'preferred'),
+                               claim(u'c', 'preferred')),
+            [u'b', u'c'])
+
+    def test_deprecated_rank(self):
+        self.assertEqual(
+            self.truthy_values(claim(u'a', 'deprecated'), claim(u'b')),
+            [u'b'])
+        self.assertEqual(self.truthy_values(claim(u'a', 'deprecated')), [])
+
+    def test_no_value(self):
+        self.assertEqual(
+            self.truthy_values(claim(None, snaktype='novalue'),
+                               claim(None, snaktype='somevalue'),
+                               claim(u'a')),
+            [u'a'])
+
+    def test_missing_property(self):
+        self.assertEqual(
+            make_wikidata_index.truthy_values({'claims': {}}, 'P1'), [])
+        self.assertEqual(make_wikidata_index.truthy_values({}, 'P1'), [])
+
+    def test_datavalues(self):
+        claims = [
+            {'mainsnak': {'snaktype': 'value', 'datavalue': {
+                'value': {'id': u'Q5', 'numeric-id': 5}}}, 'rank': 'normal'},
+            {'mainsnak': {'snaktype': 'value', 'datavalue': {
+                'value': {'numeric-id': 6}}}, 'rank': 'normal'},
+            {'mainsnak': {'snaktype': 'value', 'datavalue': {
+                'value': {'time': u'+1700-01-01T00:00:00Z'}}},
+             'rank': 'normal'},
+            {'mainsnak': {'snaktype': 'value', 'datavalue': {
+                'value': {'amount': u'+1'}}}, 'rank': 'normal'},
+        ]
+        self.assertEqual(self.truthy_values(*claims),
+                         [u'Q5', u'Q6', u'1700-01-01T00:00:00Z'])
+
+
+class TestBuildIndex(unittest.TestCase):
+    """Test building an index from the test dump."""
+
+    def build_index(self, filename, nsid_file=NSID_FILE):
+        with RecordOutput() as lines:
+            index = make_wikidata_index.build_index(
+                os.path.join(WIKIDATA_DIR, filename), nsid_file)
+        return index, lines
+
+    def test_compressed_dumps(self):
+        index = self.build_index(u'dump.json')[0]
+        del index['created'], index['dump']
+        for filename in (u'dump.json.gz', u'dump.json.bz2'):
+            compressed = self.build_index(filename)[0]
+            self.assertEqual(compressed.pop('dump'), filename)
+            del compressed['created']
+            self.assertEqual(compressed, index)
+
+    def test_bz2_stream_ending_on_read_boundary(self):
+        filename = os.path.join(WIKIDATA_DIR, u'dump.json.bz2')
+        with open(filename, 'rb') as f:
+            content = f.read()
+        decompressor = bz2.BZ2Decompressor()
+        decompressor.decompress(content)
+        first_stream = len(content) - len(decompressor.unused_data)
+        self.assertGreater(len(decompressor.unused_data), 0)
+
+        with open(os.path.join(WIKIDATA_DIR, u'dump.json'), 'rb') as f:
+            expected = f.read().rstrip('\n').split('\n')
+        read_size = make_wikidata_index.READ_SIZE
+        try:
+            for size in (first_stream, first_stream - 1, 100):
+                make_wikidata_index.READ_SIZE = size
+                self.assertEqual(
+                    list(make_wikidata_index.iter_dump_lines(filename)),
+                    expected)
+        finally:
+            make_wikidata_index.READ_SIZE = read_size
+
+    def test_single_pass(self):
+        # Q12 follows the painting referring to it and is picked up in the
+        # first pass, Q11 precedes it and requires a second pass
+        index, lines = self.build_index(u'dump.json')
+        self.assertIn(
+            ('output', u'Second pass through %s for 1 entities' %
+             os.path.join(WIKIDATA_DIR, u'dump.json')),
+            lines)
+        self.assertEqual(index['paintings']['7000000']['creator_templates'],
+                         [u'Artist A', u'Artist B'])
+        self.assertEqual(index['paintings']['7000001']['creator_cats'],
+                         [u'Cat C'])
+
+    def test_paintings(self):
+        paintings = self.build_index(u'dump.json')[0]['paintings']
+        self.assertEqual(sorted(paintings.keys()),
+                         [u'7000000', u'7000001', u'7000002'])
+        # a preferred death date hides the normal one, a deprecated one is
+        # ignored and only human depicted are kept
+        self.assertEqual(paintings['7000000']['death_dates'],
+                         [u'1700-01-01T00:00:00Z', u'1750-05-01T00:00:00Z'])
+        self.assertEqual(paintings['7000000']['depicted_persons'], [u'Q30'])
+        self.assertEqual(paintings['7000000']['depicted_cats'],
+                         [u'Depicted cat'])
+        self.assertEqual(paintings['7000001']['death_dates'], [])
+        self.assertEqual(paintings['7000001']['commons_cats'], [])
+
+    def test_same_format_as_sparql(self):
+        paintings = self.build_index(u'dump.json')[0]['paintings']
+        rows = [{
+            'item': ENTITY_URL + u'Q20',
+            'obj_id': u'7000000',
+            'types': ENTITY_URL + u'Q3305213',
+            'creators': u'|'.join(ENTITY_URL + q for q in (u'Q10', u'Q11')),
+            'creator_templates': u'Artist A|Artist B',
+            'creator_cats': u'Cat A',
+            'death_dates': u'1700-01-01T00:00:00Z|1750-05-01T00:00:00Z',
+            'commons_cats': u'Painting cat 0',
+            'depicted_persons': ENTITY_URL + u'Q30',
+            'depicted_cats': u'Depicted cat',
+        }, {
+            'item': ENTITY_URL + u'Q22',
+            'obj_id': u'7000002',
+            'types': u'',
+            'creators': u'',
+            'creator_templates': u'',
+            'creator_cats': u'',
+            'death_dates': u'',
+            'commons_cats': u'',
+            'depicted_persons': u'',
+            'depicted_cats': u'',
+        }]
+        sparql = NatmusInfo.clean_sparql_output(rows, 'obj_id')
+        for obj_id in sparql:
+            self.assertEqual(paintings[obj_id], sparql[obj_id])
+
+    def test_read_by_wikidata_index(self):
+        index = self.build_index(u'dump.json')[0]
+        temp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(temp_dir, u'index.json')
+            common.open_and_write_file(filename, index, as_json=True)
+            with RecordOutput():
+                wd_index = WikidataIndex(filename)
+                paintings = wd_index.load_painting_items()
+                creators = wd_index.load_creator_items()
+                mapping, local_cats = wd_index.load_local_nsid_mappings(
+                    NSID_FILE)
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertEqual(paintings, index['paintings'])
+        self.assertEqual(creators.keys(), [u'100'])
+        self.assertEqual(creators['100']['itemLabel'], [u'Konstn\xe4r A'])
+        self.assertEqual(mapping, {u'http://kulturnav.org/1': u'Q40'})
+        self.assertEqual(local_cats, {u'Q40': {
+            'item': [u'Q40'], 'commons_cat': [u'Mapped cat']}})
+
+
+if __name__ == '__main__':
+    unittest.main()
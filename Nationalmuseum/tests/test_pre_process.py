@@ -0,0 +1,510 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for pre_process."""
+import itertools
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+import time
+import unittest
+import zipfile
+
+import pre_process
+from tests.utils import DATA_DIR, RecordOutput
+
+LIDO_DIR = os.path.join(DATA_DIR, u'lido')
+
+
+def lido_files():
+    """Return the paths to all of the LIDO test files."""
+    return [os.path.join(LIDO_DIR, filename)
+            for filename in sorted(os.listdir(LIDO_DIR))
+            if filename.endswith('.xml')]
+
+
+def delayed_identity(job):
+    """Return the job after a delay which is longer for earlier jobs."""
+    time.sleep(0.01 * (10 - job % 10))
+    return job
+
+
+def exit_on_third(job):
+    """Return the job, unless it is the third one which exits instead."""
+    if job == 2:
+        exit()
+    return job
+
+
+def split_measurement(measurement):
+    """
+    Parse a measurement by splitting it on spaces.
+
+    This is how measurements were parsed before the use of a regex.
+
+    @return: (prefix, problem, values) as for pre_process.parse_measurement
+    """
+    parts = measurement.split(' ')
+    if parts[0].strip('0123456789,') == '':
+        parts.insert(0, u'_')
+    prefix = parts[0]
+    if prefix not in pre_process.MEASUREMENT_PREFIXES:
+        if prefix in pre_process.SKIPPED_MEASUREMENT_PREFIXES:
+            return (prefix, 'skipped prefix', None)
+        return (prefix, 'unrecognized prefix', None)
+
+    units = pre_process.MEASUREMENT_UNITS
+    if parts[-1] not in units:
+        if len(parts) > 2 and parts[2] in units:
+            return (prefix, 'comment', None)
+        elif len(parts) > 4 and parts[4] in units:
+            parts = parts[:5]
+        elif len(parts) > 6 and parts[6] in units:
+            parts = parts[:7]
+        else:
+            return (prefix, 'unrecognized unit', None)
+
+    values = ''.join(parts[1:-1]).replace(',', '.').split('x')
+    if len(values) not in (1, 2, 3):
+        return (prefix, 'unexpected formating', None)
+    values += [None] * (3 - len(values))
+    return (prefix, None, {'unit': parts[-1], 'height': values[0],
+                           'width': values[1], 'depth': values[2]})
+
+
+class TestParseMeasurement(unittest.TestCase):
+    """Test the parsing of displayObjectMeasurements strings."""
+
+    def assert_parsed(self, measurement, expected):
+        self.assertEqual(pre_process.parse_measurement(measurement),
+                         expected)
+
+    def test_values(self):
+        self.assert_parsed(u'Mått 73,5 x 60 cm', (u'Mått', None, {
+            'unit': 'cm', 'height': '73.5', 'width': '60', 'depth': None}))
+        self.assert_parsed(u'73 x 60 x 3 mm', (u'_', None, {
+            'unit': 'mm', 'height': '73', 'width': '60', 'depth': '3'}))
+        self.assert_parsed(u'Ram 73 cm', (u'Ram', None, {
+            'unit': 'cm', 'height': '73', 'width': None, 'depth': None}))
+
+    def test_unit_followed_by_text(self):
+        self.assert_parsed(u'Mått 73 x 60 cm (ca)', (u'Mått', None, {
+            'unit': 'cm', 'height': '73', 'width': '60', 'depth': None}))
+        self.assert_parsed(u'73 x 60 x 3 cm enl. uppgift', (u'_', None, {
+            'unit': 'cm', 'height': '73', 'width': '60', 'depth': '3'}))
+
+    def test_problems(self):
+        self.assert_parsed(u'Vikt 3 kg', (u'Vikt', 'skipped prefix', None))
+        self.assert_parsed(u'Okänt 3 x 4 cm',
+                           (u'Okänt', 'unrecognized prefix', None))
+        self.assert_parsed(u'Mått', (u'Mått', 'unrecognized unit', None))
+        self.assert_parsed(u'Mått 73 cm diameter',
+                           (u'Mått', 'comment', None))
+        self.assert_parsed(u'Mått 73 x 60 tum',
+                           (u'Mått', 'unrecognized unit', None))
+        self.assert_parsed(u'73 x 60 x 3 x 2 cm',
+                           (u'_', 'unexpected formating', None))
+
+    def test_same_as_splitting(self):
+        words = (u'Mått', u'Vikt', u'73', u'7,5', u'x', u'cm', u'mm', u'',
+                 u'ca')
+        measurements = [u' '.join(combination) for length in range(4)
+                        for combination in itertools.product(
+                            words, repeat=length)]
+        # longer ones, up to three values followed by a comment
+        randomiser = random.Random(0)
+        measurements += [
+            u' '.join(randomiser.choice(words) for i in range(length))
+            for length in range(4, 10) for j in range(2000)]
+        for measurement in measurements:
+            self.assertEqual(
+                pre_process.parse_measurement(measurement),
+                split_measurement(measurement), measurement)
+
+    def test_result_not_shared(self):
+        measurement = u'Mått 73 x 60 cm'
+        pre_process.parse_measurement(measurement)[2]['unit'] = u'changed'
+        self.assertEqual(
+            pre_process.parse_measurement(measurement)[2]['unit'], u'cm')
+
+
+class TestBoundedCache(unittest.TestCase):
+    """Test the LRU cache used for measurements."""
+
+    def setUp(self):
+        self.calls = []
+        self.cache = pre_process.BoundedCache(self.function, 2)
+
+    def function(self, arg):
+        self.calls.append(arg)
+        return arg.upper()
+
+    def test_hits_and_misses(self):
+        self.assertEqual([self.cache(arg) for arg in 'abab'], list('ABAB'))
+        self.assertEqual(self.calls, ['a', 'b'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+    def test_least_recently_used_evicted(self):
+        for arg in 'abac':
+            self.cache(arg)
+        # b was used less recently than a
+        self.assertEqual(list(self.cache.cache.keys()), ['a', 'c'])
+        self.cache('a')
+        self.cache('b')
+        self.assertEqual(self.calls, ['a', 'b', 'c', 'b'])
+        self.assertEqual(list(self.cache.cache.keys()), ['a', 'b'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 4))
+
+
+class TestStreamingReader(unittest.TestCase):
+    """Test that load_xml_streaming() can be used in place of load_xml()."""
+
+    def assert_same_result(self, xml_file):
+        entry, error, stats = pre_process.process_xml_data(
+            pre_process.load_xml(xml_file), verbose_tags=True)
+        s_entry, s_error, s_stats = pre_process.process_xml_data(
+            pre_process.load_xml_streaming(xml_file), verbose_tags=True)
+        self.assertEqual(entry, s_entry)
+        self.assertEqual(error, s_error)
+        self.assertEqual(stats.missed_tags, s_stats.missed_tags)
+        self.assertEqual(stats.missed_tag_examples,
+                         s_stats.missed_tag_examples)
+        self.assertEqual(stats.messages, s_stats.messages)
+        return entry, error, stats
+
+    def test_process_xml_data_equal(self):
+        for xml_file in lido_files():
+            self.assert_same_result(xml_file)
+
+    def test_attributes_and_mixed_languages(self):
+        entry, error, stats = self.assert_same_result(
+            os.path.join(LIDO_DIR, u'Item_7000100.xml'))
+        self.assertIsNone(error)
+        self.assertEqual(entry[u'obj_id'], u'7000100')
+        self.assertEqual(
+            entry[u'title'],
+            {u'sv': u'Titel 100', u'en': u'Title 100', u'_': u'Titre 100'})
+        self.assertEqual(
+            entry[u'descriptions'], {u'sv': u'Beskrivning 1', u'_': u'plain'})
+        self.assertEqual(stats.missed_tags, {u'': {u'lido:category': 1}})
+
+    def test_repeated_and_empty_tags(self):
+        entry, error, stats = self.assert_same_result(
+            os.path.join(LIDO_DIR, u'Item_7000000.xml'))
+        self.assertIsNone(error)
+        self.assertEqual(entry[u'creator'].keys(), [u'100'])
+        self.assertEqual(
+            sorted(entry[u'images'].keys()),
+            [u'NMGrh 0.tif', u'NMGrh 0b.tif'])
+        self.assertEqual(len(entry[u'measurements']), 2)
+        self.assertEqual(entry[u'subjects'], [])
+        self.assertEqual(entry[u'inscriptions'], {})
+
+    def test_error_equal(self):
+        entry, error, stats = self.assert_same_result(
+            os.path.join(LIDO_DIR, u'Item_7000011.xml'))
+        self.assertIsNone(entry)
+        self.assertIn(u'Item_7000011.xml', error)
+
+    def test_load_dump(self):
+        xml_file = os.path.join(LIDO_DIR, u'Item_7000005.xml')
+        entry = pre_process.process_xml_data(
+            pre_process.load_xml(xml_file))[0]
+        dumped = [pre_process.process_xml_data(data)[0]
+                  for data in pre_process.load_dump(xml_file)]
+        self.assertEqual(len(dumped), 1)
+        self.assertEqual(dumped[0].pop(u'source_file'), u'Item_7000005.xml:1')
+        entry.pop(u'source_file')
+        self.assertEqual(dumped[0], entry)
+
+
+class TestFileManifest(unittest.TestCase):
+    """Test the invalidation done by FileManifest."""
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.xml_dir = os.path.join(self.base_dir, u'lido')
+        shutil.copytree(LIDO_DIR, self.xml_dir)
+        self.manifest_file = os.path.join(
+            self.base_dir, pre_process.MANIFEST_FILE)
+        self.processed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def xml_files(self):
+        return [os.path.join(self.xml_dir, filename)
+                for filename in sorted(os.listdir(self.xml_dir))]
+
+    def process(self, xml_file):
+        self.processed.append(os.path.split(xml_file)[-1])
+        return pre_process.process_file(xml_file)
+
+    def run_manifest(self):
+        """Process all files using a freshly loaded manifest."""
+        self.processed = []
+        manifest = pre_process.FileManifest(
+            self.manifest_file, self.base_dir)
+        results = list(manifest.map_in_order(self.process, self.xml_files()))
+        manifest.save()
+        return manifest, results
+
+    def assert_results_equal(self, results, expected):
+        self.assertEqual([result[:2] for result in results],
+                         [result[:2] for result in expected])
+        self.assertEqual(
+            [result[2].missed_tags for result in results],
+            [result[2].missed_tags for result in expected])
+
+    def test_first_run(self):
+        manifest, results = self.run_manifest()
+        self.assertEqual(len(manifest.changes['new']), 5)
+        self.assertEqual(self.processed, sorted(os.listdir(self.xml_dir)))
+        self.assert_results_equal(
+            results, [pre_process.process_file(xml_file)
+                      for xml_file in self.xml_files()])
+        self.assertTrue(os.path.isfile(self.manifest_file))
+
+    def test_unchanged_files_are_reused(self):
+        first = self.run_manifest()[1]
+        manifest, results = self.run_manifest()
+        self.assertEqual(self.processed, [])
+        self.assertEqual(len(manifest.changes['unchanged']), 5)
+        self.assert_results_equal(results, first)
+
+    def test_touched_file_is_reused(self):
+        self.run_manifest()
+        xml_file = os.path.join(self.xml_dir, u'Item_7000001.xml')
+        os.utime(xml_file, (0, 0))
+        manifest = self.run_manifest()[0]
+        self.assertEqual(self.processed, [])
+        self.assertEqual(len(manifest.changes['unchanged']), 5)
+        self.assertEqual(
+            manifest.entries[os.path.relpath(xml_file, self.base_dir)][
+                'mtime'], 0)
+
+    def test_modified_new_and_removed_files(self):
+        self.run_manifest()
+        xml_file = os.path.join(self.xml_dir, u'Item_7000001.xml')
+        with open(xml_file, 'rb') as f:
+            content = f.read()
+        stat = os.stat(xml_file)
+        with open(xml_file, 'wb') as f:
+            f.write(content.replace(b'Title 1<', b'Titel 1<'))
+        os.utime(xml_file, (stat.st_atime, stat.st_mtime + 10))
+        os.rename(os.path.join(self.xml_dir, u'Item_7000005.xml'),
+                  os.path.join(self.xml_dir, u'Item_7000006.xml'))
+
+        manifest, results = self.run_manifest()
+        self.assertEqual(
+            self.processed, [u'Item_7000001.xml', u'Item_7000006.xml'])
+        self.assertEqual(manifest.changes['modified'],
+                         [os.path.join(u'lido', u'Item_7000001.xml')])
+        self.assertEqual(manifest.changes['new'],
+                         [os.path.join(u'lido', u'Item_7000006.xml')])
+        self.assertEqual(len(manifest.changes['unchanged']), 3)
+        self.assertEqual(results[1][0][u'title'][u'en'], u'Titel 1')
+
+        saved = pre_process.common.open_and_read_file(
+            self.manifest_file, as_json=True)
+        self.assertNotIn(os.path.join(u'lido', u'Item_7000005.xml'),
+                         saved['files'])
+        self.assertIn(os.path.join(u'lido', u'Item_7000006.xml'),
+                      saved['files'])
+
+    def test_changed_code_reprocesses_all(self):
+        self.run_manifest()
+        with RecordOutput() as log:
+            manifest = pre_process.FileManifest(
+                self.manifest_file, self.base_dir, u'other code')
+        self.assertFalse(manifest.reuse)
+        self.assertEqual(log[0][0], 'output')
+        self.processed = []
+        results = list(manifest.map_in_order(self.process, self.xml_files()))
+        manifest.save()
+        self.assertEqual(self.processed, sorted(os.listdir(self.xml_dir)))
+        self.assertEqual(len(manifest.changes['unchanged']), 5)
+        self.assert_results_equal(
+            results, [pre_process.process_file(xml_file)
+                      for xml_file in self.xml_files()])
+
+        # the new results are reused with the new code
+        manifest = pre_process.FileManifest(
+            self.manifest_file, self.base_dir, u'other code')
+        self.assertTrue(manifest.reuse)
+
+    def test_process_all_files(self):
+        output_file = os.path.join(self.base_dir, u'processed_lido.json')
+        pre_process.process_all_files(base_dir=self.base_dir, xml_dir=u'lido')
+        with open(output_file, 'rb') as f:
+            expected = f.read()
+        for i in range(2):
+            os.remove(output_file)
+            pre_process.process_all_files(
+                base_dir=self.base_dir, xml_dir=u'lido', incremental=True)
+            with open(output_file, 'rb') as f:
+                self.assertEqual(f.read(), expected)
+
+    def run_process_all_files(self, **kwargs):
+        """Return the log of a run, leaving out the manifest summary."""
+        with RecordOutput() as log:
+            pre_process.process_all_files(
+                base_dir=self.base_dir, xml_dir=u'lido', **kwargs)
+        return [line for line in log
+                if not line[1].startswith(u'Manifest: ')]
+
+    def test_process_all_files_log(self):
+        for verbose_tags in (False, True):
+            expected = self.run_process_all_files(verbose_tags=verbose_tags)
+            # the files give warnings as well as missed tags
+            self.assertIn('warning', [line[0] for line in expected])
+            missed = (u"Missed the following tags on level '': "
+                      u"lido:category")
+            if verbose_tags:
+                self.assertIn(('output', missed), expected)
+            else:
+                self.assertNotIn(('output', missed), expected)
+            # the first run stores the results, the second reuses them
+            for i in range(2):
+                log = self.run_process_all_files(
+                    verbose_tags=verbose_tags, incremental=True)
+                self.assertEqual(
+                    [line for line in log if 'code or settings' not in
+                     line[1]],
+                    expected)
+
+    def test_incremental_with_dump_or_archive(self):
+        dump = os.path.join(self.base_dir, u'dump.xml')
+        shutil.copy(os.path.join(self.xml_dir, u'Item_7000000.xml'), dump)
+        for option in ('dump', 'archive'):
+            with self.assertRaises(pre_process.common.MyError):
+                pre_process.process_all_files(
+                    base_dir=self.base_dir, incremental=True,
+                    **{option: dump})
+
+
+class TestWorkers(unittest.TestCase):
+    """Test that running with -workers gives the same result as without."""
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        xml_dir = os.path.join(self.base_dir, u'lido')
+        os.mkdir(xml_dir)
+        # each object is present several times to also trigger the
+        # reporting of duplicates
+        for i in range(3):
+            for xml_file in lido_files():
+                shutil.copy(xml_file, os.path.join(
+                    xml_dir, u'%d_%s' % (i, os.path.split(xml_file)[-1])))
+        self.chunk_size = pre_process.CHUNK_SIZE
+        pre_process.CHUNK_SIZE = 1  # spread the files over the workers
+
+    def tearDown(self):
+        pre_process.CHUNK_SIZE = self.chunk_size
+        shutil.rmtree(self.base_dir)
+
+    def test_map_in_order(self):
+        jobs = range(40)
+        self.assertEqual(
+            list(pre_process.map_in_order(delayed_identity, jobs, 4)), jobs)
+
+    def test_map_in_order_exit(self):
+        with self.assertRaises(SystemExit):
+            list(pre_process.map_in_order(exit_on_third, range(40), 2))
+
+    def run_process_all_files(self, **kwargs):
+        """Return the output and log of a full run."""
+        with RecordOutput() as log:
+            pre_process.process_all_files(
+                base_dir=self.base_dir, xml_dir=u'lido', verbose_tags=True,
+                **kwargs)
+        with open(os.path.join(
+                self.base_dir, u'processed_lido.json'), 'rb') as f:
+            output = f.read()
+        # the measurement cache is per process
+        log = [line for line in log
+               if not line[1].startswith('Measurement cache')]
+        return output, log
+
+    def test_process_all_files(self):
+        output, log = self.run_process_all_files()
+        self.assertIn(
+            ('warning', u'Unrecognized unit in measurement for '
+                        u'1_Item_7000001.xml:\nM\xe5tt 73 x 60 tum'),
+            log)
+        for workers in (2, 3):
+            self.assertEqual(
+                self.run_process_all_files(workers=workers), (output, log))
+
+    def test_unexpected_subtag(self):
+        with open(lido_files()[1], 'rb') as f:
+            content = f.read()
+        with open(os.path.join(self.base_dir, u'lido', u'1_bad.xml'),
+                  'wb') as f:
+            f.write(content.replace(
+                b'<lido:titleSet>', b'<lido:titleSet lido:type="x">', 1))
+        output, log = self.run_process_all_files()
+        errors = [text for function, text in log
+                  if text.startswith(u'Encountered error while processing '
+                                     u'1_bad.xml: ')]
+        self.assertEqual(len(errors), 1)
+        self.assertIn(
+            u'Found unexpected tags: @lido:type, lido:appellationValue',
+            errors[0])
+        self.assertEqual(
+            self.run_process_all_files(workers=2), (output, log))
+
+    def test_process_all_files_streaming(self):
+        expected = self.run_process_all_files()
+        self.assertEqual(
+            self.run_process_all_files(workers=3, streaming=True), expected)
+
+    def make_archives(self):
+        """Archive the xml files, together with some other members."""
+        xml_dir = os.path.join(self.base_dir, u'lido')
+        names = sorted(os.listdir(xml_dir))
+        zip_archive = os.path.join(self.base_dir, u'lido.zip')
+        zip_file = zipfile.ZipFile(zip_archive, 'w', zipfile.ZIP_DEFLATED)
+        try:
+            zip_file.writestr(u'lido/README.txt', b'not xml')
+            for name in names:
+                zip_file.write(os.path.join(xml_dir, name), u'lido/' + name)
+        finally:
+            zip_file.close()
+
+        tar_archive = os.path.join(self.base_dir, u'lido.tar.gz')
+        tar_file = tarfile.open(tar_archive, 'w:gz')
+        try:
+            tar_file.add(xml_dir, u'lido', recursive=False)
+            tar_file.add(os.path.join(xml_dir, names[0]), u'lido/not.xml.txt')
+            for name in names:
+                tar_file.add(os.path.join(xml_dir, name), u'lido/' + name)
+        finally:
+            tar_file.close()
+        return zip_archive, tar_archive
+
+    def test_archives(self):
+        # the number of files is only reported for a directory or zip file
+        def without_count(result):
+            output, log = result
+            return output, [line for line in log
+                            if not line[1].startswith(u'Found ')]
+
+        zip_archive, tar_archive = self.make_archives()
+        expected = self.run_process_all_files()
+        for archive in (zip_archive, tar_archive):
+            for workers in (None, 2):
+                self.assertEqual(
+                    without_count(self.run_process_all_files(
+                        archive=archive, workers=workers)),
+                    without_count(expected))
+        self.assertEqual(
+            self.run_process_all_files(archive=zip_archive), expected)
+        self.assertEqual(
+            without_count(self.run_process_all_files(
+                archive=tar_archive, streaming=True)),
+            without_count(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Shared helpers for the tests."""
+import os
+
+import pywikibot
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), u'data')
+
+
+class RecordOutput(object):
+    """Record anything output through pywikibot, instead of printing it."""
+
+    functions = ('output', 'warning', 'error')
+
+    def __enter__(self):
+        self.lines = []
+        self.original = {}
+        for function in self.functions:
+            self.original[function] = getattr(pywikibot, function)
+            setattr(pywikibot, function, self.recorder(function))
+        return self.lines
+
+    def __exit__(self, *args):
+        for function, original in self.original.iteritems():
+            setattr(pywikibot, function, original)
+
+    def recorder(self, function):
+        return lambda text: self.lines.append((function, text))